@@ -127,6 +127,7 @@ class AddonManager:
             self.invoke_addon(a, "done")
         self.lookup = {}
         self.chain = []
+        self.master.log.invalidate()
 
     def get(self, name):
         """
@@ -160,6 +161,7 @@ class AddonManager:
         for a in traverse([addon]):
             self.master.commands.collect_commands(a)
         self.master.options.process_deferred()
+        self.master.log.invalidate()
         return addon
 
     def add(self, *addons):
@@ -185,6 +187,7 @@ class AddonManager:
             self.chain = [i for i in self.chain if i is not a]
             del self.lookup[_get_name(a)]
         self.invoke_addon(addon, "done")
+        self.master.log.invalidate()
 
     def __len__(self):
         return len(self.chain)
@@ -9,6 +9,7 @@ from mitmproxy.addons import core
 from mitmproxy.addons import cut
 from mitmproxy.addons import disable_h2c
 from mitmproxy.addons import export
+from mitmproxy.addons import loadtest
 from mitmproxy.addons import onboarding
 from mitmproxy.addons import proxyauth
 from mitmproxy.addons import script
@@ -37,6 +38,7 @@ def default_addons():
         cut.Cut(),
         disable_h2c.DisableH2C(),
         export.Export(),
+        loadtest.LoadTest(),
         onboarding.Onboarding(),
         proxyauth.ProxyAuth(),
         script.ScriptLoader(),
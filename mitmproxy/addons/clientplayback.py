@@ -21,6 +21,108 @@ from mitmproxy.net.http.url import hostport
 from mitmproxy.utils import human
 
 
+class ConnectionPool:
+    """
+        Idle keep-alive server connections, keyed by origin.
+    """
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.idle: typing.Dict[typing.Hashable, typing.List[connections.ServerConnection]] = {}
+
+    def get(self, key) -> typing.Optional[connections.ServerConnection]:
+        with self.lock:
+            conns = self.idle.get(key)
+            while conns:
+                server = conns.pop()
+                if server.connected():
+                    return server
+        return None
+
+    def put(self, key, server: connections.ServerConnection, limit: int) -> None:
+        with self.lock:
+            conns = self.idle.setdefault(key, [])
+            if len(conns) < limit:
+                conns.append(server)
+                return
+        close_connection(server)
+
+    def clear(self) -> None:
+        with self.lock:
+            idle, self.idle = self.idle, {}
+        for conns in idle.values():
+            for server in conns:
+                close_connection(server)
+
+
+def close_connection(server: connections.ServerConnection) -> None:
+    if server.connected():
+        server.finish()
+        server.close()
+
+
+class Pacer:
+    """
+        Spaces out requests to a target rate, shared by all replay threads.
+    """
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.next_slot = 0.0
+
+    def wait(self, rps: int) -> None:
+        if rps <= 0:
+            return
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + 1 / rps
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def connect(opts: options.Options, f, bsl) -> connections.ServerConnection:  # pragma: no cover
+    """
+        Open a connection to the server of the flow, through the upstream proxy
+        in upstream mode.
+    """
+    r = f.request
+    if opts.mode.startswith("upstream:"):
+        server_address = server_spec.parse_with_mode(opts.mode)[
+            1].address
+        server = connections.ServerConnection(server_address)
+        server.connect()
+        if r.scheme == "https":
+            connect_request = http.make_connect_request(
+                (r.data.host, r.port))
+            server.wfile.write(
+                http1.assemble_request(connect_request))
+            server.wfile.flush()
+            resp = http1.read_response(
+                server.rfile,
+                connect_request,
+                body_size_limit=bsl
+            )
+            if resp.status_code != 200:
+                raise exceptions.ReplayException(
+                    "Upstream server refuses CONNECT request"
+                )
+            server.establish_tls(
+                sni=f.server_conn.sni,
+                **tls.client_arguments_from_options(opts)
+            )
+    else:
+        server_address = (r.host, r.port)
+        server = connections.ServerConnection(server_address)
+        server.connect()
+        if r.scheme == "https":
+            server.establish_tls(
+                sni=f.server_conn.sni,
+                **tls.client_arguments_from_options(opts)
+            )
+    return server
+
+
 class RequestReplayThread(basethread.BaseThread):
     daemon = True
 
@@ -29,19 +131,42 @@ class RequestReplayThread(basethread.BaseThread):
             opts: options.Options,
             channel: controller.Channel,
             queue: queue.Queue,
+            playback: "ClientPlayback",
     ) -> None:
         self.options = opts
         self.channel = channel
         self.queue = queue
+        self.playback = playback
         self.inflight = threading.Event()
+        self.should_exit = threading.Event()
         super().__init__("RequestReplayThread")
 
     def run(self):
-        while True:
-            f = self.queue.get()
+        while not self.should_exit.is_set():
+            try:
+                f, due = self.queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
             self.inflight.set()
-            self.replay(f)
-            self.inflight.clear()
+            try:
+                if due is not None:
+                    delay = due - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                else:
+                    self.playback.pacer.wait(self.options.client_replay_rps)
+                self.replay(f)
+            finally:
+                self.inflight.clear()
+
+    def connect(self, f, bsl) -> connections.ServerConnection:  # pragma: no cover
+        return connect(self.options, f, bsl)
+
+    def send(self, server, r, bsl):  # pragma: no cover
+        server.wfile.write(http1.assemble_request(r))
+        server.wfile.flush()
+        r.timestamp_start = r.timestamp_end = time.time()
+        return http1.read_response(server.rfile, r, body_size_limit=bsl)
 
     def replay(self, f):  # pragma: no cover
         f.live = True
@@ -49,6 +174,8 @@ class RequestReplayThread(basethread.BaseThread):
         bsl = human.parse_size(self.options.body_size_limit)
         authority_backup = r.authority
         server = None
+        key = None
+        reusable = False
         try:
             f.response = None
 
@@ -59,77 +186,67 @@ class RequestReplayThread(basethread.BaseThread):
 
             if not f.response:
                 # In all modes, we directly connect to the server displayed
-                if self.options.mode.startswith("upstream:"):
-                    server_address = server_spec.parse_with_mode(self.options.mode)[
-                        1].address
-                    server = connections.ServerConnection(server_address)
-                    server.connect()
-                    if r.scheme == "https":
-                        connect_request = http.make_connect_request(
-                            (r.data.host, r.port))
-                        server.wfile.write(
-                            http1.assemble_request(connect_request))
-                        server.wfile.flush()
-                        resp = http1.read_response(
-                            server.rfile,
-                            connect_request,
-                            body_size_limit=bsl
-                        )
-                        if resp.status_code != 200:
-                            raise exceptions.ReplayException(
-                                "Upstream server refuses CONNECT request"
-                            )
-                        server.establish_tls(
-                            sni=f.server_conn.sni,
-                            **tls.client_arguments_from_options(self.options)
-                        )
-                        r.authority = b""
-                    else:
-                        r.authority = hostport(r.scheme, r.host, r.port)
+                upstream = self.options.mode.startswith("upstream:")
+                if upstream and r.scheme != "https":
+                    r.authority = hostport(r.scheme, r.host, r.port)
                 else:
-                    server_address = (r.host, r.port)
-                    server = connections.ServerConnection(server_address)
-                    server.connect()
-                    if r.scheme == "https":
-                        server.establish_tls(
-                            sni=f.server_conn.sni,
-                            **tls.client_arguments_from_options(self.options)
-                        )
                     r.authority = ""
-
-                server.wfile.write(http1.assemble_request(r))
-                server.wfile.flush()
-                r.timestamp_start = r.timestamp_end = time.time()
-
-                if f.server_conn:
-                    f.server_conn.close()
+                key = (
+                    self.options.mode if upstream else None,
+                    r.scheme, r.host, r.port, f.server_conn.sni,
+                )
+                server = self.playback.pool.get(key)
+                if server is not None:
+                    try:
+                        f.response = self.send(server, r, bsl)
+                    except exceptions.NetlibException:
+                        # The server has closed the idle connection.
+                        close_connection(server)
+                        server = None
+                if server is None:
+                    server = self.connect(f, bsl)
+                    f.response = self.send(server, r, bsl)
                 f.server_conn = server
-
-                f.response = http1.read_response(
-                    server.rfile, r, body_size_limit=bsl)
+                reusable = not (
+                    http1.connection_close(r.http_version, r.headers) or
+                    http1.connection_close(f.response.http_version, f.response.headers) or
+                    http1.expected_http_body_size(r, f.response) == -1
+                )
             response_reply = self.channel.ask("response", f)
             if response_reply == exceptions.Kill:
                 raise exceptions.Kill()
+            self.playback.finished(True)
         except (exceptions.ReplayException, exceptions.NetlibException) as e:
             f.error = flow.Error(str(e))
+            self.playback.finished(False)
             self.channel.ask("error", f)
         except exceptions.Kill:
+            self.playback.finished(False)
             self.channel.tell("log", log.LogEntry(
                 flow.Error.KILLED_MESSAGE, "info"))
         except Exception as e:
+            self.playback.finished(False)
             self.channel.tell("log", log.LogEntry(repr(e), "error"))
         finally:
             r.authority = authority_backup
             f.live = False
-            if server and server.connected():
-                server.finish()
-                server.close()
+            if server:
+                if reusable and server.connected():
+                    self.playback.pool.put(key, server, self.options.client_replay_concurrency)
+                else:
+                    close_connection(server)
 
 
 class ClientPlayback:
     def __init__(self):
         self.q = queue.Queue()
-        self.thread: RequestReplayThread = None
+        self.threads: typing.List[RequestReplayThread] = []
+        self.pool = ConnectionPool()
+        self.pacer = Pacer()
+        self.lock = threading.Lock()
+        self.completed = 0
+        self.failed = 0
+        self.is_running = False
 
     def check(self, f: flow.Flow):
         return None
@@ -150,16 +267,62 @@ class ClientPlayback:
             "client_replay", typing.Sequence[str], [],
             "Replay client requests from a saved file."
         )
+        loader.add_option(
+            "client_replay_concurrency", int, 1,
+            """
+            Number of requests replayed in parallel. Connections to the same
+            origin are kept alive and reused between requests.
+            """
+        )
+        loader.add_option(
+            "client_replay_timing", bool, False,
+            """
+            Keep the original time between requests when replaying. Requests
+            are sent in the order they were recorded.
+            """
+        )
+        loader.add_option(
+            "client_replay_rps", int, 0,
+            """
+            Limit client replay to this many requests per second. 0 means no
+            limit. Ignored when client_replay_timing is set.
+            """
+        )
 
     def running(self):
-        self.thread = RequestReplayThread(
-            ctx.options,
-            ctx.master.channel,
-            self.q,
-        )
-        self.thread.start()
+        self.is_running = True
+        self.resize(ctx.options.client_replay_concurrency)
+
+    def done(self):
+        for t in self.threads:
+            t.should_exit.set()
+        self.threads = []
+        self.pool.clear()
+
+    def resize(self, n: int) -> None:
+        """
+            Start or stop replay threads so that n of them are running.
+        """
+        while len(self.threads) < n:
+            t = RequestReplayThread(
+                ctx.options,
+                ctx.master.channel,
+                self.q,
+                self,
+            )
+            t.start()
+            self.threads.append(t)
+        while len(self.threads) > n:
+            self.threads.pop().should_exit.set()
 
     def configure(self, updated):
+        if "client_replay_concurrency" in updated:
+            if ctx.options.client_replay_concurrency < 1:
+                raise exceptions.OptionsError("client_replay_concurrency must be at least 1.")
+            if self.is_running:
+                self.resize(ctx.options.client_replay_concurrency)
+        if "client_replay_rps" in updated and ctx.options.client_replay_rps < 0:
+            raise exceptions.OptionsError("client_replay_rps must not be negative.")
         if "client_replay" in updated and ctx.options.client_replay:
             try:
                 flows = io.read_flows_from_paths(ctx.options.client_replay)
@@ -167,21 +330,37 @@ class ClientPlayback:
                 raise exceptions.OptionsError(str(e))
             self.start_replay(flows)
 
+    def finished(self, ok: bool) -> None:
+        with self.lock:
+            if ok:
+                self.completed += 1
+            else:
+                self.failed += 1
+
     @command.command("replay.client.count")
     def count(self) -> int:
         """
             Approximate number of flows queued for replay.
         """
-        inflight = 1 if self.thread and self.thread.inflight.is_set() else 0
+        inflight = sum(1 for t in self.threads if t.inflight.is_set())
         return self.q.qsize() + inflight
 
+    @command.command("replay.client.progress")
+    def progress(self) -> str:
+        """
+            Number of replayed, failed and pending flows.
+        """
+        return "{} replayed, {} failed, {} pending".format(
+            self.completed, self.failed, self.count()
+        )
+
     @command.command("replay.client.stop")
     def stop_replay(self) -> None:
         """
             Clear the replay queue.
         """
         with self.q.mutex:
-            lst = list(self.q.queue)
+            lst = [f for f, _ in self.q.queue]
             self.q.queue.clear()
             for f in lst:
                 f.revert()
@@ -215,7 +394,15 @@ class ClientPlayback:
                 host = hf.request.host
                 if host is not None:
                     hf.request.headers.insert(0, "host", host)
-            self.q.put(hf)
+        if ctx.options.client_replay_timing and lst:
+            lst.sort(key=lambda f: f.request.timestamp_start or 0)
+            first = lst[0].request.timestamp_start or 0
+            start = time.monotonic()
+            for hf in lst:
+                self.q.put((hf, start + max((hf.request.timestamp_start or 0) - first, 0)))
+        else:
+            for hf in lst:
+                self.q.put((hf, None))
         ctx.master.addons.trigger("update", lst)
 
     @command.command("replay.client.file")
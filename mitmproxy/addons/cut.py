@@ -1,6 +1,7 @@
 import io
 import csv
 import typing
+import functools
 import os.path
 
 from mitmproxy import command
@@ -8,6 +9,11 @@ from mitmproxy import exceptions
 from mitmproxy import flow
 from mitmproxy import ctx
 from mitmproxy import certs
+from mitmproxy.addons.session import SessionDB
+from mitmproxy.io import FlowReader
+from mitmproxy.io import MappedDump
+from mitmproxy.io import columnar
+from mitmproxy.io.io import FLOW_TYPES
 from mitmproxy.utils import strutils
 import mitmproxy.types
 
@@ -24,31 +30,67 @@ def is_addr(v):
     return isinstance(v, tuple) and len(v) > 1
 
 
+# Cuts that can be read from the summary columns of a session database
+# without loading the flows.
+summary_cuts = {
+    "id": "id",
+    "request.timestamp_start": "timestamp",
+    "request.method": "method",
+    "request.url": "url",
+    "request.host": "host",
+    "request.pretty_host": "pretty_host",
+    "request.pretty_url": "pretty_url",
+    "response.status_code": "status_code",
+    "request.header[content-type]": "request_content_type",
+    "response.header[content-type]": "response_content_type",
+}
+
+
 def extract(cut: str, f: flow.Flow) -> typing.Union[str, bytes]:
+    return compile_cut(cut)(f)
+
+
+@functools.lru_cache(maxsize=256)
+def compile_cut(cut: str) -> typing.Callable[[flow.Flow], typing.Union[str, bytes]]:
+    """
+        Parse a cut specification once, returning a function that extracts
+        it from a flow.
+    """
     path = cut.split(".")
-    current: typing.Any = f
-    for i, spec in enumerate(path):
+    for spec in path:
         if spec.startswith("_"):
             raise exceptions.CommandError("Can't access internal attribute %s" % spec)
+    parents, last = path[:-1], path[-1]
+
+    if last.startswith("header["):
+        name = headername(last)
 
-        part = getattr(current, spec, None)
-        if i == len(path) - 1:
-            if spec == "port" and is_addr(current):
-                return str(current[1])
-            if spec == "host" and is_addr(current):
-                return str(current[0])
-            elif spec.startswith("header["):
-                if not current:
-                    return ""
-                return current.headers.get(headername(spec), "")
-            elif isinstance(part, bytes):
-                return part
-            elif isinstance(part, bool):
-                return "true" if part else "false"
-            elif isinstance(part, certs.Cert):
-                return part.to_pem().decode("ascii")
-        current = part
-    return str(current or "")
+        def get_header(f: flow.Flow) -> typing.Union[str, bytes]:
+            current: typing.Any = f
+            for spec in parents:
+                current = getattr(current, spec, None)
+            if not current:
+                return ""
+            return current.headers.get(name, "")
+        return get_header
+
+    def get(f: flow.Flow) -> typing.Union[str, bytes]:
+        current: typing.Any = f
+        for spec in parents:
+            current = getattr(current, spec, None)
+        if last == "port" and is_addr(current):
+            return str(current[1])
+        if last == "host" and is_addr(current):
+            return str(current[0])
+        part = getattr(current, last, None)
+        if isinstance(part, bytes):
+            return part
+        elif isinstance(part, bool):
+            return "true" if part else "false"
+        elif isinstance(part, certs.Cert):
+            return part.to_pem().decode("ascii")
+        return str(part or "")
+    return get
 
 
 class Cut:
@@ -67,9 +109,10 @@ class Cut:
             or "false", "bytes" are preserved, and all other values are
             converted to strings.
         """
+        getters = [compile_cut(c) for c in cuts]
         ret: typing.List[typing.List[typing.Union[str, bytes]]] = []
         for f in flows:
-            ret.append([extract(c, f) for c in cuts])
+            ret.append([get(f) for get in getters])
         return ret  # type: ignore
 
     @command.command("cut.save")
@@ -106,8 +149,9 @@ class Cut:
             else:
                 with open(path, "a" if append else "w", newline='', encoding="utf8") as fp:
                     writer = csv.writer(fp)
+                    getters = [compile_cut(c) for c in cuts]
                     for f in flows:
-                        vals = [extract(c, f) for c in cuts]
+                        vals = [get(f) for get in getters]
                         writer.writerow(
                             [strutils.always_str(x) or "" for x in vals]  # type: ignore
                         )
@@ -115,6 +159,96 @@ class Cut:
         except OSError as e:
             ctx.log.error(str(e))
 
+    @command.command("cut.export")
+    def export(
+        self,
+        flows: typing.Sequence[flow.Flow],
+        cuts: mitmproxy.types.CutSpec,
+        path: mitmproxy.types.Path
+    ) -> None:
+        """
+            Export cuts of a set of flows to file, written as they are
+            extracted. Paths ending in .csv get the CSV format of cut.save,
+            all others a columnar file (see mitmproxy.io.columnar), which
+            stores repeated values such as hosts and paths only once.
+        """
+        getters = [compile_cut(c) for c in cuts]
+        rows = (tuple(get(f) for get in getters) for f in flows)
+        self._export(rows, cuts, path)
+
+    @command.command("cut.export.file")
+    def export_file(
+        self,
+        source: mitmproxy.types.Path,
+        cuts: mitmproxy.types.CutSpec,
+        path: mitmproxy.types.Path
+    ) -> None:
+        """
+            Like cut.export, for all flows in a flow file or a session
+            database, which are read one at a time instead of being loaded.
+            Cuts of a session database that are all stored as summary
+            columns, such as request.host or response.status_code, are
+            read without loading the flows at all.
+        """
+        source = os.path.expanduser(source)
+        try:
+            if SessionDB.is_session_db(source):
+                self._export(self._session_rows(SessionDB(source), cuts), cuts, path)
+            else:
+                getters = [compile_cut(c) for c in cuts]
+                attrs = {c.split(".")[0] for c in cuts}
+                if all(any(a in t._stateobject_attributes for t in FLOW_TYPES.values()) for a in attrs):
+                    # Only decode the attributes the cuts start with.
+                    dump = MappedDump(source)
+                    try:
+                        rows = (tuple(get(f) for get in getters) for f in dump.partial_flows(attrs))
+                        self._export(rows, cuts, path)
+                    finally:
+                        dump.close()
+                else:
+                    with open(source, "rb") as fp:
+                        rows = (tuple(get(f) for get in getters) for f in FlowReader(fp).stream())
+                        self._export(rows, cuts, path)
+        except (OSError, exceptions.FlowReadException) as e:
+            ctx.log.error(str(e))
+
+    def _session_rows(self, db: SessionDB, cuts: typing.Sequence[str]) -> typing.Iterator[tuple]:
+        if all(c in summary_cuts for c in cuts):
+            for row in db.retrieve_columns([summary_cuts[c] for c in cuts]):
+                # Same conversion as in extract(), which turns None and 0 into "".
+                yield tuple(str(v or "") for v in row)
+        else:
+            getters = [compile_cut(c) for c in cuts]
+            for f in db.iter_flows():
+                yield tuple(get(f) for get in getters)
+
+    def _export(
+        self,
+        rows: typing.Iterable[typing.Sequence[typing.Union[str, bytes]]],
+        cuts: typing.Sequence[str],
+        path: str
+    ) -> None:
+        path = os.path.expanduser(path)
+        count = 0
+        try:
+            if path.endswith(".csv"):
+                with open(path, "w", newline='', encoding="utf8") as fp:
+                    writer = csv.writer(fp)
+                    for row in rows:
+                        writer.writerow([strutils.always_str(x) or "" for x in row])  # type: ignore
+                        count += 1
+            else:
+                with open(path, "wb") as fp:
+                    w = columnar.ColumnWriter(fp, cuts)
+                    for row in rows:
+                        w.add(row)
+                        count += 1
+                    w.flush()
+        except OSError as e:
+            ctx.log.error(str(e))
+            return
+        ctx.log.alert("Exported %s cuts over %d flows." % (len(cuts), count))
+
     @command.command("cut.clip")
     def clip(
         self,
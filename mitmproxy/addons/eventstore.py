@@ -4,6 +4,8 @@ import typing  # noqa
 import blinker
 
 from mitmproxy import command
+from mitmproxy import ctx
+from mitmproxy import log
 from mitmproxy.log import LogEntry
 
 
@@ -12,12 +14,26 @@ class EventStore:
         self.data: typing.Deque[LogEntry] = collections.deque(maxlen=size)
         self.sig_add = blinker.Signal()
         self.sig_refresh = blinker.Signal()
+        self.log_verbosity = "debug"
+
+    def load(self, loader):
+        loader.add_option(
+            "eventstore_verbosity", str, "debug",
+            "Event log verbosity. Entries below this level are not stored.",
+            choices=log.LogTierOrder
+        )
+
+    def configure(self, updated):
+        if "eventstore_verbosity" in updated:
+            self.log_verbosity = ctx.options.eventstore_verbosity
 
     @property
     def size(self) -> typing.Optional[int]:
         return self.data.maxlen
 
     def log(self, entry: LogEntry) -> None:
+        if log.log_tier(entry.level) > log.log_tier(self.log_verbosity):
+            return
         self.data.append(entry)
         self.sig_add.send(self, entry=entry)
 
@@ -7,9 +7,9 @@ class KeepServing:
         loader.add_option(
             "keepserving", bool, False,
             """
-            Continue serving after client playback, server playback or file
-            read. This option is ignored by interactive tools, which always keep
-            serving.
+            Continue serving after client playback, server playback, load test
+            or file read. This option is ignored by interactive tools, which
+            always keep serving.
             """
         )
 
@@ -18,6 +18,7 @@ class KeepServing:
             "readfile.reading",
             "replay.client.count",
             "replay.server.count",
+            "loadtest.active",
         ]
         return any([ctx.master.commands.call(c) for c in checks])
 
@@ -35,6 +36,7 @@ class KeepServing:
             ctx.options.client_replay,
             ctx.options.server_replay,
             ctx.options.rfile,
+            ctx.options.load_test,
         ]
         if any(opts) and not ctx.options.keepserving:
             asyncio.get_event_loop().create_task(self.watch())
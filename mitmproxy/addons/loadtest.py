@@ -0,0 +1,424 @@
+import asyncio
+import collections
+import json
+import math
+import threading
+import time
+import typing
+
+import mitmproxy.types
+from mitmproxy import command
+from mitmproxy import connections
+from mitmproxy import ctx
+from mitmproxy import exceptions
+from mitmproxy import flow
+from mitmproxy import http
+from mitmproxy import io
+from mitmproxy import options
+from mitmproxy.addons import clientplayback
+from mitmproxy.coretypes import basethread
+from mitmproxy.net.http import http1
+from mitmproxy.net.http.url import hostport
+from mitmproxy.utils import human
+from mitmproxy.utils.histogram import Histogram
+
+PERCENTILES = (("p50", 50), ("p90", 90), ("p99", 99), ("p999", 99.9))
+
+
+class Prepared(typing.NamedTuple):
+    flow: http.HTTPFlow
+    request: http.HTTPRequest
+    data: bytes
+    key: typing.Hashable
+
+
+def prepare(opts: options.Options, f: http.HTTPFlow) -> Prepared:
+    """
+        Assemble the request of a flow once, so that workers only need to
+        write it out.
+    """
+    r = f.request.copy()
+    if r.http_version == "HTTP/2.0":
+        r.http_version = "HTTP/1.1"
+        r.headers.pop(":authority", None)
+        if "host" not in r.headers:
+            r.headers.insert(0, "host", r.host)
+    if opts.mode.startswith("upstream:") and r.scheme != "https":
+        r.authority = hostport(r.scheme, r.host, r.port)
+    else:
+        r.authority = ""
+    key = (r.scheme, r.host, r.port, f.server_conn.sni)
+    return Prepared(f, r, http1.assemble_request(r), key)
+
+
+class Schedule:
+    """
+        Hands out send times to the workers of a load test.
+
+        With a target rate, request n is due at a fixed offset from the start,
+        independent of how long earlier requests took. If the rate ramps up,
+        it rises linearly from zero to the target over the ramp period.
+        Without a target rate, requests are due as soon as a worker is free.
+    """
+
+    def __init__(self, rps: int, ramp: int, duration: int, total: int) -> None:
+        self.rps = rps
+        self.ramp = ramp
+        self.duration = duration
+        self.total = total
+        self.lock = threading.Lock()
+        self.n = 0
+        self.start = time.monotonic()
+        self.stopped = False
+
+    def offset(self, n: int) -> float:
+        if self.ramp:
+            ramp_requests = self.rps * self.ramp / 2
+            if n < ramp_requests:
+                return math.sqrt(2 * self.ramp * n / self.rps)
+            return self.ramp + (n - ramp_requests) / self.rps
+        return n / self.rps
+
+    def next(self) -> typing.Optional[typing.Tuple[int, float]]:
+        with self.lock:
+            if self.stopped:
+                return None
+            n = self.n
+            if not self.duration and n >= self.total:
+                return None
+            now = time.monotonic()
+            if self.rps:
+                due = self.start + self.offset(n)
+            else:
+                due = now
+            if self.duration and max(due, now) - self.start >= self.duration:
+                return None
+            self.n += 1
+        return n, due
+
+    def stop(self) -> None:
+        with self.lock:
+            self.stopped = True
+
+
+class LoadWorker(basethread.BaseThread):
+    """
+        Sends requests over its own keep-alive connections and records the
+        results. Latency is measured from the time a request was due, so that
+        a slow server does not hide the requests that queued up behind it.
+        The service time is measured from the time it was actually sent.
+    """
+    daemon = True
+
+    def __init__(self, opts: options.Options, requests: typing.Sequence[Prepared], schedule: Schedule) -> None:
+        self.options = opts
+        self.requests = requests
+        self.schedule = schedule
+        self.connections: typing.Dict[typing.Hashable, connections.ServerConnection] = {}
+        self.latency = Histogram()
+        self.service = Histogram()
+        self.status: typing.Counter[int] = collections.Counter()
+        self.errors: typing.Counter[str] = collections.Counter()
+        self.completed = 0
+        self.failed = 0
+        self.bytes = 0
+        self.ended: typing.Optional[float] = None
+        super().__init__("LoadWorker")
+
+    def run(self):
+        bsl = human.parse_size(self.options.body_size_limit)
+        try:
+            while True:
+                slot = self.schedule.next()
+                if slot is None:
+                    break
+                n, due = slot
+                delay = due - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                self.send(self.requests[n % len(self.requests)], due, bsl)
+        finally:
+            self.ended = time.time()
+            for server in self.connections.values():
+                clientplayback.close_connection(server)
+            self.connections.clear()
+
+    def exchange(self, server, p: Prepared, bsl) -> http.HTTPResponse:  # pragma: no cover
+        server.wfile.write(p.data)
+        server.wfile.flush()
+        return http1.read_response(server.rfile, p.request, body_size_limit=bsl)
+
+    def send(self, p: Prepared, due: float, bsl) -> None:  # pragma: no cover
+        start = time.monotonic()
+        server = self.connections.pop(p.key, None)
+        try:
+            response = None
+            if server is not None:
+                try:
+                    response = self.exchange(server, p, bsl)
+                except exceptions.NetlibException:
+                    # The server has closed the idle connection.
+                    clientplayback.close_connection(server)
+                    server = None
+            if server is None:
+                server = clientplayback.connect(self.options, p.flow, bsl)
+                response = self.exchange(server, p, bsl)
+        except (exceptions.ReplayException, exceptions.NetlibException) as e:
+            self.errors[type(e).__name__] += 1
+            self.failed += 1
+            if server:
+                clientplayback.close_connection(server)
+            return
+        end = time.monotonic()
+        self.latency.record((end - due) * 1e6)
+        self.service.record((end - start) * 1e6)
+        self.status[response.status_code] += 1
+        self.bytes += len(response.raw_content or b"")
+        self.completed += 1
+        reusable = not (
+            http1.connection_close(p.request.http_version, p.request.headers) or
+            http1.connection_close(response.http_version, response.headers) or
+            http1.expected_http_body_size(p.request, response) == -1
+        )
+        if reusable and server.connected():
+            self.connections[p.key] = server
+        else:
+            clientplayback.close_connection(server)
+
+
+def summarize(h: Histogram) -> dict:
+    """
+        Percentiles of a histogram of microseconds, in milliseconds.
+    """
+    ret = {
+        "min": (h.min or 0) / 1000,
+        "mean": round(h.mean / 1000, 3),
+    }
+    for name, p in PERCENTILES:
+        ret[name] = h.percentile(p) / 1000
+    ret["max"] = (h.max or 0) / 1000
+    ret["buckets"] = [[v / 1000, n] for v, n in h.buckets()]
+    return ret
+
+
+class LoadTest:
+    # Progress is logged this often while a load test is running.
+    PROGRESS_INTERVAL = 1
+    # Seconds to wait for requests in flight when shutting down.
+    STOP_TIMEOUT = 5
+
+    def __init__(self):
+        self.workers: typing.List[LoadWorker] = []
+        self.schedule: typing.Optional[Schedule] = None
+        self.flows = 0
+        self.started = 0.0
+        self.finished: typing.Optional[float] = None
+        self.pending: typing.Optional[typing.Sequence[flow.Flow]] = None
+        self.is_running = False
+
+    def load(self, loader):
+        loader.add_option(
+            "load_test", typing.Sequence[str], [],
+            """
+            Run a load test with the requests from saved flow files. Requests
+            are sent directly to the servers and are not passed to other
+            addons.
+            """
+        )
+        loader.add_option(
+            "load_test_rps", int, 0,
+            """
+            Target request rate of a load test. 0 sends requests as fast as
+            the workers can.
+            """
+        )
+        loader.add_option(
+            "load_test_ramp", int, 0,
+            """
+            Seconds over which the request rate of a load test rises linearly
+            from zero to load_test_rps.
+            """
+        )
+        loader.add_option(
+            "load_test_duration", int, 0,
+            """
+            Seconds to run a load test for, cycling through the flows. 0 sends
+            every flow once.
+            """
+        )
+        loader.add_option(
+            "load_test_concurrency", int, 1,
+            """
+            Number of workers of a load test. Each worker keeps its own
+            connection to every server.
+            """
+        )
+        loader.add_option(
+            "load_test_report", typing.Optional[str], None,
+            "Write the results of a load test to this file as JSON."
+        )
+
+    def configure(self, updated):
+        for name in ("load_test_rps", "load_test_ramp", "load_test_duration"):
+            if name in updated and getattr(ctx.options, name) < 0:
+                raise exceptions.OptionsError(f"{name} must not be negative.")
+        if "load_test_concurrency" in updated and ctx.options.load_test_concurrency < 1:
+            raise exceptions.OptionsError("load_test_concurrency must be at least 1.")
+        if ctx.options.load_test_ramp and not ctx.options.load_test_rps:
+            raise exceptions.OptionsError("load_test_ramp requires load_test_rps.")
+        if "load_test" in updated and ctx.options.load_test:
+            try:
+                flows = io.read_flows_from_paths(ctx.options.load_test)
+            except exceptions.FlowReadException as e:
+                raise exceptions.OptionsError(str(e))
+            if self.is_running:
+                self.start(flows)
+            else:
+                self.pending = flows
+
+    def running(self):
+        self.is_running = True
+        if self.pending:
+            flows, self.pending = self.pending, None
+            self.start(flows)
+
+    def done(self):
+        if self.active():
+            self.stop()
+            for w in self.workers:
+                w.join(self.STOP_TIMEOUT)
+            self.finish()
+
+    @command.command("loadtest.start")
+    def start(self, flows: typing.Sequence[flow.Flow]) -> None:
+        """
+            Start a load test with the requests of the given flows, as
+            configured by the load_test_* options.
+        """
+        if self.active():
+            raise exceptions.CommandError("A load test is already running.")
+        requests = [
+            prepare(ctx.options, f) for f in flows
+            if isinstance(f, http.HTTPFlow) and f.request
+        ]
+        if not requests:
+            raise exceptions.CommandError("No HTTP requests to send.")
+        self.flows = len(requests)
+        self.schedule = Schedule(
+            ctx.options.load_test_rps,
+            ctx.options.load_test_ramp,
+            ctx.options.load_test_duration,
+            len(requests),
+        )
+        self.started = time.time()
+        self.finished = None
+        self.workers = [
+            LoadWorker(ctx.options, requests, self.schedule)
+            for _ in range(ctx.options.load_test_concurrency)
+        ]
+        for w in self.workers:
+            w.start()
+        ctx.log.info("Load test started with {} requests and {} workers.".format(
+            len(requests), len(self.workers)
+        ))
+        asyncio.get_event_loop().create_task(self.watch())
+
+    @command.command("loadtest.stop")
+    def stop(self) -> None:
+        """
+            Stop the running load test after the requests in flight.
+        """
+        if self.schedule:
+            self.schedule.stop()
+
+    @command.command("loadtest.active")
+    def active(self) -> bool:
+        """
+            Is a load test running?
+        """
+        return bool(self.workers) and self.finished is None
+
+    async def watch(self):
+        workers = self.workers
+        last = 0
+        while any(w.is_alive() for w in workers):
+            await asyncio.sleep(self.PROGRESS_INTERVAL)
+            completed = sum(w.completed for w in workers)
+            failed = sum(w.failed for w in workers)
+            ctx.log.info("Load test: {} requests, {:.1f} req/s, {} errors".format(
+                completed + failed, (completed - last) / self.PROGRESS_INTERVAL, failed
+            ))
+            last = completed
+        if workers is self.workers and self.finished is None:
+            self.finish()
+
+    def finish(self) -> None:
+        self.finished = time.time()
+        results = self.results()
+        latency = results["latency"]
+        ctx.log.alert(
+            "Load test finished: {} requests in {:.1f}s ({:.1f} req/s), {} errors, "
+            "latency p50 {}ms p90 {}ms p99 {}ms p999 {}ms".format(
+                results["requests"], results["elapsed"], results["throughput"],
+                sum(results["errors"].values()),
+                latency["p50"], latency["p90"], latency["p99"], latency["p999"],
+            )
+        )
+        if ctx.options.load_test_report:
+            try:
+                self.write_report(ctx.options.load_test_report)
+            except exceptions.CommandError as e:
+                ctx.log.error(f"Cannot write load test results: {e}")
+
+    def results(self) -> dict:
+        latency = Histogram()
+        service = Histogram()
+        status: typing.Counter[int] = collections.Counter()
+        errors: typing.Counter[str] = collections.Counter()
+        completed = failed = received = 0
+        for w in self.workers:
+            latency.merge(w.latency)
+            service.merge(w.service)
+            status.update(w.status)
+            errors.update(w.errors)
+            completed += w.completed
+            failed += w.failed
+            received += w.bytes
+        ended = [w.ended for w in self.workers]
+        if None in ended:
+            elapsed = time.time() - self.started
+        else:
+            elapsed = max(ended) - self.started
+        return {
+            "config": {
+                "rps": ctx.options.load_test_rps,
+                "ramp": ctx.options.load_test_ramp,
+                "duration": ctx.options.load_test_duration,
+                "concurrency": len(self.workers),
+            },
+            "flows": self.flows,
+            "started": self.started,
+            "elapsed": round(elapsed, 3),
+            "requests": completed + failed,
+            "responses": completed,
+            "throughput": round(completed / elapsed, 1) if elapsed > 0 else 0.0,
+            "bytes": received,
+            "status": {str(k): v for k, v in sorted(status.items())},
+            "errors": dict(errors),
+            "latency": summarize(latency),
+            "service": summarize(service),
+        }
+
+    @command.command("loadtest.report")
+    def write_report(self, path: mitmproxy.types.Path) -> None:
+        """
+            Write the results of the last load test to a file as JSON.
+        """
+        if not self.workers:
+            raise exceptions.CommandError("No load test has been run.")
+        try:
+            with open(path, "w") as f:
+                json.dump(self.results(), f, indent=2)
+        except OSError as e:
+            raise exceptions.CommandError(str(e)) from e
+        ctx.log.alert(f"Load test results written to {path}.")
@@ -1,14 +1,20 @@
 import mimetypes
+import os
 import re
+import time
 import typing
 import urllib.parse
 from pathlib import Path
 
 from werkzeug.security import safe_join
 
-from mitmproxy import ctx, exceptions, flowfilter, http, version
+from mitmproxy import command, ctx, exceptions, flowfilter, http, version
+from mitmproxy.utils.ruletable import Rule, RuleTable
 from mitmproxy.utils.spec import parse_spec
 
+# Seconds between checks of the directories that cached lookups depend on.
+WATCH_INTERVAL = 1.0
+
 
 class MapLocalSpec(typing.NamedTuple):
     matches: flowfilter.TFilter
@@ -47,17 +53,23 @@ def _safe_path_join(root: Path, untrusted: str) -> Path:
     return Path(joined)
 
 
-def file_candidates(url: str, spec: MapLocalSpec) -> typing.List[Path]:
+def file_candidates(
+    url: str,
+    spec: MapLocalSpec,
+    regex: typing.Optional[typing.Pattern[str]] = None,
+) -> typing.List[Path]:
     """
     Get all potential file candidates given a URL and a mapping spec ordered by preference.
     This function already assumes that the spec regex matches the URL.
+    The compiled spec regex can be passed in as regex.
     """
-    m = re.search(spec.regex, url)
+    pattern = spec.regex if regex is None else regex
+    m = re.search(pattern, url)
     assert m
     if m.groups():
         suffix = m.group(1)
     else:
-        suffix = re.split(spec.regex, url, maxsplit=1)[1]
+        suffix = re.split(pattern, url, maxsplit=1)[1]
         suffix = suffix.split("?")[0]  # remove query string
         suffix = suffix.strip("/")
 
@@ -79,9 +91,98 @@ def file_candidates(url: str, spec: MapLocalSpec) -> typing.List[Path]:
         return [spec.local_path / "index.html"]
 
 
+def _mtime(path: Path) -> typing.Optional[int]:
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _watched_dir(path: Path) -> Path:
+    """
+    The directory that changes when the given file is created or removed:
+    its closest existing ancestor.
+    """
+    for parent in path.parents:
+        if parent.is_dir():
+            return parent
+    return path.parent
+
+
+class LocalFiles:
+    """
+        Caches the local file a rule maps a URL to, so that candidates are
+        not looked up on disk for every request.
+
+        Every lookup records the directories whose contents decide its
+        result. They are checked at most every WATCH_INTERVAL seconds, and
+        the cache is dropped as soon as one of them changed.
+    """
+
+    def __init__(self, max_entries: int = 4096) -> None:
+        self.max_entries = max_entries
+        self.entries: typing.Dict[
+            typing.Tuple[int, str],
+            typing.Tuple[typing.Optional[Path], typing.List[Path]]
+        ] = {}
+        self.dirs: typing.Dict[Path, typing.Optional[int]] = {}
+        self.checked = time.monotonic()
+
+    def clear(self) -> None:
+        self.entries.clear()
+        self.dirs.clear()
+
+    def check(self) -> None:
+        now = time.monotonic()
+        if now - self.checked < WATCH_INTERVAL:
+            return
+        self.checked = now
+        for path, mtime in self.dirs.items():
+            if _mtime(path) != mtime:
+                self.clear()
+                return
+
+    def get(
+        self,
+        rule: Rule[MapLocalSpec],
+        url: str,
+    ) -> typing.Tuple[typing.Optional[Path], typing.List[Path]]:
+        """
+            Returns the first existing file and all candidates.
+        """
+        self.check()
+        key = (rule.index, url)
+        ret = self.entries.get(key)
+        if ret is not None:
+            return ret
+
+        spec = rule.spec
+        if spec.local_path.is_file():
+            candidates = [spec.local_path]
+        else:
+            candidates = file_candidates(url, spec, rule.url)
+        if len(self.entries) >= self.max_entries:
+            self.clear()
+        # Record the directories before looking at the candidates, so that
+        # files created in between are not missed.
+        for path in [spec.local_path, *candidates]:
+            d = _watched_dir(path)
+            if d not in self.dirs:
+                self.dirs[d] = _mtime(d)
+
+        local_file = None
+        for candidate in candidates:
+            if candidate.is_file():
+                local_file = candidate
+                break
+        ret = self.entries[key] = (local_file, candidates)
+        return ret
+
+
 class MapLocal:
     def __init__(self):
-        self.replacements: typing.List[MapLocalSpec] = []
+        self.replacements: RuleTable[MapLocalSpec] = RuleTable()
+        self.files = LocalFiles()
 
     def load(self, loader):
         loader.add_option(
@@ -95,57 +196,58 @@ class MapLocal:
 
     def configure(self, updated):
         if "map_local" in updated:
-            self.replacements = []
+            entries = []
             for option in ctx.options.map_local:
                 try:
                     spec = parse_map_local_spec(option)
                 except ValueError as e:
                     raise exceptions.OptionsError(f"Cannot parse map_local option {option}: {e}") from e
 
-                self.replacements.append(spec)
+                entries.append((option, spec, re.compile(spec.regex)))
+            self.replacements = RuleTable(entries)
+            self.files = LocalFiles()
+
+    @command.command("maplocal.hits")
+    def hits(self) -> typing.Sequence[str]:
+        """
+            Number of requests each map_local rule matched.
+        """
+        return self.replacements.hit_counts()
 
     def request(self, flow: http.HTTPFlow) -> None:
         if flow.reply and flow.reply.has_message:
             return
+        if not self.replacements:
+            return
 
         url = flow.request.pretty_url
 
         all_candidates = []
-        for spec in self.replacements:
-            if spec.matches(flow) and re.search(spec.regex, url):
-                if spec.local_path.is_file():
-                    candidates = [spec.local_path]
-                else:
-                    candidates = file_candidates(url, spec)
-                all_candidates.extend(candidates)
-
-                local_file = None
-                for candidate in candidates:
-                    if candidate.is_file():
-                        local_file = candidate
-                        break
-
-                if local_file:
-                    headers = {
-                        "Server": version.MITMPROXY
-                    }
-                    mimetype = mimetypes.guess_type(str(local_file))[0]
-                    if mimetype:
-                        headers["Content-Type"] = mimetype
-
-                    try:
-                        contents = local_file.read_bytes()
-                    except OSError as e:
-                        ctx.log.warn(f"Could not read file: {e}")
-                        continue
-
-                    flow.response = http.HTTPResponse.make(
-                        200,
-                        contents,
-                        headers
-                    )
-                    # only set flow.response once, for the first matching rule
-                    return
+        for rule in self.replacements.matching(flow, url):
+            local_file, candidates = self.files.get(rule, url)
+            all_candidates.extend(candidates)
+
+            if local_file:
+                headers = {
+                    "Server": version.MITMPROXY
+                }
+                mimetype = mimetypes.guess_type(str(local_file))[0]
+                if mimetype:
+                    headers["Content-Type"] = mimetype
+
+                try:
+                    contents = local_file.read_bytes()
+                except OSError as e:
+                    ctx.log.warn(f"Could not read file: {e}")
+                    continue
+
+                flow.response = http.HTTPResponse.make(
+                    200,
+                    contents,
+                    headers
+                )
+                # only set flow.response once, for the first matching rule
+                return
         if all_candidates:
             flow.response = http.HTTPResponse.make(404)
             ctx.log.info(f"None of the local file candidates exist: {', '.join(str(x) for x in all_candidates)}")
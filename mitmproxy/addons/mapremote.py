@@ -1,7 +1,8 @@
 import re
 import typing
 
-from mitmproxy import ctx, exceptions, flowfilter, http
+from mitmproxy import command, ctx, exceptions, flowfilter, http
+from mitmproxy.utils.ruletable import RuleTable
 from mitmproxy.utils.spec import parse_spec
 
 
@@ -24,7 +25,7 @@ def parse_map_remote_spec(option: str) -> MapRemoteSpec:
 
 class MapRemote:
     def __init__(self):
-        self.replacements: typing.List[MapRemoteSpec] = []
+        self.replacements: RuleTable[MapRemoteSpec] = RuleTable()
 
     def load(self, loader):
         loader.add_option(
@@ -38,23 +39,38 @@ class MapRemote:
 
     def configure(self, updated):
         if "map_remote" in updated:
-            self.replacements = []
+            entries = []
             for option in ctx.options.map_remote:
                 try:
                     spec = parse_map_remote_spec(option)
                 except ValueError as e:
                     raise exceptions.OptionsError(f"Cannot parse map_remote option {option}: {e}") from e
 
-                self.replacements.append(spec)
+                entries.append((option, spec, re.compile(spec.subject)))
+            self.replacements = RuleTable(entries)
+
+    @command.command("mapremote.hits")
+    def hits(self) -> typing.Sequence[str]:
+        """
+            Number of requests each map_remote rule matched.
+        """
+        return self.replacements.hit_counts()
 
     def request(self, flow: http.HTTPFlow) -> None:
         if flow.reply and flow.reply.has_message:
             return
-        for spec in self.replacements:
-            if spec.matches(flow):
+        if not self.replacements:
+            return
+        url = flow.request.pretty_url
+        rules = self.replacements.matching(flow, url)
+        rule = next(rules, None)
+        while rule:
+            new_url = rule.url.sub(rule.spec.replacement, url)  # type: ignore
+            # this is a bit messy: setting .url also updates the host header,
+            # so we really only do that if the replacement affected the URL.
+            if url != new_url:
+                flow.request.url = new_url  # type: ignore
                 url = flow.request.pretty_url
-                new_url = re.sub(spec.subject, spec.replacement, url)
-                # this is a bit messy: setting .url also updates the host header,
-                # so we really only do that if the replacement affected the URL.
-                if url != new_url:
-                    flow.request.url = new_url  # type: ignore
+                # The remaining rules apply to the new URL.
+                rules = self.replacements.matching(flow, url, rule.index + 1)
+            rule = next(rules, None)
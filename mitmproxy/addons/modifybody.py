@@ -1,13 +1,162 @@
 import re
 import typing
 
-from mitmproxy import ctx, exceptions
+from mitmproxy import command, ctx, exceptions, http
 from mitmproxy.addons.modifyheaders import parse_modify_spec, ModifySpec
+from mitmproxy.net.http import encoding
+from mitmproxy.utils import human
+from mitmproxy.utils.ruletable import RuleTable
+
+Substitution = typing.Tuple[typing.Pattern[bytes], bytes]
+
+
+class Window:
+    """
+    Applies several regex substitutions to data that arrives in pieces, in a
+    single pass.
+
+    At every position the earliest match of any subject is replaced, the
+    first rule winning ties, and scanning continues behind the replaced
+    text. Matches are assumed to be no longer than max_match bytes: data is
+    passed on as soon as no match starting in it can reach past the data
+    received so far. The last max_match bytes passed on are kept as well, as
+    context for lookbehinds.
+    """
+
+    def __init__(self, substitutions: typing.Sequence[Substitution], max_match: int) -> None:
+        self.substitutions = substitutions
+        # Replacements without group references are used as they are.
+        self.literals = [None if b"\\" in repl else repl for _, repl in substitutions]
+        self.max_match = max_match
+        self.buf = b""
+        # Start of the data that has not been passed on yet.
+        self.pos = 0
+
+    def _replacement(self, m: typing.Match[bytes], i: int) -> bytes:
+        literal = self.literals[i]
+        if literal is None:
+            return m.expand(self.substitutions[i][1])
+        return literal
+
+    def feed(self, data: bytes, final: bool = False) -> bytes:
+        buf = self.buf + data
+        # Matches starting behind limit may change with more data.
+        limit = len(buf) if final else len(buf) - self.max_match
+        out: typing.List[bytes] = []
+        if len(self.substitutions) == 1:
+            pos = self._feed_one(buf, self.pos, limit, out)
+        else:
+            pos = self._feed_many(buf, self.pos, limit, out)
+        if pos < limit:
+            out.append(buf[pos:limit])
+            pos = limit
+        cut = max(0, pos - self.max_match)
+        self.buf = buf[cut:]
+        self.pos = pos - cut
+        return b"".join(out)
+
+    def _feed_one(self, buf: bytes, pos: int, limit: int, out: typing.List[bytes]) -> int:
+        subject = self.substitutions[0][0]
+        append = out.append
+        while True:
+            for m in subject.finditer(buf, pos):
+                start, end = m.span()
+                if start > limit:
+                    return pos
+                append(buf[pos:start])
+                append(self._replacement(m, 0))
+                pos = end
+                if start == end:
+                    break
+            else:
+                return pos
+            # Like re.sub, move on after an empty match.
+            if pos == len(buf):
+                return pos
+            append(buf[pos:pos + 1])
+            pos += 1
+
+    def _feed_many(self, buf: bytes, pos: int, limit: int, out: typing.List[bytes]) -> int:
+        # The next match of each subject, valid as long as it starts at or
+        # behind pos. Subjects that do not match anymore are dropped.
+        found: typing.List[typing.Tuple[typing.Optional[typing.Match[bytes]], int]] = [
+            (None, i) for i in range(len(self.substitutions))
+        ]
+        while found:
+            best = None
+            for j, (m, i) in enumerate(found):
+                if m is None or m.start() < pos:
+                    m = self.substitutions[i][0].search(buf, pos)
+                    found[j] = (m, i)
+                if m is not None and (best is None or m.start() < best[0].start()):
+                    best = (m, i)
+            found = [x for x in found if x[0] is not None]
+            if best is None or best[0].start() > limit:
+                break
+            m, i = best
+            start, end = m.span()
+            out.append(buf[pos:start])
+            out.append(self._replacement(m, i))
+            if start == end:
+                # Like re.sub, move on after an empty match.
+                if start == len(buf):
+                    pos = start
+                    break
+                out.append(buf[start:start + 1])
+                end += 1
+            pos = end
+        return pos
+
+
+class StreamReplacer:
+    """
+    A stream modifier that rewrites a streamed body with Window, decoding
+    and re-encoding it on the fly if it has a content encoding.
+    The rewritten body is passed on to the stream modifier that was set
+    before, if any.
+    """
+
+    def __init__(
+        self,
+        substitutions: typing.Sequence[Substitution],
+        max_match: int,
+        content_encoding: typing.Optional[str] = None,
+        inner=None,
+    ) -> None:
+        self.substitutions = substitutions
+        self.max_match = max_match
+        self.content_encoding = content_encoding
+        self.inner = inner
+
+    def __call__(self, chunks):
+        chunks = self.replace(chunks)
+        if callable(self.inner):
+            chunks = self.inner(chunks)
+        return chunks
+
+    def replace(self, chunks):
+        window = Window(self.substitutions, self.max_match)
+        if self.content_encoding:
+            decoder = encoding.stream_decoder(self.content_encoding)
+            encoder = encoding.stream_encoder(self.content_encoding)
+            for chunk in chunks:
+                data = window.feed(decoder.process(chunk))
+                if data:
+                    yield encoder.process(data)
+            yield encoder.process(window.feed(decoder.flush(), True)) + encoder.flush()
+        else:
+            for chunk in chunks:
+                data = window.feed(chunk)
+                if data:
+                    yield data
+            yield window.feed(b"", True)
 
 
 class ModifyBody:
     def __init__(self):
-        self.replacements: typing.List[ModifySpec] = []
+        self.replacements: RuleTable[ModifySpec] = RuleTable()
+        # The compiled subjects by rule index.
+        self.subjects: typing.List[typing.Pattern[bytes]] = []
 
     def load(self, loader):
         loader.add_option(
@@ -18,17 +167,40 @@ class ModifyBody:
             is used to read the replacement string.
             """
         )
+        loader.add_option(
+            "modify_body_max_match", str, "4k",
+            """
+            Maximum length of a match of modify_body patterns in streamed
+            bodies, which are rewritten in a single pass over a sliding
+            window of this size. Longer matches are missed.
+            Understands k/m/g suffixes, i.e. 3m for 3 megabytes.
+            """
+        )
 
     def configure(self, updated):
         if "modify_body" in updated:
-            self.replacements = []
+            entries = []
             for option in ctx.options.modify_body:
                 try:
                     spec = parse_modify_spec(option, True)
                 except ValueError as e:
                     raise exceptions.OptionsError(f"Cannot parse modify_body option {option}: {e}") from e
 
-                self.replacements.append(spec)
+                entries.append((option, spec, None))
+            self.replacements = RuleTable(entries)
+            self.subjects = [re.compile(spec.subject, re.DOTALL) for _, spec, _ in entries]
+        if "modify_body_max_match" in updated:
+            try:
+                human.parse_size(ctx.options.modify_body_max_match)
+            except ValueError as e:
+                raise exceptions.OptionsError(e)
+
+    @command.command("modifybody.hits")
+    def hits(self) -> typing.Sequence[str]:
+        """
+            Number of messages each modify_body rule matched.
+        """
+        return self.replacements.hit_counts()
 
     def request(self, flow):
         if not flow.reply.has_message:
@@ -38,15 +210,56 @@ class ModifyBody:
         if not flow.reply.has_message:
             self.run(flow)
 
+    def substitutions(self, flow) -> typing.List[Substitution]:
+        ret = []
+        for rule in self.replacements.matching(flow):
+            try:
+                replacement = rule.spec.read_replacement()
+            except OSError as e:
+                ctx.log.warn(f"Could not read replacement file: {e}")
+                continue
+            ret.append((self.subjects[rule.index], replacement))
+        return ret
+
     def run(self, flow):
-        for spec in self.replacements:
-            if spec.matches(flow):
-                try:
-                    replacement = spec.read_replacement()
-                except OSError as e:
-                    ctx.log.warn(f"Could not read replacement file: {e}")
-                    continue
-                if flow.response:
-                    flow.response.content = re.sub(spec.subject, replacement, flow.response.content, flags=re.DOTALL)
-                else:
-                    flow.request.content = re.sub(spec.subject, replacement, flow.request.content, flags=re.DOTALL)
+        if not self.replacements:
+            return
+        message = flow.response or flow.request
+        if message.raw_content is None and message.stream:
+            self.stream(flow, message)
+            return
+        substitutions = self.substitutions(flow)
+        if substitutions:
+            # Decode and encode once, no matter how many rules apply.
+            content = message.content
+            for subject, replacement in substitutions:
+                content = subject.sub(replacement, content)
+            message.content = content
+
+    def stream(self, flow, message) -> None:
+        """
+            Rewrite a streamed body while it is transferred.
+        """
+        substitutions = self.substitutions(flow)
+        if not substitutions:
+            return
+        if isinstance(message.stream, http.AddonBody):
+            ctx.log.info(f"Cannot modify body served by an addon: {message.stream!r}.")
+            return
+        content_encoding = message.headers.get("content-encoding", "").strip().lower() or None
+        if content_encoding and content_encoding not in encoding.stream_decoders:
+            ctx.log.warn(f"Cannot modify streamed body with content encoding {content_encoding}.")
+            return
+        # The length changes, so the body has to be delimited differently.
+        if message.http_version == "HTTP/1.1":
+            if "chunked" not in message.headers.get("transfer-encoding", "").lower():
+                message.headers["transfer-encoding"] = "chunked"
+        elif message.http_version != "HTTP/2.0":
+            if isinstance(message, http.HTTPRequest):
+                ctx.log.warn(f"Cannot modify streamed {message.http_version} request body.")
+                return
+            message.headers["connection"] = "close"
+        message.headers.pop("content-length", None)
+        inner = message.stream if callable(message.stream) else None
+        max_match = human.parse_size(ctx.options.modify_body_max_match)
+        message.stream = StreamReplacer(substitutions, max_match, content_encoding, inner)
@@ -2,9 +2,10 @@ import re
 import typing
 from pathlib import Path
 
-from mitmproxy import ctx, exceptions, flowfilter, http
+from mitmproxy import command, ctx, exceptions, flowfilter, http
 from mitmproxy.net.http import Headers
 from mitmproxy.utils import strutils
+from mitmproxy.utils.ruletable import RuleTable
 from mitmproxy.utils.spec import parse_spec
 
 
@@ -50,7 +51,7 @@ def parse_modify_spec(option: str, subject_is_regex: bool) -> ModifySpec:
 
 class ModifyHeaders:
     def __init__(self):
-        self.replacements: typing.List[ModifySpec] = []
+        self.replacements: RuleTable[ModifySpec] = RuleTable()
 
     def load(self, loader):
         loader.add_option(
@@ -64,13 +65,21 @@ class ModifyHeaders:
 
     def configure(self, updated):
         if "modify_headers" in updated:
-            self.replacements = []
+            entries = []
             for option in ctx.options.modify_headers:
                 try:
                     spec = parse_modify_spec(option, False)
                 except ValueError as e:
                     raise exceptions.OptionsError(f"Cannot parse modify_headers option {option}: {e}") from e
-                self.replacements.append(spec)
+                entries.append((option, spec, None))
+            self.replacements = RuleTable(entries)
+
+    @command.command("modifyheaders.hits")
+    def hits(self) -> typing.Sequence[str]:
+        """
+            Number of messages each modify_headers rule matched.
+        """
+        return self.replacements.hit_counts()
 
     def request(self, flow):
         if not flow.reply.has_message:
@@ -81,19 +90,19 @@ class ModifyHeaders:
             self.run(flow, flow.response.headers)
 
     def run(self, flow: http.HTTPFlow, hdrs: Headers) -> None:
+        rules = list(self.replacements.matching(flow))
+
         # unset all specified headers
-        for spec in self.replacements:
-            if spec.matches(flow):
-                hdrs.pop(spec.subject, None)
+        for rule in rules:
+            hdrs.pop(rule.spec.subject, None)
 
         # set all specified headers if the replacement string is not empty
-        for spec in self.replacements:
-            if spec.matches(flow):
-                try:
-                    replacement = spec.read_replacement()
-                except OSError as e:
-                    ctx.log.warn(f"Could not read replacement file: {e}")
-                    continue
-                else:
-                    if replacement:
-                        hdrs.add(spec.subject, replacement)
+        for rule in rules:
+            try:
+                replacement = rule.spec.read_replacement()
+            except OSError as e:
+                ctx.log.warn(f"Could not read replacement file: {e}")
+                continue
+            else:
+                if replacement:
+                    hdrs.add(rule.spec.subject, replacement)
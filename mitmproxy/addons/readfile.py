@@ -5,6 +5,7 @@ import typing
 
 from mitmproxy import ctx
 from mitmproxy import exceptions
+from mitmproxy import flow
 from mitmproxy import flowfilter
 from mitmproxy import io
 from mitmproxy import command
@@ -40,13 +41,15 @@ class ReadFile:
             self.filter = filt
 
     async def load_flows(self, fo: typing.IO[bytes]) -> int:
+        return await self._load(io.FlowReader(fo).stream())
+
+    async def _load(self, flows: typing.Iterable[flow.Flow]) -> int:
         cnt = 0
-        freader = io.FlowReader(fo)
         try:
-            for flow in freader.stream():
-                if self.filter and not self.filter(flow):
+            for f in flows:
+                if self.filter and not self.filter(f):
                     continue
-                await ctx.master.load_flow(flow)
+                await ctx.master.load_flow(f)
                 cnt += 1
         except (OSError, exceptions.FlowReadException) as e:
             if cnt:
@@ -57,8 +60,20 @@ class ReadFile:
         else:
             return cnt
 
+    def _index(self, path: str) -> typing.Optional[io.FlowIndex]:
+        try:
+            return io.FlowIndex.open(path)
+        except (OSError, exceptions.FlowReadException):
+            return None  # read the file in full, which loads the flows in front of a corrupted one.
+
     async def load_flows_from_path(self, path: str) -> int:
         path = os.path.expanduser(path)
+        predicate = io.entry_filter(self.filter) if self.filter else None
+        if predicate is not None and os.path.isfile(path):
+            # Flows the filter rules out by their key fields are never deserialized.
+            idx = self._index(path)
+            if idx is not None:
+                return await self._load(idx.stream([e for e in idx if predicate(e)]))
         try:
             with open(path, "rb") as f:
                 return await self.load_flows(f)
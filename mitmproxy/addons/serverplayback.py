@@ -1,4 +1,4 @@
-import hashlib
+import collections
 import typing
 import urllib
 
@@ -8,15 +8,90 @@ from mitmproxy import ctx, http
 from mitmproxy import exceptions
 from mitmproxy import flow
 from mitmproxy import io
+from mitmproxy.utils import human
+
+
+class ResponseCache:
+    """
+        A bounded LRU cache of the responses decoded from memory-mapped
+        dumps, by the total size of their bodies.
+    """
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries: "collections.OrderedDict[MappedFlow, http.HTTPResponse]" = collections.OrderedDict()
+
+    def get(self, f: "MappedFlow") -> http.HTTPResponse:
+        response = self.entries.get(f)
+        if response is not None:
+            self.entries.move_to_end(f)
+            return response
+        response = http.HTTPResponse.from_state(f.dump.decode(f.response_span))
+        size = len(response.raw_content or b"")
+        if size <= self.max_bytes:
+            self.entries[f] = response
+            self.size += size
+            while self.size > self.max_bytes:
+                _, old = self.entries.popitem(last=False)
+                self.size -= len(old.raw_content or b"")
+        return response
+
+    def clear(self) -> None:
+        self.entries.clear()
+        self.size = 0
+
+
+class MappedFlow:
+    """
+        A recorded flow in a memory-mapped dump. Only the location of the
+        request and the response is kept, they are decoded when needed.
+    """
+    __slots__ = ("dump", "request_span", "response_span", "cache")
+
+    def __init__(self, dump: io.MappedDump, request_span, response_span, cache: ResponseCache) -> None:
+        self.dump = dump
+        self.request_span = request_span
+        self.response_span = response_span
+        self.cache = cache
+
+    @property
+    def request(self) -> http.HTTPRequest:
+        return http.HTTPRequest.from_state(self.dump.decode(self.request_span))
+
+    @property
+    def response(self) -> http.HTTPResponse:
+        return self.cache.get(self)
 
 
 class ServerPlayback:
-    flowmap: typing.Dict[typing.Hashable, typing.List[http.HTTPFlow]]
+    flowmap: typing.Dict[typing.Hashable, typing.Deque[typing.Union[http.HTTPFlow, MappedFlow]]]
     configured: bool
 
+    # Options that change how requests are matched to the recorded flows.
+    matching_options = {
+        "server_replay_use_headers",
+        "server_replay_ignore_content",
+        "server_replay_ignore_params",
+        "server_replay_ignore_payload_params",
+        "server_replay_ignore_host",
+        "server_replay_ignore_port",
+    }
+
     def __init__(self):
         self.flowmap = {}
+        self.remaining = 0
         self.configured = False
+        self.dumps: typing.List[io.MappedDump] = []
+        self.cache = ResponseCache(0)
+        # Snapshot of the matching options, reading options is comparatively
+        # slow and _hash runs for every request.
+        self.ignore_content = False
+        self.ignore_payload_params: typing.FrozenSet[str] = frozenset()
+        self.ignore_params: typing.FrozenSet[str] = frozenset()
+        self.ignore_host = False
+        self.ignore_port = False
+        self.use_headers: typing.Sequence[str] = ()
 
     def load(self, loader):
         loader.add_option(
@@ -45,6 +120,21 @@ class ServerPlayback:
             "server_replay", typing.Sequence[str], [],
             "Replay server responses from a saved file."
         )
+        loader.add_option(
+            "server_replay_lazy", bool, False,
+            """
+            Memory-map server replay files and only index them when loading.
+            Responses are read from the file when they are first replayed.
+            """
+        )
+        loader.add_option(
+            "server_replay_cache", str, "64m",
+            """
+            Size of the responses read from memory-mapped server replay files
+            that are kept in memory.
+            Understands k/m/g suffixes, i.e. 3m for 3 megabytes.
+            """
+        )
         loader.add_option(
             "server_replay_ignore_content", bool, False,
             "Ignore request's content while searching for a saved flow to replay."
@@ -84,20 +174,60 @@ class ServerPlayback:
         """
             Replay server responses from flows.
         """
+        self.close_dumps()
+        # Flows without a response can never be replayed.
+        self.index(
+            f for f in flows
+            if isinstance(f, http.HTTPFlow) and f.response
+        )
+        ctx.master.addons.trigger("update", [])
+
+    def load_dumps(self, paths: typing.Sequence[str]) -> None:
+        """
+            Replay server responses from memory-mapped dumps.
+        """
+        self.close_dumps()
+        # Options at their defaults are never passed to configure.
+        self.cache.max_bytes = human.parse_size(ctx.options.server_replay_cache)
+        flows = []
+        for path in paths:
+            dump = io.MappedDump(path)
+            self.dumps.append(dump)
+            for state, spans in dump.scan(("request", "response")):
+                if state["type"] == "http" and "request" in spans and "response" in spans:
+                    flows.append(MappedFlow(dump, spans["request"], spans["response"], self.cache))
+        self.index(flows)
+        ctx.master.addons.trigger("update", [])
+
+    def close_dumps(self) -> None:
+        self.cache.clear()
+        for dump in self.dumps:
+            dump.close()
+        self.dumps = []
+
+    def index(self, flows: typing.Iterable[typing.Union[http.HTTPFlow, MappedFlow]]) -> None:
+        """
+            Group flows by the key of their request.
+        """
         self.flowmap = {}
+        self.remaining = 0
         for f in flows:
-            if isinstance(f, http.HTTPFlow):
-                lst = self.flowmap.setdefault(self._hash(f), [])
-                lst.append(f)
-        ctx.master.addons.trigger("update", [])
+            key = self._hash(f)
+            q = self.flowmap.get(key)
+            if q is None:
+                q = self.flowmap[key] = collections.deque()
+            q.append(f)
+            self.remaining += 1
 
     @command.command("replay.server.file")
     def load_file(self, path: mitmproxy.types.Path) -> None:
         try:
-            flows = io.read_flows_from_paths([path])
+            if ctx.options.server_replay_lazy:
+                self.load_dumps([path])
+            else:
+                self.load_flows(io.read_flows_from_paths([path]))
         except exceptions.FlowReadException as e:
             raise exceptions.CommandError(str(e))
-        self.load_flows(flows)
 
     @command.command("replay.server.stop")
     def clear(self) -> None:
@@ -105,103 +235,112 @@ class ServerPlayback:
             Stop server replay.
         """
         self.flowmap = {}
+        self.remaining = 0
+        self.close_dumps()
         ctx.master.addons.trigger("update", [])
 
     @command.command("replay.server.count")
     def count(self) -> int:
-        return sum([len(i) for i in self.flowmap.values()])
+        return self.remaining
 
-    def _hash(self, flow: http.HTTPFlow) -> typing.Hashable:
+    def _hash(self, flow: typing.Union[http.HTTPFlow, MappedFlow]) -> typing.Hashable:
         """
             Calculates a loose hash of the flow request.
+
+            The key is a tuple that is used as the dict key directly, so
+            matching a request costs a single dict lookup.
         """
         r = flow.request
-        _, _, path, _, query, _ = urllib.parse.urlparse(r.url)
-        queriesArray = urllib.parse.parse_qsl(query, keep_blank_values=True)
+        path, _, query = r.path.partition("?")
+        if ";" in r.path or "#" in r.path:
+            # Let urllib deal with path parameters and fragments.
+            _, _, path, _, query, _ = urllib.parse.urlparse(r.url)
 
-        key: typing.List[typing.Any] = [str(r.scheme), str(r.method), str(path)]
-        if not ctx.options.server_replay_ignore_content:
-            if ctx.options.server_replay_ignore_payload_params and r.multipart_form:
+        key: typing.List[typing.Any] = [r.scheme, r.method, path]
+        if not self.ignore_content:
+            if self.ignore_payload_params and r.multipart_form:
                 key.extend(
                     (k, v)
                     for k, v in r.multipart_form.items(multi=True)
-                    if k.decode(errors="replace") not in ctx.options.server_replay_ignore_payload_params
+                    if k.decode(errors="replace") not in self.ignore_payload_params
                 )
-            elif ctx.options.server_replay_ignore_payload_params and r.urlencoded_form:
+            elif self.ignore_payload_params and r.urlencoded_form:
                 key.extend(
                     (k, v)
                     for k, v in r.urlencoded_form.items(multi=True)
-                    if k not in ctx.options.server_replay_ignore_payload_params
+                    if k not in self.ignore_payload_params
                 )
             else:
-                key.append(str(r.raw_content))
+                key.append(r.raw_content)
 
-        if not ctx.options.server_replay_ignore_host:
+        if not self.ignore_host:
             key.append(r.pretty_host)
-        if not ctx.options.server_replay_ignore_port:
+        if not self.ignore_port:
             key.append(r.port)
 
-        filtered = []
-        ignore_params = ctx.options.server_replay_ignore_params or []
-        for p in queriesArray:
-            if p[0] not in ignore_params:
-                filtered.append(p)
-        for p in filtered:
-            key.append(p[0])
-            key.append(p[1])
-
-        if ctx.options.server_replay_use_headers:
-            headers = []
-            for i in ctx.options.server_replay_use_headers:
-                v = r.headers.get(i)
-                headers.append((i, v))
-            key.append(headers)
-        return hashlib.sha256(
-            repr(key).encode("utf8", "surrogateescape")
-        ).digest()
-
-    def next_flow(self, flow: http.HTTPFlow) -> typing.Optional[http.HTTPFlow]:
+        if query:
+            for k, v in urllib.parse.parse_qsl(query, keep_blank_values=True):
+                if k not in self.ignore_params:
+                    key.append(k)
+                    key.append(v)
+
+        if self.use_headers:
+            key.append(tuple(
+                (i, r.headers.get(i))
+                for i in self.use_headers
+            ))
+        return tuple(key)
+
+    def next_flow(self, flow: http.HTTPFlow) -> typing.Optional[typing.Union[http.HTTPFlow, MappedFlow]]:
         """
             Returns the next flow object, or None if no matching flow was
             found.
         """
         hash = self._hash(flow)
-        if hash in self.flowmap:
-            if ctx.options.server_replay_nopop:
-                return next((
-                    flow
-                    for flow in self.flowmap[hash]
-                    if flow.response
-                ), None)
-            else:
-                ret = self.flowmap[hash].pop(0)
-                while not ret.response:
-                    if self.flowmap[hash]:
-                        ret = self.flowmap[hash].pop(0)
-                    else:
-                        del self.flowmap[hash]
-                        return None
-                if not self.flowmap[hash]:
-                    del self.flowmap[hash]
-                return ret
-        else:
+        q = self.flowmap.get(hash)
+        if not q:
             return None
+        if ctx.options.server_replay_nopop:
+            return q[0]
+        self.remaining -= 1
+        ret = q.popleft()
+        if not q:
+            del self.flowmap[hash]
+        return ret
 
     def configure(self, updated):
+        if self.matching_options.intersection(updated):
+            self.ignore_content = ctx.options.server_replay_ignore_content
+            self.ignore_payload_params = frozenset(ctx.options.server_replay_ignore_payload_params)
+            self.ignore_params = frozenset(ctx.options.server_replay_ignore_params)
+            self.ignore_host = ctx.options.server_replay_ignore_host
+            self.ignore_port = ctx.options.server_replay_ignore_port
+            self.use_headers = tuple(ctx.options.server_replay_use_headers)
+        if "server_replay_cache" in updated:
+            try:
+                self.cache.max_bytes = human.parse_size(ctx.options.server_replay_cache)
+            except ValueError as e:
+                raise exceptions.OptionsError(e)
         if not self.configured and ctx.options.server_replay:
             self.configured = True
             try:
-                flows = io.read_flows_from_paths(ctx.options.server_replay)
+                if ctx.options.server_replay_lazy:
+                    self.load_dumps(ctx.options.server_replay)
+                else:
+                    self.load_flows(io.read_flows_from_paths(ctx.options.server_replay))
             except exceptions.FlowReadException as e:
                 raise exceptions.OptionsError(str(e))
-            self.load_flows(flows)
+        elif self.flowmap and self.matching_options.intersection(updated):
+            # The keys depend on these options.
+            self.index([f for q in self.flowmap.values() for f in q])
 
     def request(self, f: http.HTTPFlow) -> None:
         if self.flowmap:
             rflow = self.next_flow(f)
             if rflow:
-                assert rflow.response
-                response = rflow.response.copy()
+                response = rflow.response
+                assert response
+                response = response.copy()
                 if ctx.options.server_replay_refresh:
                     response.refresh()
                 f.response = response
@@ -214,3 +353,6 @@ class ServerPlayback:
                 )
                 assert f.reply
                 f.reply.kill()
+
+    def done(self):
+        self.close_dumps()
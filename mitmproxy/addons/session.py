@@ -1,12 +1,16 @@
 import collections
+import functools
+import hashlib
 import tempfile
 import asyncio
 import typing
 import bisect
 import shutil
 import sqlite3
+import time
 import copy
 import os
+import re
 
 from mitmproxy import flowfilter
 from mitmproxy import types
@@ -29,6 +33,169 @@ class KeyifyList:
         return self.key(self.inner[k])
 
 
+class FlowSummary(typing.NamedTuple):
+    """
+    The order and filter columns of a stored flow,
+    which can be queried without loading the flow itself.
+    """
+    id: str
+    time: float
+    method: str
+    url: str
+    size: int
+    host: str
+    pretty_host: str
+    pretty_url: str
+    status_code: typing.Optional[int]
+    request_content_type: typing.Optional[str]
+    response_content_type: typing.Optional[str]
+
+    @classmethod
+    def from_flow(cls, f: http.HTTPFlow) -> "FlowSummary":
+        size = 0
+        if f.request.raw_content:
+            size += len(f.request.raw_content)
+        if f.response and f.response.raw_content:
+            size += len(f.response.raw_content)
+        return cls(
+            f.id,
+            f.request.timestamp_start or 0,
+            f.request.method,
+            f.request.url,
+            size,
+            f.request.host,
+            f.request.pretty_host,
+            f.request.pretty_url,
+            f.response.status_code if f.response else None,
+            f.request.headers.get("content-type"),
+            f.response.headers.get("content-type") if f.response else None,
+        )
+
+
+@functools.lru_cache(maxsize=256)
+def _compile(pattern, flags):
+    return re.compile(pattern, flags)
+
+
+def _sql_regexp(pattern, value):
+    # Backs the REGEXP operator.
+    return value is not None and _compile(pattern, 0).search(value) is not None
+
+
+def _sql_regexp_i(pattern, value):
+    # The flags are passed separately, so that patterns with inline flags of their own still compile.
+    return value is not None and _compile(pattern, re.IGNORECASE).search(value) is not None
+
+
+_REGEX_META = frozenset("^$*+?{}[]\\|()")
+
+
+def _literal(body: str) -> typing.Optional[typing.List[typing.Optional[str]]]:
+    # The characters of a literal pattern, None standing for the . wildcard.
+    chars = []
+    escaped = False
+    for c in body:
+        if escaped:
+            if c.isalnum():
+                return None
+            chars.append(c)
+            escaped = False
+        elif c == "\\":
+            escaped = True
+        elif c == ".":
+            chars.append(None)
+        elif c in _REGEX_META:
+            return None
+        else:
+            chars.append(c)
+    return chars if chars and not escaped else None
+
+
+def _pattern_to_sql(column: str, expr: str, ignore_case: bool) -> typing.Tuple[str, list]:
+    """
+    A predicate that holds where re.search(expr) matches the column.
+
+    Literal patterns, optionally anchored with ^ and $ and with . for any character, become LIKE
+    (case-insensitive) or GLOB (case-sensitive) patterns, which SQLite evaluates without calling
+    back into Python and answers from an index if they are anchored at the start. All other
+    patterns go through the regexp functions.
+    """
+    start = expr.startswith("^")
+    end = expr.endswith("$") and not expr.endswith("\\$")
+    chars = _literal(expr[int(start):len(expr) - int(end)])
+    if chars is not None and ignore_case and all(c is None or c.isascii() for c in chars):
+        # LIKE only folds the case of ASCII characters.
+        pattern = "".join("_" if c is None else "\\" + c if c in "%_\\" else c for c in chars)
+        return f"{column} LIKE ? ESCAPE '\\'", [("" if start else "%") + pattern + ("" if end else "%")]
+    if chars is not None and not ignore_case:
+        pattern = "".join("?" if c is None else f"[{c}]" if c in "*?[" else c for c in chars)
+        return f"{column} GLOB ?", [("" if start else "*") + pattern + ("" if end else "*")]
+    return f"{'regexp_i' if ignore_case else 'regexp'}(?, {column})", [expr]
+
+
+def filter_to_sql(flt) -> typing.Tuple[typing.Optional[str], list, bool]:
+    """
+    Translate a flow filter into a WHERE clause over the summary columns of the flow table.
+
+    Returns a (clause, params, exact) tuple. clause is None if no part of the filter can be translated.
+    If exact is False, the clause is only a necessary condition and the filter still has to be
+    evaluated on the flows that pass it, e.g. for body or header expressions.
+    """
+    if isinstance(flt, flowfilter.FAnd):
+        clauses, params, exact = [], [], True
+        for sub in flt.lst:
+            c, p, e = filter_to_sql(sub)
+            if c is not None:
+                clauses.append(c)
+                params.extend(p)
+            exact = exact and e
+        if not clauses:
+            return None, [], False
+        return f"({' AND '.join(clauses)})", params, exact
+    if isinstance(flt, flowfilter.FOr):
+        parts = [filter_to_sql(sub) for sub in flt.lst]
+        if any(c is None for c, _, _ in parts):
+            return None, [], False
+        return (
+            f"({' OR '.join(c for c, _, _ in parts)})",
+            [x for _, p, _ in parts for x in p],
+            all(e for _, _, e in parts)
+        )
+    if isinstance(flt, flowfilter.FNot):
+        c, p, e = filter_to_sql(flt.itm)
+        if c is None or not e:
+            return None, [], False
+        return f"(NOT {c})", p, True
+    if isinstance(flt, flowfilter.FDomain):
+        host, p1 = _pattern_to_sql("host", flt.expr, True)
+        pretty_host, p2 = _pattern_to_sql("pretty_host", flt.expr, True)
+        return f"({host} OR {pretty_host})", p1 + p2, True
+    if isinstance(flt, flowfilter.FMethod):
+        c, p = _pattern_to_sql("method", flt.expr, True)
+        return c, p, True
+    if isinstance(flt, flowfilter.FUrl):
+        c, p = _pattern_to_sql("pretty_url", flt.expr, False)
+        return c, p, True
+    if isinstance(flt, flowfilter.FCode):
+        return "status_code IS ?", [flt.num], True
+    # A missing content type matches nothing, also under NOT.
+    if isinstance(flt, flowfilter.FContentType):
+        req, p1 = _pattern_to_sql("ifnull(request_content_type, '')", flt.expr, False)
+        resp, p2 = _pattern_to_sql("ifnull(response_content_type, '')", flt.expr, False)
+        return f"({req} OR {resp})", p1 + p2, True
+    if isinstance(flt, flowfilter.FContentTypeRequest):
+        c, p = _pattern_to_sql("ifnull(request_content_type, '')", flt.expr, False)
+        return c, p, True
+    if isinstance(flt, flowfilter.FContentTypeResponse):
+        c, p = _pattern_to_sql("ifnull(response_content_type, '')", flt.expr, False)
+        return c, p, True
+    if isinstance(flt, flowfilter.FReq):
+        return "status_code IS NULL", [], True
+    if isinstance(flt, flowfilter.FResp):
+        return "status_code IS NOT NULL", [], True
+    return None, [], False
+
+
 # Could be implemented using async libraries
 class SessionDB:
     """
@@ -43,6 +210,19 @@ class SessionDB:
             2: "response"
         }
     }
+    summary_columns = {
+        "id": "VARCHAR(36)",
+        "timestamp": "REAL",
+        "method": "TEXT",
+        "url": "TEXT",
+        "size": "INTEGER",
+        "host": "TEXT",
+        "pretty_host": "TEXT",
+        "pretty_url": "TEXT",
+        "status_code": "INTEGER",
+        "request_content_type": "TEXT",
+        "response_content_type": "TEXT",
+    }
 
     def __init__(self, db_path=None):
         """
@@ -66,6 +246,7 @@ class SessionDB:
                 self.tempdir = tempfile.mkdtemp()
                 path = os.path.join(self.tempdir, 'tmp.sqlite')
             self.con = sqlite3.connect(path)
+            self._configure_connection()
             self._create_session()
 
     def __del__(self):
@@ -84,6 +265,53 @@ class SessionDB:
         if not self.is_session_db(path):
             raise SessionLoadException('Given path does not point to a valid Session')
         self.con = sqlite3.connect(path)
+        self._configure_connection()
+        self._migrate_session()
+        self.id_ledger.update(r[0] for r in self.con.execute("SELECT id FROM flow;"))
+        self.body_ledger.update(r[0] for r in self.con.execute("SELECT DISTINCT flow_id FROM body;"))
+
+    def _configure_connection(self):
+        # Lets clear() give space back to the file system, only takes effect on new databases.
+        self.con.execute("PRAGMA auto_vacuum=INCREMENTAL;")
+        # With WAL, readers don't block the writer and a commit doesn't need to rewrite the main database file.
+        self.con.execute("PRAGMA journal_mode=WAL;")
+        self.con.execute("PRAGMA synchronous=NORMAL;")
+        self.con.create_function("regexp", 2, _sql_regexp, deterministic=True)
+        self.con.create_function("regexp_i", 2, _sql_regexp_i, deterministic=True)
+
+    def _migrate_session(self):
+        """
+        Add the summary columns to sessions created before they existed, and fill them in.
+        Bodies stored before the content table existed stay in the body table.
+        """
+        existing = {row[1] for row in self.con.execute("PRAGMA table_info(flow);")}
+        missing = [c for c in self.summary_columns if c not in existing]
+        with self.con:
+            for column in missing:
+                self.con.execute(f"ALTER TABLE flow ADD COLUMN {column} {self.summary_columns[column]};")
+            if "digest" not in {row[1] for row in self.con.execute("PRAGMA table_info(body);")}:
+                self.con.execute("ALTER TABLE body ADD COLUMN digest BLOB;")
+        # The creation script is idempotent, running it again adds any missing indexes.
+        self._create_session()
+        self._backfill_summaries()
+
+    def _backfill_summaries(self, batch_size=1000):
+        """
+        Fill in the summary columns of flows stored without them, batch by batch. Every flow
+        stored with summaries has a method, so an interrupted migration resumes on the next load.
+        """
+        sql = f"UPDATE flow SET {', '.join(f'{c}=?' for c in list(self.summary_columns)[1:])} WHERE id=?;"
+        batch = []
+        for f in self.iter_flows(batch_size, where="method IS NULL"):
+            s = FlowSummary.from_flow(f)
+            batch.append((*s[1:], s.id))
+            if len(batch) >= batch_size:
+                with self.con:
+                    self.con.executemany(sql, batch)
+                batch = []
+        if batch:
+            with self.con:
+                self.con.executemany(sql, batch)
 
     def _create_session(self):
         script_path = pkg_data.path("io/sql/session_create.sql")
@@ -146,6 +374,8 @@ class SessionDB:
     def store_flows(self, flows):
         body_buf = []
         flow_buf = []
+        # Bodies are stored once by digest, repeated static assets and API responses cost a reference each.
+        content_buf: typing.Dict[bytes, bytes] = {}
         for flow in flows:
             self.id_ledger.add(flow.id)
             self._disassemble(flow)
@@ -155,45 +385,110 @@ class SessionDB:
                 f.response = copy.deepcopy(flow.response)
             f.id = flow.id
             if len(f.request.content) > self.content_threshold and f.id not in self.body_ledger:
-                body_buf.append((f.id, 1, f.request.content))
+                body_buf.append((f.id, 1, self._digest(f.request.content, content_buf)))
                 f.request.content = b""
                 self.body_ledger.add(f.id)
             if f.response and f.id not in self.body_ledger:
                 if len(f.response.content) > self.content_threshold:
-                    body_buf.append((f.id, 2, f.response.content))
+                    body_buf.append((f.id, 2, self._digest(f.response.content, content_buf)))
                     f.response.content = b""
-            flow_buf.append((f.id, protobuf.dumps(f)))
-        self.con.executemany("INSERT OR REPLACE INTO flow VALUES(?, ?);", flow_buf)
-        if body_buf:
-            self.con.executemany("INSERT INTO body (flow_id, type_id, content) VALUES(?, ?, ?);", body_buf)
-        self.con.commit()
+            flow_buf.append((f.id, protobuf.dumps(f), *FlowSummary.from_flow(flow)[1:]))
+        # One transaction per batch, each statement prepared once for all rows.
+        with self.con:
+            self.con.executemany(
+                f"INSERT OR REPLACE INTO flow (id, content, {', '.join(list(self.summary_columns)[1:])}) "
+                f"VALUES({', '.join('?' * (len(self.summary_columns) + 1))});",
+                flow_buf
+            )
+            if body_buf:
+                # Content that is already stored is not written again, the triggers count the references.
+                self.con.executemany(
+                    "INSERT OR IGNORE INTO content (digest, refs, content) VALUES(?, 0, ?);", content_buf.items()
+                )
+                self.con.executemany("INSERT INTO body (flow_id, type_id, digest) VALUES(?, ?, ?);", body_buf)
+
+    @staticmethod
+    def _digest(content: bytes, content_buf: typing.Dict[bytes, bytes]) -> bytes:
+        digest = hashlib.sha256(content).digest()
+        content_buf.setdefault(digest, content)
+        return digest
 
     def retrieve_flows(self, ids=None):
-        flows = []
+        flows: typing.Dict[str, http.HTTPFlow] = {}
         with self.con as con:
             if not ids:
-                sql = "SELECT f.content, b.type_id, b.content " \
+                sql = "SELECT f.id, f.content, b.type_id, coalesce(c.content, b.content) " \
                       "FROM flow f " \
-                      "LEFT OUTER JOIN body b ON f.id = b.flow_id;"
+                      "LEFT OUTER JOIN body b ON f.id = b.flow_id " \
+                      "LEFT OUTER JOIN content c ON b.digest = c.digest;"
                 rows = con.execute(sql).fetchall()
             else:
-                sql = "SELECT f.content, b.type_id, b.content " \
+                sql = "SELECT f.id, f.content, b.type_id, coalesce(c.content, b.content) " \
                       "FROM flow f " \
                       "LEFT OUTER JOIN body b ON f.id = b.flow_id " \
-                      f"AND f.id IN ({','.join(['?' for _ in range(len(ids))])});"
+                      "LEFT OUTER JOIN content c ON b.digest = c.digest " \
+                      f"WHERE f.id IN ({','.join(['?' for _ in range(len(ids))])});"
                 rows = con.execute(sql, ids).fetchall()
-            for row in rows:
-                flow = protobuf.loads(row[0])
-                if row[1]:
-                    typ = self.type_mappings["body"][row[1]]
-                    if typ and row[2]:
-                        setattr(getattr(flow, typ), "content", row[2])
-                flow = self._reassemble(flow)
-                flows.append(flow)
-        return flows
+            # A flow with both request and response bodies stored separately spans two rows.
+            for fid, content, type_id, body in rows:
+                flow = flows.get(fid)
+                if flow is None:
+                    flow = flows[fid] = self._reassemble(protobuf.loads(content))
+                if type_id:
+                    typ = self.type_mappings["body"][type_id]
+                    if typ and body:
+                        setattr(getattr(flow, typ), "content", body)
+        return list(flows.values())
+
+    def retrieve_summaries(self, ids=None, where=None, params=()) -> typing.List[FlowSummary]:
+        """
+        Projection query returning only the order and filter columns of stored flows,
+        optionally restricted by a WHERE clause over those columns (see filter_to_sql).
+        """
+        sql = f"SELECT {', '.join(self.summary_columns)} FROM flow"
+        clauses = []
+        args = []
+        if ids:
+            clauses.append(f"id IN ({','.join(['?' for _ in range(len(ids))])})")
+            args.extend(ids)
+        if where:
+            clauses.append(where)
+            args.extend(params)
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        return [FlowSummary(*row) for row in self.con.execute(sql + ";", args)]
+
+    def iter_flows(self, batch_size=1000, where=None, params=()) -> typing.Iterator[http.HTTPFlow]:
+        """
+        Like retrieve_flows, but loads the stored flows batch by batch, in the order they were stored,
+        optionally restricted by a WHERE clause over the summary columns (see filter_to_sql).
+        """
+        condition = f" AND ({where})" if where else ""
+        last = 0
+        while True:
+            rows = self.con.execute(
+                f"SELECT rowid, id FROM flow WHERE rowid > ?{condition} ORDER BY rowid LIMIT ?;",
+                (last, *params, batch_size)
+            ).fetchall()
+            if not rows:
+                return
+            last = rows[-1][0]
+            order = {fid: i for i, (_, fid) in enumerate(rows)}
+            yield from sorted(self.retrieve_flows(list(order)), key=lambda f: order[f.id])
+
+    def retrieve_columns(self, columns: typing.Sequence[str]) -> typing.Iterator[tuple]:
+        """
+        Projection of the given summary columns of all stored flows, in the order they were stored.
+        """
+        for c in columns:
+            if c not in self.summary_columns:
+                raise ValueError(f"Not a summary column: {c}")
+        yield from self.con.execute(f"SELECT {', '.join(columns)} FROM flow ORDER BY rowid;")
 
     def clear(self):
-        self.con.executescript("DELETE FROM body; DELETE FROM annotation; DELETE FROM flow;")
+        self.con.executescript(
+            "DELETE FROM content; DELETE FROM body; DELETE FROM annotation; DELETE FROM flow; PRAGMA incremental_vacuum;"
+        )
 
 
 matchall = flowfilter.parse(".")
@@ -209,8 +504,13 @@ orders = [
 class Session:
 
     _FP_RATE = 150
+    _FP_RATE_MIN = 25
+    _FP_RATE_MAX = 5000
     _FP_DECREMENT = 0.9
     _FP_DEFAULT = 3.0
+    _FP_MIN = 0.05
+    # Commit latency we aim for per batch, so that a flush never blocks the event loop for long.
+    _FP_TARGET_LATENCY = 0.05
 
     def __init__(self):
         self.db_store: SessionDB = None
@@ -255,20 +555,39 @@ class Session:
         while True:
             await asyncio.sleep(self._flush_period)
             batches = -(-len(self._hot_store) // self._flush_rate)
-            self._flush_period = self._flush_period * self._FP_DECREMENT if batches > 1 else self._FP_DEFAULT
-            while batches:
+            if batches > 1:
+                self._flush_period = max(self._flush_period * self._FP_DECREMENT, self._FP_MIN)
+            else:
+                self._flush_period = self._FP_DEFAULT
+            while batches and self._hot_store:
                 tof = []
                 to_dump = min(len(self._hot_store), self._flush_rate)
                 for _ in range(to_dump):
                     tof.append(self._hot_store.popitem(last=False)[1])
+                start = time.perf_counter()
                 self.db_store.store_flows(tof)
+                self._adapt_flush_rate(len(tof), time.perf_counter() - start)
                 batches -= 1
                 await asyncio.sleep(0.01)
 
+    def _adapt_flush_rate(self, stored: int, elapsed: float) -> None:
+        """
+        Size the next batch so that its commit takes about _FP_TARGET_LATENCY,
+        based on the measured per-flow cost of the last one.
+        Only full batches are meaningful samples, a deep queue is drained by shortening the flush period.
+        """
+        if stored < self._flush_rate or elapsed <= 0:
+            return
+        ideal = stored * self._FP_TARGET_LATENCY / elapsed
+        # Smooth out single slow or fast commits.
+        rate = int((self._flush_rate + ideal) / 2)
+        self._flush_rate = max(self._FP_RATE_MIN, min(rate, self._FP_RATE_MAX))
+
     def load_view(self) -> typing.Sequence[http.HTTPFlow]:
+        # The view is already sorted, we just need to put the loaded flows back into that order.
         ids = [fid for _, fid in self._view]
-        flows = self.load_storage(ids)
-        return sorted(flows, key=lambda f: self._generate_order(self.order, f))
+        flows = {f.id: f for f in self.load_storage(ids)}
+        return [flows[fid] for fid in ids if fid in flows]
 
     def load_storage(self, ids=None) -> typing.Sequence[http.HTTPFlow]:
         flows = []
@@ -280,7 +599,8 @@ class Session:
                     flows.append(self._hot_store[fid])
                 elif fid in self.db_store:
                     ids_from_store.append(fid)
-            flows += self.db_store.retrieve_flows(ids_from_store)
+            if ids_from_store:
+                flows += self.db_store.retrieve_flows(ids_from_store)
         else:
             for flow in self._hot_store.values():
                 flows.append(flow)
@@ -323,6 +643,9 @@ class Session:
         for order in orders:
             self._order_store[f.id][order] = self._generate_order(order, f)
 
+    def _store_summary_order(self, s: FlowSummary):
+        self._order_store[s.id] = {order: getattr(s, order) for order in orders}
+
     def set_order(self, order: str) -> None:
         if order not in orders:
             raise CommandError(
@@ -336,11 +659,29 @@ class Session:
             self._view = sorted(newview)
 
     def _refilter(self):
-        self._view = []
-        flows = self.load_storage()
-        for f in flows:
+        if self.filter is matchall:
+            where, params, exact = None, [], True
+        else:
+            where, params, exact = filter_to_sql(self.filter)
+        # Flows in the hot store are more recent than their stored versions and are filtered in memory.
+        summaries = [
+            s for s in self.db_store.retrieve_summaries(where=where, params=params)
+            if s.id not in self._hot_store
+        ]
+        for s in summaries:
+            self._store_summary_order(s)
+        if exact:
+            matched = [s.id for s in summaries]
+        else:
+            # Only the residual predicates need the flows themselves, which are read batch by batch.
+            matched = [
+                f.id for f in self.db_store.iter_flows(where=where, params=params)
+                if f.id not in self._hot_store and self.filter(f)
+            ]
+        for f in self._hot_store.values():
             if self.filter(f):
-                self.update_view(f)
+                matched.append(f.id)
+        self._view = sorted((self._order_store[fid][self.order], fid) for fid in matched)
 
     def set_filter(self, input_filter: typing.Optional[str]) -> None:
         filt = matchall if not input_filter else flowfilter.parse(input_filter)
@@ -352,10 +693,13 @@ class Session:
         self._refilter()
 
     def update_view(self, f):
-        if any([f.id == t[1] for t in self._view]):
-            self._view = [(order, fid) for order, fid in self._view if fid != f.id]
-        o = self._order_store[f.id][self.order]
-        self._view.insert(bisect.bisect_left(KeyifyList(self._view, lambda x: x[0]), o), (o, f.id))
+        self._update_view_id(f.id)
+
+    def _update_view_id(self, fid: str):
+        if any([fid == t[1] for t in self._view]):
+            self._view = [(order, i) for order, i in self._view if i != fid]
+        o = self._order_store[fid][self.order]
+        self._view.insert(bisect.bisect_left(KeyifyList(self._view, lambda x: x[0]), o), (o, fid))
 
     def update(self, flows: typing.Sequence[http.HTTPFlow]) -> None:
         for f in flows:
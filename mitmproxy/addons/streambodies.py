@@ -1,14 +1,160 @@
+import os
+import tempfile
 import typing
 
 from mitmproxy.net.http import http1
 from mitmproxy import exceptions
+from mitmproxy import flowfilter
+from mitmproxy import http
 from mitmproxy import ctx
 from mitmproxy.utils import human
 
+STREAM_MODES = ("stream", "buffer", "tee")
+
+
+class StreamRule(typing.NamedTuple):
+    matches: flowfilter.TFilter
+    mode: str
+
+
+def _match_all(flow) -> bool:
+    return True
+
+
+def parse_stream_rule(option: str) -> StreamRule:
+    """
+    Parse strings in the following format:
+
+        [/flow-filter]/mode
+
+    The separator can be any character. The mode is split off at the last
+    separator, so the filter itself may contain it.
+    """
+    sep, rem = option[0], option[1:]
+    if sep in rem:
+        patt, mode = rem.rsplit(sep, 1)
+        flow_filter = flowfilter.parse(patt)
+        if not flow_filter:
+            raise ValueError(f"Invalid filter pattern: {patt}")
+    else:
+        flow_filter, mode = _match_all, rem
+    if mode not in STREAM_MODES:
+        raise ValueError(f"Invalid stream mode: {mode} (expected one of {', '.join(STREAM_MODES)})")
+    return StreamRule(flow_filter, mode)
+
+
+class Tee:
+    """
+    A stream modifier that passes all chunks through to the peer and keeps a
+    copy of the body.
+
+    At most `limit` bytes are kept in memory. If `spill_dir` is given, a full
+    copy is written to a file in that directory as well. Once the body has
+    been transferred completely, the message content is restored if it fit
+    into the limit, so that the flow looks like a regular buffered one.
+    Otherwise the captured prefix, the total size and the path of the spill
+    file are stored in `flow.metadata["stream_tee"]`.
+    """
+
+    def __init__(self, flow, message, limit: int, spill_dir: typing.Optional[str] = None, inner=None,
+                 spills: typing.Optional[typing.Set[str]] = None):
+        self.flow = flow
+        self.message = message
+        self.limit = limit
+        self.spill_dir = spill_dir
+        self.inner = inner
+        self.spill_path: typing.Optional[str] = None
+        # shared set of spill files that still exist
+        self.spills = spills if spills is not None else set()
+
+    def __call__(self, chunks):
+        if callable(self.inner):
+            chunks = self.inner(chunks)
+        return self.capture(chunks)
+
+    def capture(self, chunks):
+        captured = []
+        captured_size = 0
+        size = 0
+        spill = None
+        if self.spill_dir:
+            fd, self.spill_path = tempfile.mkstemp(prefix="mitmproxy-stream-", dir=self.spill_dir)
+            spill = os.fdopen(fd, "wb")
+            self.spills.add(self.spill_path)
+        try:
+            for chunk in chunks:
+                size += len(chunk)
+                if captured_size < self.limit:
+                    captured.append(chunk[:self.limit - captured_size])
+                    captured_size += len(captured[-1])
+                if spill:
+                    spill.write(chunk)
+                yield chunk
+        finally:
+            if spill:
+                spill.close()
+        prefix = b"".join(captured)
+        if size <= self.limit:
+            self.message.data.content = prefix
+            self.remove_spill()
+        else:
+            self.flow.metadata["stream_tee"] = {
+                "size": size,
+                "prefix": prefix,
+                "spill": self.spill_path,
+            }
+        # The response hook has already run with the content missing, let
+        # the UI know that the flow has changed.
+        master = ctx.master
+        master.channel.loop.call_soon_threadsafe(master.addons.trigger, "update", [self.flow])
+
+    def remove_spill(self):
+        if self.spill_path:
+            remove_spill(self.spill_path)
+            self.spills.discard(self.spill_path)
+            self.spill_path = None
+
+
+def remove_spill(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def spill_path(flow) -> typing.Optional[str]:
+    """
+    Return the path of the full copy of a teed message that was spilled to
+    disk, or None.
+    """
+    tee = flow.metadata.get("stream_tee", None)
+    if not tee or not tee.get("spill") or not os.path.exists(tee["spill"]):
+        return None
+    return tee["spill"]
+
+
+def read_spill(flow, limit: typing.Optional[int] = None) -> typing.Optional[bytes]:
+    """
+    Return the full body of a teed message that was spilled to disk, or None.
+    Spilled bodies larger than limit are not read.
+    """
+    path = spill_path(flow)
+    if not path:
+        return None
+    try:
+        if limit is not None and os.path.getsize(path) > limit:
+            return None
+        with open(path, "rb") as f:
+            return f.read()
+    except OSError:
+        return None
+
 
 class StreamBodies:
     def __init__(self):
         self.max_size = None
+        self.rules: typing.List[StreamRule] = []
+        self.spills: typing.Set[str] = set()
 
     def load(self, loader):
         loader.add_option(
@@ -16,9 +162,35 @@ class StreamBodies:
             """
             Stream data to the client if response body exceeds the given
             threshold. If streamed, the body will not be stored in any way.
+            Bodies of unknown size (e.g. chunked) are buffered as usual, and
+            only streamed once they grow beyond the threshold.
             Understands k/m/g suffixes, i.e. 3m for 3 megabytes.
             """
         )
+        loader.add_option(
+            "stream_rules", typing.Sequence[str], [],
+            """
+            Streaming rules of the form "[/flow-filter]/mode", where the
+            separator can be any character. The mode is one of "stream"
+            (always stream), "buffer" (never stream) or "tee" (stream, and
+            keep a copy as configured by stream_tee_size and
+            stream_tee_spill). The first matching rule wins, and
+            stream_large_bodies applies if no rule matches.
+            """
+        )
+        loader.add_option(
+            "stream_tee_size", str, "1m",
+            """
+            Maximum number of bytes of a teed body that are kept in memory.
+            Understands k/m/g suffixes, i.e. 3m for 3 megabytes.
+            """
+        )
+        loader.add_option(
+            "stream_tee_spill", typing.Optional[str], None,
+            """
+            Directory to which a full copy of every teed body is written.
+            """
+        )
         loader.add_option(
             "stream_websockets", bool, False,
             """
@@ -33,10 +205,50 @@ class StreamBodies:
                 self.max_size = human.parse_size(ctx.options.stream_large_bodies)
             except ValueError as e:
                 raise exceptions.OptionsError(e)
+        if "stream_rules" in updated:
+            rules = []
+            for option in ctx.options.stream_rules:
+                try:
+                    rules.append(parse_stream_rule(option))
+                except ValueError as e:
+                    raise exceptions.OptionsError(f"Cannot parse stream_rules option {option}: {e}") from e
+            self.rules = rules
+        if "stream_tee_size" in updated:
+            try:
+                human.parse_size(ctx.options.stream_tee_size)
+            except ValueError as e:
+                raise exceptions.OptionsError(e)
+        if "stream_tee_spill" in updated and ctx.options.stream_tee_spill:
+            if not os.path.isdir(os.path.expanduser(ctx.options.stream_tee_spill)):
+                raise exceptions.OptionsError(
+                    "stream_tee_spill directory does not exist: %s" % ctx.options.stream_tee_spill
+                )
+
+    def mode(self, f) -> typing.Optional[str]:
+        for rule in self.rules:
+            if rule.matches(f):
+                return rule.mode
+        return None
+
+    def tee(self, f, r, limit):
+        spill_dir = ctx.options.stream_tee_spill
+        if spill_dir:
+            spill_dir = os.path.expanduser(spill_dir)
+        r.stream = Tee(f, r, limit, spill_dir, r.stream, self.spills)
 
     def run(self, f, is_request):
-        if self.max_size:
-            r = f.request if is_request else f.response
+        r = f.request if is_request else f.response
+        if r.raw_content or isinstance(r.stream, http.AddonBody):
+            return
+        mode = self.mode(f)
+        if mode == "buffer":
+            return
+        if mode == "stream":
+            # r.stream may already be a callable, which we want to preserve.
+            r.stream = r.stream or True
+        elif mode == "tee":
+            self.tee(f, r, human.parse_size(ctx.options.stream_tee_size))
+        elif self.max_size:
             try:
                 expected_size = http1.expected_http_body_size(
                     f.request, f.response if not is_request else None
@@ -44,10 +256,20 @@ class StreamBodies:
             except exceptions.HttpException:
                 f.reply.kill()
                 return
-            if expected_size and not r.raw_content and not (0 <= expected_size <= self.max_size):
-                # r.stream may already be a callable, which we want to preserve.
+            if expected_size is None or expected_size < 0:
+                # The size is not known in advance. Buffer the body, so
+                # that hooks still see small ones, and stream it once it
+                # turns out to be large.
+                if not r.stream:
+                    r.stream = http.StreamAbove(self.max_size)
+                return
+            elif expected_size > self.max_size:
                 r.stream = r.stream or True
-                ctx.log.info("Streaming {} {}".format("response from" if not is_request else "request to", f.request.host))
+            else:
+                return
+        else:
+            return
+        ctx.log.info("Streaming {} {}".format("response from" if not is_request else "request to", f.request.host))
 
     def requestheaders(self, f):
         self.run(f, True)
@@ -55,6 +277,11 @@ class StreamBodies:
     def responseheaders(self, f):
         self.run(f, False)
 
+    def done(self):
+        for path in self.spills:
+            remove_spill(path)
+        self.spills.clear()
+
     def websocket_start(self, f):
         if ctx.options.stream_websockets:
             f.stream = True
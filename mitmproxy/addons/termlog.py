@@ -21,6 +21,10 @@ class TermLog:
             choices=log.LogTierOrder
         )
 
+    @property
+    def log_verbosity(self):
+        return ctx.options.termlog_verbosity
+
     def log(self, e):
         if log.log_tier(e.level) == log.log_tier("error"):
             outfile = self.outfile or realstderr
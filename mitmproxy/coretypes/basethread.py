@@ -1,5 +1,8 @@
+import concurrent.futures
+import queue
 import time
 import threading
+import typing
 
 
 class BaseThread(threading.Thread):
@@ -12,3 +15,63 @@ class BaseThread(threading.Thread):
             self.name,
             int(time.time() - self._thread_started)
         )
+
+
+class WorkerPool:
+    """
+        A pool of daemon threads that run submitted calls and are reused
+        across calls. Workers are started on demand, up to max_workers, so
+        that a pool which is never fully used doesn't hold idle threads,
+        and they never keep the interpreter from exiting.
+    """
+
+    def __init__(self, max_workers: int, name: str) -> None:
+        self.max_workers = max_workers
+        self.name = name
+        self.queue: "queue.SimpleQueue" = queue.SimpleQueue()
+        self.lock = threading.Lock()
+        self.workers = 0
+        self.idle = 0
+        self.closed = False
+
+    def submit(self, fn: typing.Callable, *args) -> concurrent.futures.Future:
+        future: concurrent.futures.Future = concurrent.futures.Future()
+        with self.lock:
+            if self.closed:
+                raise RuntimeError("cannot submit to a pool that has been shut down")
+            self.queue.put((future, fn, args))
+            if self.idle:
+                self.idle -= 1
+            elif self.workers < self.max_workers:
+                self.workers += 1
+                BaseThread(
+                    name=f"{self.name}-{self.workers}",
+                    target=self._work,
+                    daemon=True,
+                ).start()
+        return future
+
+    def _work(self) -> None:
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            future, fn, args = item
+            if future.set_running_or_notify_cancel():
+                try:
+                    result = fn(*args)
+                except BaseException as e:
+                    future.set_exception(e)
+                else:
+                    future.set_result(result)
+            with self.lock:
+                self.idle += 1
+
+    def shutdown(self) -> None:
+        """
+            Stop the workers once the calls submitted so far are done.
+        """
+        with self.lock:
+            self.closed = True
+            for _ in range(self.workers):
+                self.queue.put(None)
@@ -1,6 +1,7 @@
 import html
+import os
 import time
-from typing import Optional, Tuple
+from typing import Iterator, Optional, Tuple, Union
 from mitmproxy import flow
 from mitmproxy import version
 from mitmproxy.net import http
@@ -63,6 +64,116 @@ class HTTPFlow(flow.Flow):
         return f
 
 
+class StreamAbove:
+    """
+    Buffer a body of unknown size as usual while it stays within ``limit``
+    bytes, and stream it once it grows beyond that.
+
+    Assign an instance to ``message.stream`` in the requestheaders or
+    responseheaders hook. A body that fits is read completely, and the
+    message is processed like any buffered one (``stream`` is reset to
+    False). A larger body is streamed (``stream`` becomes True), starting
+    with the part that was already read.
+    """
+
+    def __init__(self, limit: int) -> None:
+        self.limit = limit
+
+    def __repr__(self):
+        return f"StreamAbove({self.limit})"
+
+
+class AddonBody:
+    """
+    A response body that an addon provides instead of the server.
+
+    Assign an instance to ``response.stream`` of a response created by an
+    addon (with ``data.content`` left as None). The proxy then sends the
+    chunks of the body to the client.
+    """
+
+    def chunks(self) -> Iterator[bytes]:
+        raise NotImplementedError()
+
+    def __call__(self, chunks):
+        # Behave like a regular stream modifier: the upstream chunks are
+        # replaced by the body.
+        return self.chunks()
+
+
+class FileBody(AddonBody):
+    """
+    A response body that is served from a region of a file on disk.
+
+    Assign an instance to ``response.stream`` of a response created by an
+    addon (with ``data.content`` left as None). The proxy then sends the
+    file directly to the client, using ``socket.sendfile`` where the
+    connection allows it, instead of holding the body in memory.
+    """
+    CHUNK_SIZE = 1024 * 64
+
+    def __init__(self, path: str, offset: int = 0, length: Optional[int] = None) -> None:
+        self.path = path
+        self.offset = offset
+        if length is None:
+            length = os.path.getsize(path) - offset
+        self.length = length
+
+    def chunks(self):
+        remaining = self.length
+        with open(self.path, "rb") as f:
+            f.seek(self.offset)
+            while remaining > 0:
+                chunk = f.read(min(self.CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+
+    def __repr__(self):
+        return f"<FileBody {self.path} [{self.offset}:{self.offset + self.length}]>"
+
+
+class ThrottledBody(AddonBody):
+    """
+    A response body, in memory or a FileBody, that is sent at no more than
+    rate bytes per second, to simulate a slow network.
+
+    The pauses between chunks are taken by the thread that sends the body,
+    which serves this connection only, so the event loop and other
+    connections are not held up.
+    """
+
+    def __init__(self, source: Union[bytes, FileBody], rate: int) -> None:
+        self.source = source
+        self.rate = rate
+        # Chunks of about 50ms each, so that the rate is even.
+        self.chunk_size = max(1024, min(FileBody.CHUNK_SIZE, rate // 20))
+
+    def _pieces(self) -> Iterator[bytes]:
+        if isinstance(self.source, FileBody):
+            for chunk in self.source.chunks():
+                for i in range(0, len(chunk), self.chunk_size):
+                    yield chunk[i:i + self.chunk_size]
+        else:
+            for i in range(0, len(self.source), self.chunk_size):
+                yield self.source[i:i + self.chunk_size]
+
+    def chunks(self):
+        start = time.monotonic()
+        sent = 0
+        for chunk in self._pieces():
+            # A chunk is sent once the time to transfer it at the rate has passed.
+            sent += len(chunk)
+            wait = start + sent / self.rate - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            yield chunk
+
+    def __repr__(self):
+        return f"<ThrottledBody {self.source if isinstance(self.source, FileBody) else len(self.source)} @ {self.rate}B/s>"
+
+
 def make_error_response(
         status_code: int,
         message: str = "",
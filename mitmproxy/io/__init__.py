@@ -1,7 +1,10 @@
 from .io import FlowWriter, FlowReader, FilteredFlowWriter, read_flows_from_paths
 from .db import DBHandler
+from .index import FlowIndex, MappedDump, entry_filter
+from .columnar import ColumnWriter, ColumnReader
 
 
 __all__ = [
-    "FlowWriter", "FlowReader", "FilteredFlowWriter", "read_flows_from_paths", "DBHandler"
+    "FlowWriter", "FlowReader", "FilteredFlowWriter", "read_flows_from_paths", "DBHandler", "FlowIndex",
+    "MappedDump", "entry_filter", "ColumnWriter", "ColumnReader",
 ]
@@ -0,0 +1,161 @@
+"""
+Columnar files for exporting flow fields in bulk.
+
+Exporting the metadata of millions of flows as rows repeats the same few hosts,
+paths and status codes over and over. A columnar file stores the values of a
+batch of rows column by column instead, as a msgpack stream of
+
+    - a header with the column names,
+    - any number of batches, each holding one encoded column per name.
+
+A column is either stored as a plain list of values or dictionary-encoded: the
+batch carries the values that have not been seen in that column before and an
+array of indices into all values seen so far, as Arrow does with delta
+dictionaries. Columns start out dictionary-encoded and fall back to plain lists
+for the rest of the file once they turn out to have too many distinct values,
+such as ids or timestamps.
+
+Values are str or bytes, as returned by the cut addon.
+"""
+import array
+import sys
+import typing
+
+import msgpack
+
+from mitmproxy import exceptions
+
+FORMAT = "mitmproxy-columns"
+FORMAT_VERSION = 1
+
+PLAIN = 0
+DICTIONARY = 1
+
+Value = typing.Union[str, bytes]
+
+
+def _index_array(indices: typing.List[int], size: int) -> typing.Tuple[str, bytes]:
+    # The smallest unsigned type that can hold all indices, little endian.
+    for typecode in "BHIQ":
+        if size <= 1 << (8 * array.array(typecode).itemsize):
+            break
+    arr = array.array(typecode, indices)
+    if sys.byteorder == "big":
+        arr.byteswap()
+    return typecode, arr.tobytes()
+
+
+def _indices(typecode: str, data: bytes) -> array.array:
+    arr = array.array(typecode)
+    arr.frombytes(data)
+    if sys.byteorder == "big":
+        arr.byteswap()
+    return arr
+
+
+class ColumnWriter:
+    """
+        Writes rows to a columnar file in batches of batch_size rows.
+    """
+
+    def __init__(
+        self,
+        fo: typing.BinaryIO,
+        names: typing.Sequence[str],
+        batch_size: int = 16384,
+        max_dictionary: int = 1 << 16,
+    ) -> None:
+        self.fo = fo
+        self.names = list(names)
+        self.batch_size = batch_size
+        self.max_dictionary = max_dictionary
+        self.packer = msgpack.Packer(use_bin_type=True)
+        self.columns: typing.List[typing.List[Value]] = [[] for _ in self.names]
+        # The index of every value written so far by column,
+        # None for columns that are stored plain.
+        self.dictionaries: typing.List[typing.Optional[typing.Dict[Value, int]]] = [{} for _ in self.names]
+        self.rows = 0
+        self.fo.write(self.packer.pack(dict(format=FORMAT, version=FORMAT_VERSION, columns=self.names)))
+
+    def add(self, row: typing.Sequence[Value]) -> None:
+        for column, value in zip(self.columns, row):
+            column.append(value)
+        self.rows += 1
+        if self.rows >= self.batch_size:
+            self.flush()
+
+    def _encode(self, i: int, values: typing.List[Value]) -> list:
+        dictionary = self.dictionaries[i]
+        if dictionary is not None:
+            known = len(dictionary)
+            indices = []
+            for v in values:
+                idx = dictionary.get(v)
+                if idx is None:
+                    idx = dictionary[v] = len(dictionary)
+                indices.append(idx)
+            added = len(dictionary) - known
+            # Mostly distinct values are smaller without the indices.
+            if added <= len(values) // 2 and len(dictionary) <= self.max_dictionary:
+                new = list(dictionary)[known:] if added else []
+                typecode, data = _index_array(indices, len(dictionary))
+                return [DICTIONARY, new, typecode, data]
+            self.dictionaries[i] = None
+        return [PLAIN, values]
+
+    def flush(self) -> None:
+        """
+            Write the rows added so far as a batch.
+        """
+        if not self.rows:
+            return
+        batch = dict(
+            rows=self.rows,
+            columns=[self._encode(i, values) for i, values in enumerate(self.columns)],
+        )
+        self.fo.write(self.packer.pack(batch))
+        self.columns = [[] for _ in self.names]
+        self.rows = 0
+
+
+class ColumnReader:
+    """
+        Reads a columnar file written by ColumnWriter.
+    """
+
+    def __init__(self, fo: typing.BinaryIO) -> None:
+        self.unpacker = msgpack.Unpacker(fo, raw=False, max_buffer_size=0)
+        try:
+            header = next(self.unpacker)
+        except (StopIteration, ValueError, msgpack.UnpackException):
+            raise exceptions.FlowReadException("Invalid columnar file.")
+        if not isinstance(header, dict) or header.get("format") != FORMAT:
+            raise exceptions.FlowReadException("Invalid columnar file.")
+        if header.get("version") != FORMAT_VERSION:
+            raise exceptions.FlowReadException(
+                "Unsupported columnar file version: {}".format(header.get("version"))
+            )
+        self.names: typing.List[str] = header["columns"]
+        self.dictionaries: typing.List[typing.List[Value]] = [[] for _ in self.names]
+
+    def batches(self) -> typing.Iterator[typing.List[typing.List[Value]]]:
+        """
+            Yields the columns of every batch, as lists of values.
+        """
+        try:
+            for batch in self.unpacker:
+                columns = []
+                for dictionary, column in zip(self.dictionaries, batch["columns"]):
+                    if column[0] == DICTIONARY:
+                        _, new, typecode, data = column
+                        dictionary.extend(new)
+                        columns.append([dictionary[i] for i in _indices(typecode, data)])
+                    else:
+                        columns.append(column[1])
+                yield columns
+        except (ValueError, KeyError, IndexError, msgpack.UnpackException):
+            raise exceptions.FlowReadException("Invalid columnar file.")
+
+    def rows(self) -> typing.Iterator[typing.Tuple[Value, ...]]:
+        for columns in self.batches():
+            yield from zip(*columns)
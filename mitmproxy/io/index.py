@@ -0,0 +1,400 @@
+"""
+Sidecar offset index for flow dumps.
+
+A flow dump is a plain concatenation of tnetstring records, so the only way to
+find the n-th flow is to parse everything in front of it. The index stores the
+byte offset and length of every record together with a handful of key fields
+(id, host, method, status code, timestamp) in a file next to the dump
+(``<dump>.idx``). With an index at hand we can
+
+    - seek straight to a single flow,
+    - select flows by their key fields without deserializing the others,
+    - decode ranges of records in parallel in a process pool.
+
+The sidecar is tied to the size and modification time of the dump it was built
+from and is silently rebuilt when either changes.
+
+MappedDump covers the opposite case, where a dump is too large to be read in
+full: it maps the file into memory, decodes records without the values of some
+of their keys, and decodes those values from the mapping on demand. It can also
+build flows with only some of their attributes, which is a lot cheaper than
+building complete flows, connections and certificates included.
+"""
+import concurrent.futures
+import mmap
+import os
+import typing
+
+from mitmproxy import exceptions
+from mitmproxy import flow
+from mitmproxy import flowfilter
+from mitmproxy import stateobject
+from mitmproxy import version
+from mitmproxy.io import compat
+from mitmproxy.io import tnetstring
+from mitmproxy.io.io import FLOW_TYPES
+
+INDEX_SUFFIX = ".idx"
+INDEX_VERSION = 1
+
+
+class IndexEntry(typing.NamedTuple):
+    offset: int
+    length: int
+    id: str
+    host: typing.Optional[str]
+    method: typing.Optional[str]
+    status_code: typing.Optional[int]
+    timestamp: typing.Optional[float]
+
+
+def _migrate(loaded: typing.Any) -> dict:
+    try:
+        mdata = compat.migrate_flow(loaded)
+    except ValueError as e:
+        raise exceptions.FlowReadException(str(e))
+    if mdata["type"] not in FLOW_TYPES:
+        raise exceptions.FlowReadException("Unknown flow type: {}".format(mdata["type"]))
+    return mdata
+
+
+def _entry(offset: int, length: int, state: dict) -> IndexEntry:
+    host = method = status_code = timestamp = None
+    request = state.get("request")
+    if request:
+        host = request["host"]
+        method = request["method"].decode("utf8", "surrogateescape")
+        timestamp = request["timestamp_start"]
+    response = state.get("response")
+    if response:
+        status_code = response["status_code"]
+    return IndexEntry(offset, length, state["id"], host, method, status_code, timestamp)
+
+
+def _decode_range(path: str, entries: typing.Sequence[IndexEntry]) -> typing.List[dict]:
+    """
+    Decode a batch of records to migrated flow states.
+
+    This runs in worker processes, so it returns plain state dicts rather than
+    flows, which are cheap to pickle and fast to rebuild in the parent.
+    """
+    states = []
+    with open(path, "rb") as f:
+        for e in entries:
+            f.seek(e.offset)
+            try:
+                loaded = tnetstring.loads(f.read(e.length))
+            except ValueError:
+                raise exceptions.FlowReadException("Invalid data format.")
+            states.append(_migrate(loaded))
+    return states
+
+
+def _from_state(state: dict) -> flow.Flow:
+    return FLOW_TYPES[state["type"]].from_state(state)
+
+
+EntryPredicate = typing.Callable[[IndexEntry], bool]
+
+
+def _entry_filter(flt) -> typing.Tuple[typing.Optional[EntryPredicate], bool]:
+    if isinstance(flt, flowfilter.FAnd):
+        parts = [_entry_filter(sub) for sub in flt.lst]
+        preds = [p for p, _ in parts if p is not None]
+        if not preds:
+            return None, False
+        return (lambda e: all(p(e) for p in preds)), all(exact for _, exact in parts)
+    if isinstance(flt, flowfilter.FOr):
+        parts = [_entry_filter(sub) for sub in flt.lst]
+        if any(p is None for p, _ in parts):
+            return None, False
+        preds = [p for p, _ in parts]
+        return (lambda e: any(p(e) for p in preds)), all(exact for _, exact in parts)
+    if isinstance(flt, flowfilter.FNot):
+        pred, exact = _entry_filter(flt.itm)
+        if pred is None or not exact:
+            return None, False
+        return (lambda e: not pred(e)), True
+    # Only HTTP flows have a method.
+    if isinstance(flt, flowfilter.FMethod):
+        return (lambda e: e.method is not None and bool(flt.re.search(e.method.encode("utf8", "surrogateescape")))), True
+    if isinstance(flt, flowfilter.FCode):
+        return (lambda e: e.status_code == flt.num), True
+    if isinstance(flt, flowfilter.FReq):
+        return (lambda e: e.method is not None and e.status_code is None), True
+    if isinstance(flt, flowfilter.FResp):
+        return (lambda e: e.status_code is not None), True
+    return None, False
+
+
+def entry_filter(flt) -> typing.Optional[EntryPredicate]:
+    """
+        Translate a flow filter into a predicate over index entries.
+
+        Returns None if no part of the filter can be decided from the key
+        fields. Otherwise the predicate rejects only entries whose flows cannot
+        match, and the filter still has to be applied to the flows of the
+        accepted ones. ~d is left out, it also matches the Host header.
+    """
+    return _entry_filter(flt)[0]
+
+
+class FlowIndex:
+    """
+        Offset index over a flow dump.
+    """
+
+    def __init__(self, path: str, entries: typing.List[IndexEntry]) -> None:
+        self.path = path
+        self.entries = entries
+        self._by_id = {e.id: e for e in entries}
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __iter__(self) -> typing.Iterator[IndexEntry]:
+        return iter(self.entries)
+
+    @staticmethod
+    def _fingerprint(path: str) -> typing.Tuple[int, int]:
+        st = os.stat(path)
+        return st.st_size, st.st_mtime_ns
+
+    @classmethod
+    def build(cls, path: str) -> "FlowIndex":
+        """
+            Scan the dump once and record offsets and key fields of every flow.
+        """
+        entries = []
+        with open(path, "rb") as f:
+            while True:
+                offset = f.tell()
+                try:
+                    loaded = tnetstring.load(f)
+                except ValueError as e:
+                    if str(e) == "not a tnetstring: empty file":
+                        break
+                    raise exceptions.FlowReadException("Invalid data format.")
+                entries.append(_entry(offset, f.tell() - offset, _migrate(loaded)))
+        return cls(path, entries)
+
+    @classmethod
+    def load(cls, path: str) -> typing.Optional["FlowIndex"]:
+        """
+            Load the sidecar index for the given dump.
+            Returns None if there is no index or if it is stale.
+        """
+        try:
+            with open(path + INDEX_SUFFIX, "rb") as f:
+                data = tnetstring.load(f)
+        except (OSError, ValueError):
+            return None
+        if not isinstance(data, dict) or data.get("version") != INDEX_VERSION:
+            return None
+        if list(cls._fingerprint(path)) != data["fingerprint"]:
+            return None
+        return cls(path, [IndexEntry(*e) for e in data["entries"]])
+
+    @classmethod
+    def open(cls, path: str) -> "FlowIndex":
+        """
+            Load the sidecar index, (re)building and saving it if necessary.
+        """
+        path = os.path.expanduser(path)
+        idx = cls.load(path)
+        if idx is None:
+            idx = cls.build(path)
+            try:
+                idx.save()
+            except OSError:
+                pass  # read-only location, the in-memory index is still fine.
+        return idx
+
+    def save(self) -> None:
+        data = dict(
+            version=INDEX_VERSION,
+            fingerprint=list(self._fingerprint(self.path)),
+            entries=[list(e) for e in self.entries],
+        )
+        with open(self.path + INDEX_SUFFIX, "wb") as f:
+            tnetstring.dump(data, f)
+
+    def select(
+        self,
+        host: typing.Optional[str] = None,
+        method: typing.Optional[str] = None,
+        status_code: typing.Optional[int] = None,
+        since: typing.Optional[float] = None,
+        until: typing.Optional[float] = None,
+    ) -> typing.List[IndexEntry]:
+        """
+            Return the entries matching all given key fields.
+            Records are never touched, so non-matching flows cost nothing.
+        """
+        if method is not None:
+            method = method.upper()
+        if host is not None:
+            host = host.lower()
+        ret = []
+        for e in self.entries:
+            if host is not None and (e.host or "").lower() != host:
+                continue
+            if method is not None and e.method != method:
+                continue
+            if status_code is not None and e.status_code != status_code:
+                continue
+            if since is not None and (e.timestamp is None or e.timestamp < since):
+                continue
+            if until is not None and (e.timestamp is None or e.timestamp > until):
+                continue
+            ret.append(e)
+        return ret
+
+    def get(self, flow_id: str) -> typing.Optional[IndexEntry]:
+        return self._by_id.get(flow_id)
+
+    def read(self, entry: IndexEntry) -> flow.Flow:
+        """
+            Deserialize a single flow.
+        """
+        return _from_state(_decode_range(self.path, [entry])[0])
+
+    def stream(
+        self,
+        entries: typing.Optional[typing.Sequence[IndexEntry]] = None,
+        processes: int = 0,
+        chunk_size: int = 256,
+    ) -> typing.Iterable[flow.Flow]:
+        """
+            Yields the flows for the given entries (all by default) in order.
+
+            With processes > 0, record ranges of chunk_size flows are decoded
+            in a process pool of that size.
+        """
+        if entries is None:
+            entries = self.entries
+        chunks = [entries[i:i + chunk_size] for i in range(0, len(entries), chunk_size)]
+        try:
+            if processes > 0 and len(chunks) > 1:
+                with concurrent.futures.ProcessPoolExecutor(processes) as pool:
+                    for states in pool.map(_decode_range, [self.path] * len(chunks), chunks):
+                        yield from (_from_state(s) for s in states)
+            else:
+                for chunk in chunks:
+                    yield from (_from_state(s) for s in _decode_range(self.path, chunk))
+        except OSError as e:
+            raise exceptions.FlowReadException(e.strerror)
+
+
+class Span(typing.NamedTuple):
+    """
+        Location of a value that has not been decoded yet. Records in an older
+        format have to be migrated as a whole, then key names the value in the
+        migrated record.
+    """
+    start: int
+    end: int
+    key: typing.Optional[str] = None
+
+
+class MappedDump:
+    """
+        A flow dump mapped into memory.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = os.path.expanduser(path)
+        self.data: typing.Any = b""
+        try:
+            with open(self.path, "rb") as f:
+                if os.fstat(f.fileno()).st_size:
+                    self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except OSError as e:
+            raise exceptions.FlowReadException(e.strerror)
+
+    def close(self) -> None:
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.data = b""
+
+    def scan(
+        self,
+        lazy: typing.Container[str],
+        decode: typing.Container[str] = (),
+    ) -> typing.Iterator[typing.Tuple[dict, typing.Dict[str, Span]]]:
+        """
+            Yields (state, spans) for every record in the dump.
+
+            The state only has the type, the version and the top-level keys
+            in decode. For the keys in lazy, spans to decode their values
+            later are returned instead, unless the value is null, in which
+            case it is in the state. All other keys are skipped.
+        """
+        data = self.data
+        end = len(data)
+        pos = 0
+        while pos < end:
+            try:
+                start, stop = tnetstring._span(data, pos, end)
+                if data[stop] != ord("}"):
+                    raise ValueError("not a dict")
+                state = {}
+                spans = {}
+                p = start
+                while p < stop:
+                    key, p = tnetstring._decode(data, p, stop)
+                    # A length prefix starting with 0 is an empty value, such
+                    # as null, which is decoded right away.
+                    if key in ("type", "version") or key in decode or (key in lazy and data[p] == ord("0")):
+                        state[key], p = tnetstring._decode(data, p, stop)
+                    else:
+                        _, vstop = tnetstring._span(data, p, stop)
+                        if key in lazy:
+                            spans[key] = Span(p, vstop + 1)
+                        p = vstop + 1
+                if state.get("version") != version.FLOW_FORMAT_VERSION:
+                    # Migrations may need the complete record.
+                    migrated = _migrate(tnetstring._decode(data, pos, stop + 1)[0])
+                    state = {
+                        k: v for k, v in migrated.items()
+                        if k in ("type", "version") or k in decode or (k in lazy and v is None)
+                    }
+                    spans = {
+                        k: Span(pos, stop + 1, k) for k in lazy
+                        if migrated.get(k) is not None
+                    }
+                elif state.get("type") not in FLOW_TYPES:
+                    raise exceptions.FlowReadException("Unknown flow type: {}".format(state.get("type")))
+            except ValueError:
+                raise exceptions.FlowReadException("Invalid data format.")
+            yield state, spans
+            pos = stop + 1
+
+    def partial_flows(self, attrs: typing.Collection[str]) -> typing.Iterator[flow.Flow]:
+        """
+            Yields the flows in the dump with only the given state attributes
+            decoded. All other attributes have the values of a new flow.
+        """
+        for state, _ in self.scan((), attrs):
+            cls = FLOW_TYPES[state["type"]]
+            f = cls(None, None)  # type: ignore
+            for attr in attrs:
+                if attr in state and attr in cls._stateobject_attributes:
+                    try:
+                        value = stateobject.make_object(cls._stateobject_attributes[attr], state[attr])
+                    except (ValueError, TypeError, KeyError):
+                        raise exceptions.FlowReadException("Invalid data format.")
+                    setattr(f, attr, value)
+            yield f
+
+    def decode(self, span: Span) -> typing.Any:
+        """
+            Decode a value that was skipped by scan().
+        """
+        try:
+            value = tnetstring._decode(self.data, span.start, span.end)[0]
+        except ValueError:
+            raise exceptions.FlowReadException("Invalid data format.")
+        if span.key is not None:
+            value = _migrate(value)[span.key]
+        return value
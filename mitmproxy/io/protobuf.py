@@ -110,13 +110,19 @@ def dumps(f: flow.Flow) -> bytes:
 
 def _load_http_request(o: http_pb2.HTTPRequest) -> HTTPRequest:
     d: dict = {}
-    _move_attrs(o, d, ['host', 'port', 'method', 'scheme', 'authority', 'path', 'http_version', 'content',
+    _move_attrs(o, d, ['host', 'port', 'method', 'scheme', 'path', 'http_version', 'content',
                        'timestamp_start', 'timestamp_end'])
     if d['content'] is None:
         d['content'] = b""
+    # The authority is not stored, only the request form it implies.
+    if o.first_line_format in ("authority", "absolute"):
+        d['authority'] = f"{d['host']}:{d['port']}"
+    else:
+        d['authority'] = b""
     d["headers"] = []
     for header in o.headers:
         d["headers"].append((bytes(header.name, "utf-8"), bytes(header.value, "utf-8")))
+    d["trailers"] = None
 
     return HTTPRequest(**d)
 
@@ -130,6 +136,7 @@ def _load_http_response(o: http_pb2.HTTPResponse) -> HTTPResponse:
     d["headers"] = []
     for header in o.headers:
         d["headers"].append((bytes(header.name, "utf-8"), bytes(header.value, "utf-8")))
+    d["trailers"] = None
 
     return HTTPResponse(**d)
 
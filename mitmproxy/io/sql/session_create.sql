@@ -1,22 +1,62 @@
 PRAGMA foreign_keys = ON;
 
-CREATE TABLE flow (
+CREATE TABLE IF NOT EXISTS flow (
 id VARCHAR(36) PRIMARY KEY,
-content BLOB
+content BLOB,
+timestamp REAL,
+method TEXT,
+url TEXT,
+size INTEGER,
+host TEXT,
+pretty_host TEXT,
+pretty_url TEXT,
+status_code INTEGER,
+request_content_type TEXT,
+response_content_type TEXT
 );
 
-CREATE TABLE body (
+CREATE TABLE IF NOT EXISTS body (
 id INTEGER PRIMARY KEY,
 flow_id VARCHAR(36),
 type_id INTEGER,
 content BLOB,
+digest BLOB,
 FOREIGN KEY(flow_id) REFERENCES flow(id)
 );
 
-CREATE TABLE annotation (
+-- Bodies by SHA-256, stored once no matter how many flows carry them.
+-- refs counts the body rows pointing here and is kept up to date by the triggers below.
+CREATE TABLE IF NOT EXISTS content (
+digest BLOB PRIMARY KEY,
+refs INTEGER DEFAULT 0,
+content BLOB
+);
+
+CREATE TABLE IF NOT EXISTS annotation (
 id INTEGER PRIMARY KEY,
 flow_id VARCHAR(36),
 type VARCHAR(16),
 content BLOB,
 FOREIGN KEY(flow_id) REFERENCES flow(id)
 );
+
+CREATE INDEX IF NOT EXISTS flow_timestamp ON flow(timestamp);
+-- ~d and ~m are case-insensitive, so their LIKE predicates can only use NOCASE indexes.
+DROP INDEX IF EXISTS flow_host;
+DROP INDEX IF EXISTS flow_method;
+CREATE INDEX IF NOT EXISTS flow_host_nocase ON flow(host COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS flow_pretty_host_nocase ON flow(pretty_host COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS flow_method_nocase ON flow(method COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS flow_status_code ON flow(status_code);
+CREATE INDEX IF NOT EXISTS body_flow_id ON body(flow_id);
+
+CREATE TRIGGER IF NOT EXISTS body_content_inserted AFTER INSERT ON body WHEN new.digest IS NOT NULL
+BEGIN
+UPDATE content SET refs = refs + 1 WHERE digest = new.digest;
+END;
+
+CREATE TRIGGER IF NOT EXISTS body_content_deleted AFTER DELETE ON body WHEN old.digest IS NOT NULL
+BEGIN
+UPDATE content SET refs = refs - 1 WHERE digest = old.digest;
+DELETE FROM content WHERE digest = old.digest AND refs <= 0;
+END;
@@ -26,7 +26,8 @@ This module gives you the following functions:
 Note that since parsing a tnetstring requires reading all the data into memory
 at once, there's no efficiency gain from using the file-based versions of these
 functions.  They're only here so you can use load() to read precisely one
-item from a file or socket without consuming any extra data.
+item from a file or socket without consuming any extra data. Parsing itself
+works on offsets into the input buffer, so nested values are not copied.
 
 The tnetstrings specification explicitly states that strings are binary blobs
 and forbids the use of unicode at the protocol level.
@@ -40,7 +41,6 @@ all other strings are returned as plain bytes.
 :License: MIT
 """
 
-import collections
 import typing
 
 TSerializable = typing.Union[None, str, bool, int, float, bytes, list, tuple, dict]
@@ -50,11 +50,8 @@ def dumps(value: TSerializable) -> bytes:
     """
     This function dumps a python object as a tnetstring.
     """
-    #  This uses a deque to collect output fragments in reverse order,
-    #  then joins them together at the end.  It's measurably faster
-    #  than creating all the intermediate strings.
-    q: collections.deque = collections.deque()
-    _rdumpq(q, 0, value)
+    q: typing.List[bytes] = []
+    _dumpq(q, value)
     return b''.join(q)
 
 
@@ -66,94 +63,110 @@ def dump(value: TSerializable, file_handle: typing.BinaryIO) -> None:
     file_handle.write(dumps(value))
 
 
-def _rdumpq(q: collections.deque, size: int, value: TSerializable) -> int:
-    """
-    Dump value as a tnetstring, to a deque instance, last chunks first.
+_END = object()
+
+
+def _dict_items(value: dict) -> typing.Iterator:
+    for k, v in value.items():
+        yield v
+        yield k
+
 
-    This function generates the tnetstring representation of the given value,
-    pushing chunks of the output onto the given deque instance.  It pushes
-    the last chunk first, then recursively generates more chunks.
+def _dumpq(q: typing.List[bytes], value: TSerializable) -> None:
+    """
+    Dump value as a tnetstring into the list q.
 
-    When passed in the current size of the string in the queue, it will return
-    the new size of the string in the queue.
+    This is an iterative version of the classic last-chunk-first encoder:
+    chunks are appended in reverse order, so that the length prefix of a
+    container can be emitted as soon as all of its items have been written,
+    without building intermediate strings or recursing. The list is reversed
+    in place once the outermost value is complete.
 
-    Operating last-chunk-first makes it easy to calculate the size written
-    for recursive structures without having to build their representation as
-    a string.  This is measurably faster than generating the intermediate
-    strings, especially on deeply nested structures.
+    Dictionary items are emitted in reverse insertion order, which keeps the
+    output byte-for-byte identical to what previous versions produced.
     """
-    write = q.appendleft
-    if value is None:
-        write(b'0:~')
-        return size + 3
-    elif value is True:
-        write(b'4:true!')
-        return size + 7
-    elif value is False:
-        write(b'5:false!')
-        return size + 8
-    elif isinstance(value, int):
-        data = str(value).encode()
-        ldata = len(data)
-        span = str(ldata).encode()
-        write(b'%s:%s#' % (span, data))
-        return size + 2 + len(span) + ldata
-    elif isinstance(value, float):
-        #  Use repr() for float rather than str().
-        #  It round-trips more accurately.
-        #  Probably unnecessary in later python versions that
-        #  use David Gay's ftoa routines.
-        data = repr(value).encode()
-        ldata = len(data)
-        span = str(ldata).encode()
-        write(b'%s:%s^' % (span, data))
-        return size + 2 + len(span) + ldata
-    elif isinstance(value, bytes):
-        data = value
-        ldata = len(data)
-        span = str(ldata).encode()
-        write(b',')
-        write(data)
-        write(b':')
-        write(span)
-        return size + 2 + len(span) + ldata
-    elif isinstance(value, str):
-        data = value.encode("utf8")
-        ldata = len(data)
-        span = str(ldata).encode()
-        write(b';')
-        write(data)
-        write(b':')
-        write(span)
-        return size + 2 + len(span) + ldata
-    elif isinstance(value, (list, tuple)):
-        write(b']')
-        init_size = size = size + 1
-        for item in reversed(value):
-            size = _rdumpq(q, size, item)
-        span = str(size - init_size).encode()
-        write(b':')
-        write(span)
-        return size + 1 + len(span)
-    elif isinstance(value, dict):
-        write(b'}')
-        init_size = size = size + 1
-        for (k, v) in value.items():
-            size = _rdumpq(q, size, v)
-            size = _rdumpq(q, size, k)
-        span = str(size - init_size).encode()
-        write(b':')
-        write(span)
-        return size + 1 + len(span)
-    else:
-        raise ValueError("unserializable object: {} ({})".format(value, type(value)))
+    append = q.append
+    stack: typing.List[typing.Tuple[typing.Iterator, int]] = []
+    size = 0
+    while True:
+        t = type(value)
+        if t is bytes:
+            span = b'%d:' % len(value)  # type: ignore
+            append(b',')
+            append(value)  # type: ignore
+            append(span)
+            size += len(span) + len(value) + 1  # type: ignore
+        elif t is str:
+            data = value.encode("utf8")  # type: ignore
+            span = b'%d:' % len(data)
+            append(b';')
+            append(data)
+            append(span)
+            size += len(span) + len(data) + 1
+        elif t is dict:
+            append(b'}')
+            size += 1
+            stack.append((_dict_items(value), size))  # type: ignore
+        elif t is list or t is tuple:
+            append(b']')
+            size += 1
+            stack.append((reversed(value), size))  # type: ignore
+        elif value is None:
+            append(b'0:~')
+            size += 3
+        elif value is True:
+            append(b'4:true!')
+            size += 7
+        elif value is False:
+            append(b'5:false!')
+            size += 8
+        elif isinstance(value, int):
+            data = b'%d' % value
+            data = b'%d:%s#' % (len(data), data)
+            append(data)
+            size += len(data)
+        elif isinstance(value, float):
+            #  Use repr() for float rather than str().
+            #  It round-trips more accurately.
+            data = repr(value).encode()
+            data = b'%d:%s^' % (len(data), data)
+            append(data)
+            size += len(data)
+        elif isinstance(value, (bytes, str, dict, list, tuple)):
+            # subclasses take the slow path.
+            value = _coerce(value)
+            continue
+        else:
+            raise ValueError("unserializable object: {} ({})".format(value, type(value)))
+
+        while stack:
+            items, init_size = stack[-1]
+            value = next(items, _END)
+            if value is not _END:
+                break
+            stack.pop()
+            span = b'%d:' % (size - init_size)
+            append(span)
+            size += len(span)
+        else:
+            q.reverse()
+            return
+
+
+def _coerce(value):
+    for t in (bytes, str, dict, list):
+        if isinstance(value, t):
+            return t(value)
+    return tuple(value)
 
 
 def loads(string: bytes) -> TSerializable:
     """
     This function parses a tnetstring into a python object.
     """
-    return pop(string)[0]
+    if isinstance(string, (bytearray, memoryview)):
+        string = bytes(string)
+    return _decode(string, 0, len(string))[0]
 
 
 def load(file_handle: typing.BinaryIO) -> TSerializable:
@@ -184,6 +197,12 @@ def load(file_handle: typing.BinaryIO) -> TSerializable:
 
 
 def parse(data_type: int, data: bytes) -> TSerializable:
+    if data_type == ord(b']') or data_type == ord(b'}'):
+        return _parse_container(data_type, data, 0, len(data))
+    return _parse_scalar(data_type, data)
+
+
+def _parse_scalar(data_type: int, data: bytes) -> TSerializable:
     if data_type == ord(b','):
         return data
     if data_type == ord(b';'):
@@ -209,42 +228,87 @@ def parse(data_type: int, data: bytes) -> TSerializable:
         if data:
             raise ValueError(f"not a tnetstring: invalid null literal: {data!r}")
         return None
-    if data_type == ord(b']'):
+    raise ValueError(f"unknown type tag: {data_type}")
+
+
+def _parse_container(data_type: int, data: bytes, start: int, stop: int) -> TSerializable:
+    if data_type == 93:  # b']'
         l = []
-        while data:
-            item, data = pop(data)
-            l.append(item)  # type: ignore
+        while start < stop:
+            item, start = _decode(data, start, stop)
+            l.append(item)
         return l
-    if data_type == ord(b'}'):
-        d = {}
-        while data:
-            key, data = pop(data)
-            val, data = pop(data)
-            d[key] = val  # type: ignore
-        return d
-    raise ValueError(f"unknown type tag: {data_type}")
+    d = {}
+    while start < stop:
+        key, start = _decode(data, start, stop)
+        val, start = _decode(data, start, stop)
+        d[key] = val  # type: ignore
+    return d
 
 
-def pop(data: bytes) -> typing.Tuple[TSerializable, bytes]:
+def _decode(data: bytes, pos: int, end: int) -> typing.Tuple[TSerializable, int]:
     """
-    This function parses a tnetstring into a python object.
-    It returns a tuple giving the parsed object and a string
-    containing any unparsed data from the end of the string.
+    Parse the tnetstring starting at data[pos], which must end before data[end].
+    Returns the parsed object and the offset just behind it.
+
+    This works on offsets into one shared buffer, so nested values never copy
+    the data that follows them - only leaf values are sliced out. Any buffer
+    supporting find() and slicing to bytes works, e.g. bytes or mmap.mmap.
     """
-    #  Parse out data length, type and remaining string.
+    colon = data.find(b':', pos, end)
     try:
-        blength, data = data.split(b':', 1)
-        length = int(blength)
+        if colon < 0:
+            raise ValueError
+        length = int(data[pos:colon])
+        if length < 0:
+            raise ValueError
     except ValueError:
-        raise ValueError(f"not a tnetstring: missing or invalid length prefix: {data!r}")
+        raise ValueError(f"not a tnetstring: missing or invalid length prefix: {data[pos:min(end, pos + 32)]!r}")
+    start = colon + 1
+    stop = start + length
+    if stop >= end:
+        raise ValueError(f"not a tnetstring: invalid length prefix: {length}")
+    data_type = data[stop]
+    # Fast paths for the most common types, see _parse_scalar for the rest.
+    if data_type == 44:  # b','
+        return data[start:stop], stop + 1
+    if data_type == 59:  # b';'
+        return data[start:stop].decode("utf8"), stop + 1
+    if data_type == 93 or data_type == 125:  # b']', b'}'
+        return _parse_container(data_type, data, start, stop), stop + 1
+    return _parse_scalar(data_type, data[start:stop]), stop + 1
+
+
+def _span(data: bytes, pos: int, end: int) -> typing.Tuple[int, int]:
+    """
+    Locate the tnetstring starting at data[pos] without parsing its value.
+    Returns the offsets of its payload and of its type tag, the tnetstring
+    ends just behind the type tag.
+    """
+    colon = data.find(b':', pos, end)
     try:
-        data, data_type, remain = data[:length], data[length], data[length + 1:]
-    except IndexError:
-        #  This fires if len(data) < dlen, meaning we don't need
-        #  to further validate that data is the right length.
+        if colon < 0:
+            raise ValueError
+        length = int(data[pos:colon])
+        if length < 0:
+            raise ValueError
+    except ValueError:
+        raise ValueError(f"not a tnetstring: missing or invalid length prefix: {data[pos:min(end, pos + 32)]!r}")
+    start = colon + 1
+    stop = start + length
+    if stop >= end:
         raise ValueError(f"not a tnetstring: invalid length prefix: {length}")
-    # Parse the data based on the type tag.
-    return parse(data_type, data), remain
+    return start, stop
+
+
+def pop(data: bytes) -> typing.Tuple[TSerializable, bytes]:
+    """
+    This function parses a tnetstring into a python object.
+    It returns a tuple giving the parsed object and a string
+    containing any unparsed data from the end of the string.
+    """
+    value, end = _decode(data, 0, len(data))
+    return value, data[end:]
 
 
 __all__ = ["dump", "dumps", "load", "loads", "pop"]
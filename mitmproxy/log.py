@@ -1,64 +1,199 @@
 import asyncio
+import collections
+import time
+import typing
+
+from mitmproxy import addonmanager
 
 
 class LogEntry:
-    def __init__(self, msg, level):
-        self.msg = msg
+    """
+        A log entry. If args are given, msg is formatted with them (using %)
+        the first time it is accessed, so that entries which are never
+        displayed are never formatted.
+    """
+    def __init__(self, msg, level, args=()):
+        self._msg = msg
+        self.args = args
         self.level = level
 
+    @property
+    def msg(self):
+        if self.args:
+            self._msg = self._msg % self.args
+            self.args = ()
+        return self._msg
+
+    @msg.setter
+    def msg(self, value):
+        self._msg = value
+        self.args = ()
+
     def __eq__(self, other):
         if isinstance(other, LogEntry):
-            return self.__dict__ == other.__dict__
+            return (self.msg, self.level) == (other.msg, other.level)
         return False
 
     def __repr__(self):
         return f"LogEntry({self.msg}, {self.level})"
 
 
+class Sampler:
+    """
+        Decide which occurrences of a frequent event are worth logging: the
+        first one for each key, and every n-th after that.
+    """
+    def __init__(self, every: int, max_keys: int = 10000):
+        self.every = every
+        self.max_keys = max_keys
+        self.counts: typing.Dict[typing.Hashable, int] = {}
+
+    def __call__(self, key: typing.Hashable) -> bool:
+        if self.every <= 0:
+            return False
+        n = self.counts.get(key, 0)
+        if n == 0 and len(self.counts) >= self.max_keys:
+            self.counts.clear()
+        self.counts[key] = n + 1
+        return n % self.every == 0
+
+
 class Log:
     """
         The central logger, exposed to scripts as mitmproxy.ctx.log.
+
+        Entries are delivered to all addons implementing the log event. An
+        addon can declare the most verbose level it cares about with a
+        log_verbosity attribute (one of LogTierOrder); entries that no addon
+        wants are dropped before they are formatted or scheduled.
+
+        Identical entries repeated within DEDUP_WINDOW seconds are delivered
+        once, followed by a summary of how often they were repeated.
     """
+    DEDUP_WINDOW = 1.0
+
     def __init__(self, master):
         self.master = master
+        self._tier: typing.Optional[int] = None
+        # (level, msg) -> [window start, suppressed count]
+        self._repeats: typing.Dict[typing.Tuple[str, str], typing.List] = collections.OrderedDict()
+        self._flush_scheduled = False
+        master.options.changed.connect(self._options_changed)
+
+    def _options_changed(self, options, updated):
+        self.invalidate()
+
+    def invalidate(self):
+        """
+            Recompute the wanted log level on the next call, e.g. because
+            addons or options have changed.
+        """
+        self._tier = None
+
+    def _compute_tier(self) -> int:
+        tier = None
+        for a in addonmanager.traverse(self.master.addons.chain):
+            if callable(getattr(a, "log", None)):
+                t = log_tier(getattr(a, "log_verbosity", "debug"))
+                if t is not None and (tier is None or t > tier):
+                    tier = t
+        if tier is None:
+            # Nobody is listening through the addon chain, but the master
+            # may still be interested.
+            tier = log_tier("debug")
+        return tier
+
+    def wants(self, level) -> bool:
+        """
+            Returns True if any log sink would receive entries of this level.
+        """
+        tier = self._tier
+        if tier is None:
+            tier = self._tier = self._compute_tier()
+        return log_tier(level) <= tier
 
-    def debug(self, txt):
+    def debug(self, txt, *args):
         """
             Log with level debug.
         """
-        self(txt, "debug")
+        self(txt, "debug", *args)
 
-    def info(self, txt):
+    def info(self, txt, *args):
         """
             Log with level info.
         """
-        self(txt, "info")
+        self(txt, "info", *args)
 
-    def alert(self, txt):
+    def alert(self, txt, *args):
         """
             Log with level alert. Alerts have the same urgency as info, but
             signals to interactive tools that the user's attention should be
             drawn to the output even if they're not currently looking at the
             event log.
         """
-        self(txt, "alert")
+        self(txt, "alert", *args)
 
-    def warn(self, txt):
+    def warn(self, txt, *args):
         """
             Log with level warn.
         """
-        self(txt, "warn")
+        self(txt, "warn", *args)
 
-    def error(self, txt):
+    def error(self, txt, *args):
         """
             Log with level error.
         """
-        self(txt, "error")
+        self(txt, "error", *args)
+
+    def __call__(self, text, level="info", *args):
+        if not self.wants(level):
+            return
+        self.add(LogEntry(text, level, args))
 
-    def __call__(self, text, level="info"):
-        asyncio.get_event_loop().call_soon(
-            self.master.addons.trigger, "log", LogEntry(text, level)
-        )
+    def add(self, entry: LogEntry):
+        """
+            Deliver an entry to the log sinks. Can be called from any thread.
+        """
+        try:
+            self.master.channel.loop.call_soon_threadsafe(self._deliver, entry)
+        except RuntimeError:  # event loop has been closed
+            pass
+
+    def _deliver(self, entry: LogEntry):
+        key = (entry.level, entry.msg)
+        now = time.monotonic()
+        repeat = self._repeats.get(key)
+        if repeat is not None and now - repeat[0] < self.DEDUP_WINDOW:
+            repeat[1] += 1
+            return
+        if repeat is not None:
+            self._emit_repeats(key, repeat)
+        self._repeats[key] = [now, 0]
+        self._repeats.move_to_end(key)
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            asyncio.get_event_loop().call_later(self.DEDUP_WINDOW, self._flush_repeats)
+        self.master.addons.trigger("log", entry)
+
+    def _emit_repeats(self, key, repeat):
+        if repeat[1]:
+            level, msg = key
+            self.master.addons.trigger(
+                "log", LogEntry("%s [repeated %d times]", level, (msg, repeat[1]))
+            )
+
+    def _flush_repeats(self):
+        self._flush_scheduled = False
+        now = time.monotonic()
+        while self._repeats:
+            key, repeat = next(iter(self._repeats.items()))
+            if now - repeat[0] < self.DEDUP_WINDOW:
+                break
+            del self._repeats[key]
+            self._emit_repeats(key, repeat)
+        if self._repeats:
+            self._flush_scheduled = True
+            asyncio.get_event_loop().call_later(self.DEDUP_WINDOW, self._flush_repeats)
 
 
 LogTierOrder = [
@@ -70,5 +205,8 @@ LogTierOrder = [
 ]
 
 
+_LOG_TIERS = dict(error=0, warn=1, info=2, alert=2, debug=3)
+
+
 def log_tier(level):
-    return dict(error=0, warn=1, info=2, alert=2, debug=3).get(level)
+    return _LOG_TIERS.get(level)
@@ -4,6 +4,7 @@ Utility functions for decoding response bodies.
 
 import codecs
 import collections
+import threading
 from io import BytesIO
 
 import gzip
@@ -13,14 +14,100 @@ import zstandard as zstd
 
 from typing import Union, Optional, AnyStr, overload  # noqa
 
-# We have a shared single-element cache for encoding and decoding.
+# We have a shared cache for encoding and decoding.
 # This is quite useful in practice, e.g.
 # flow.request.content = flow.request.content.replace(b"foo", b"bar")
-# does not require an .encode() call if content does not contain b"foo"
+# does not require an .encode() call if content does not contain b"foo",
+# and repeatedly decoding the same body (filters, content views, web UI) is free.
 CachedDecode = collections.namedtuple(
     "CachedDecode", "encoded encoding errors decoded"
 )
-_cache = CachedDecode(None, None, None, None)
+
+# Only these encodings are expensive enough to be worth caching.
+_CACHED_ENCODINGS = ("gzip", "deflate", "br", "zstd")
+
+
+class _CodecCache:
+    """
+    A bounded, thread-safe LRU cache of CachedDecode entries.
+
+    Every entry can be looked up by its encoded side (for decode) and by its decoded side (for encode).
+    Keys use the hash of the bytes object, which Python computes once per object and then caches,
+    so lookups don't compare whole bodies unless the hashes match.
+    Both keys of an entry account for its full size, which keeps the byte budget conservative.
+    """
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: "collections.OrderedDict[tuple, CachedDecode]" = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _entry_size(entry: CachedDecode) -> int:
+        return len(entry.encoded) + len(entry.decoded)
+
+    def get(self, side: int, data: bytes, encoding: str, errors: str) -> Optional[CachedDecode]:
+        # side is the index of data in CachedDecode: 0 for the encoded, 3 for the decoded value.
+        key = (side, hash(data), len(data), encoding, errors)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[side] == data:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+            return None
+
+    def put(self, entry: CachedDecode) -> None:
+        size = self._entry_size(entry)
+        if size > self.max_bytes // 4:
+            return
+        with self._lock:
+            for side in (0, 3):
+                data = entry[side]
+                key = (side, hash(data), len(data), entry.encoding, entry.errors)
+                old = self._entries.pop(key, None)
+                if old is not None:
+                    self.size -= self._entry_size(old)
+                self._entries[key] = entry
+                self.size += size
+            while self.size > self.max_bytes:
+                _, old = self._entries.popitem(last=False)
+                self.size -= self._entry_size(old)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+            self.hits = 0
+            self.misses = 0
+
+    def info(self) -> dict:
+        with self._lock:
+            return dict(
+                hits=self.hits,
+                misses=self.misses,
+                entries=len(self._entries),
+                size=self.size,
+                max_bytes=self.max_bytes,
+            )
+
+
+_cache = _CodecCache(64 * 2 ** 20)
+
+
+def cache_info() -> dict:
+    """
+    Returns hit/miss counters and the current size of the shared codec cache.
+    """
+    return _cache.info()
+
+
+def cache_clear() -> None:
+    _cache.clear()
 
 
 @overload
@@ -53,22 +140,18 @@ def decode(
     if encoded is None:
         return None
 
-    global _cache
-    cached = (
-            isinstance(encoded, bytes) and
-            _cache.encoded == encoded and
-            _cache.encoding == encoding and
-            _cache.errors == errors
-    )
-    if cached:
-        return _cache.decoded
+    cacheable = isinstance(encoded, bytes) and encoding in _CACHED_ENCODINGS
+    if cacheable:
+        cached = _cache.get(0, encoded, encoding, errors)  # type: ignore
+        if cached:
+            return cached.decoded
     try:
         try:
             decoded = custom_decode[encoding](encoded)
         except KeyError:
             decoded = codecs.decode(encoded, encoding, errors)  # type: ignore
-        if encoding in ("gzip", "deflate", "br", "zstd"):
-            _cache = CachedDecode(encoded, encoding, errors, decoded)
+        if cacheable:
+            _cache.put(CachedDecode(encoded, encoding, errors, decoded))
         return decoded
     except TypeError:
         raise
@@ -109,22 +192,18 @@ def encode(decoded: Union[None, str, bytes], encoding, errors='strict') -> Union
     if decoded is None:
         return None
 
-    global _cache
-    cached = (
-            isinstance(decoded, bytes) and
-            _cache.decoded == decoded and
-            _cache.encoding == encoding and
-            _cache.errors == errors
-    )
-    if cached:
-        return _cache.encoded
+    cacheable = isinstance(decoded, bytes) and encoding in _CACHED_ENCODINGS
+    if cacheable:
+        cached = _cache.get(3, decoded, encoding, errors)  # type: ignore
+        if cached:
+            return cached.encoded
     try:
         try:
             encoded = custom_encode[encoding](decoded)
         except KeyError:
             encoded = codecs.encode(decoded, encoding, errors)  # type: ignore
-        if encoding in ("gzip", "deflate", "br", "zstd"):
-            _cache = CachedDecode(encoded, encoding, errors, decoded)
+        if cacheable:
+            _cache.put(CachedDecode(encoded, encoding, errors, decoded))
         return encoded
     except TypeError:
         raise
@@ -211,6 +290,157 @@ def encode_deflate(content: bytes) -> bytes:
     return zlib.compress(content)
 
 
+class _StreamIdentity:
+    def process(self, data: bytes) -> bytes:
+        return data
+
+    def flush(self) -> bytes:
+        return b""
+
+
+class _StreamZlibDecoder:
+    def __init__(self, wbits: int) -> None:
+        self.obj = zlib.decompressobj(wbits)
+
+    def process(self, data: bytes) -> bytes:
+        return self.obj.decompress(data)
+
+    def flush(self) -> bytes:
+        return self.obj.flush()
+
+
+class _StreamDeflateDecoder:
+    """
+        Like decode_deflate, accepts data with or without a zlib header.
+    """
+
+    def __init__(self) -> None:
+        self.obj = None
+        self.pending = b""
+
+    def process(self, data: bytes) -> bytes:
+        if self.obj is None:
+            data = self.pending + data
+            if len(data) < 2:
+                self.pending = data
+                return b""
+            has_header = data[0] & 0x0F == 8 and (data[0] << 8 | data[1]) % 31 == 0
+            self.obj = zlib.decompressobj(zlib.MAX_WBITS if has_header else -zlib.MAX_WBITS)
+        return self.obj.decompress(data)
+
+    def flush(self) -> bytes:
+        if self.obj is None:
+            return decode_deflate(self.pending)
+        return self.obj.flush()
+
+
+class _StreamZlibEncoder:
+    def __init__(self, wbits: int) -> None:
+        self.obj = zlib.compressobj(wbits=wbits)
+
+    def process(self, data: bytes) -> bytes:
+        return self.obj.compress(data) + self.obj.flush(zlib.Z_SYNC_FLUSH)
+
+    def flush(self) -> bytes:
+        return self.obj.flush()
+
+
+class _StreamBrotliDecoder:
+    def __init__(self) -> None:
+        self.obj = brotli.Decompressor()
+
+    def process(self, data: bytes) -> bytes:
+        return self.obj.process(data)
+
+    def flush(self) -> bytes:
+        return b""
+
+
+class _StreamBrotliEncoder:
+    def __init__(self) -> None:
+        self.obj = brotli.Compressor()
+
+    def process(self, data: bytes) -> bytes:
+        return self.obj.process(data) + self.obj.flush()
+
+    def flush(self) -> bytes:
+        return self.obj.finish()
+
+
+class _StreamZstdDecoder:
+    def __init__(self) -> None:
+        self.obj = zstd.ZstdDecompressor().decompressobj()
+
+    def process(self, data: bytes) -> bytes:
+        return self.obj.decompress(data)
+
+    def flush(self) -> bytes:
+        return b""
+
+
+class _StreamZstdEncoder:
+    def __init__(self) -> None:
+        self.obj = zstd.ZstdCompressor().compressobj()
+
+    def process(self, data: bytes) -> bytes:
+        return self.obj.compress(data) + self.obj.flush(zstd.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def flush(self) -> bytes:
+        return self.obj.flush()
+
+
+class StreamCodec:
+    """
+        Decodes or encodes a body chunk by chunk, for bodies that are
+        streamed. Every chunk passed to an encoder is flushed, so that the
+        peer can decode the data sent so far.
+    """
+
+    def __init__(self, codec, encoding: str, action: str) -> None:
+        self.codec = codec
+        self.encoding = encoding
+        self.action = action
+
+    def _call(self, f, *args) -> bytes:
+        try:
+            return f(*args)
+        except Exception as e:
+            raise ValueError("{} when {} a stream with {}: {}".format(
+                type(e).__name__,
+                self.action,
+                repr(self.encoding),
+                repr(e),
+            ))
+
+    def process(self, data: bytes) -> bytes:
+        return self._call(self.codec.process, data)
+
+    def flush(self) -> bytes:
+        return self._call(self.codec.flush)
+
+
+def stream_decoder(encoding: str) -> StreamCodec:
+    """
+    Raises:
+        ValueError, if the encoding cannot be decoded incrementally.
+    """
+    try:
+        return StreamCodec(stream_decoders[encoding](), encoding, "decoding")
+    except KeyError:
+        raise ValueError(f"Cannot decode a stream with {encoding!r}.")
+
+
+def stream_encoder(encoding: str) -> StreamCodec:
+    """
+    Raises:
+        ValueError, if the encoding cannot be encoded incrementally.
+    """
+    try:
+        return StreamCodec(stream_encoders[encoding](), encoding, "encoding")
+    except KeyError:
+        raise ValueError(f"Cannot encode a stream with {encoding!r}.")
+
+
 custom_decode = {
     "none": identity,
     "identity": identity,
@@ -230,4 +460,23 @@ custom_encode = {
     "zstd": encode_zstd,
 }
 
-__all__ = ["encode", "decode"]
+stream_decoders = {
+    "none": _StreamIdentity,
+    "identity": _StreamIdentity,
+    "gzip": lambda: _StreamZlibDecoder(16 + zlib.MAX_WBITS),
+    "deflate": _StreamDeflateDecoder,
+    "deflateRaw": _StreamDeflateDecoder,
+    "br": _StreamBrotliDecoder,
+    "zstd": _StreamZstdDecoder,
+}
+stream_encoders = {
+    "none": _StreamIdentity,
+    "identity": _StreamIdentity,
+    "gzip": lambda: _StreamZlibEncoder(16 + zlib.MAX_WBITS),
+    "deflate": lambda: _StreamZlibEncoder(zlib.MAX_WBITS),
+    "deflateRaw": lambda: _StreamZlibEncoder(zlib.MAX_WBITS),
+    "br": _StreamBrotliEncoder,
+    "zstd": _StreamZstdEncoder,
+}
+
+__all__ = ["encode", "decode", "stream_decoder", "stream_encoder"]
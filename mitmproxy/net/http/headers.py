@@ -1,5 +1,5 @@
 import collections
-from typing import Dict, Optional, Tuple
+from typing import Dict, List, Optional, Tuple
 
 from mitmproxy.coretypes import multidict
 from mitmproxy.utils import strutils
@@ -63,6 +63,10 @@ class Headers(multidict.MultiDict):
 
     Caveats:
         For use with the "Set-Cookie" header, see :py:meth:`get_all`.
+
+    Lookups go through an index from lowercased names to field positions,
+    and the HTTP1 header block is cached. Both are built lazily and dropped
+    whenever ``fields`` is reassigned, which is the only way to change it.
     """
 
     def __init__(self, fields=(), **headers):
@@ -89,6 +93,34 @@ class Headers(multidict.MultiDict):
         }
         self.update(headers)
 
+    @property
+    def fields(self):
+        return self._fields
+
+    @fields.setter
+    def fields(self, value):
+        self._fields = value
+        self._index: Optional[Dict[bytes, List[int]]] = None
+        self._bytes: Optional[bytes] = None
+
+    def _get_index(self) -> Dict[bytes, List[int]]:
+        if self._index is None:
+            index: Dict[bytes, List[int]] = {}
+            for i, (name, _) in enumerate(self._fields):
+                index.setdefault(name.lower(), []).append(i)
+            self._index = index
+        return self._index
+
+    def copy(self) -> "Headers":
+        # The fields are an immutable tuple and are shared with the copy,
+        # together with the cached header block. set_all() extends the index
+        # in place, so the copy gets its own.
+        h = type(self).__new__(type(self))
+        h._fields = self._fields
+        h._index = dict(self._index) if self._index is not None else None
+        h._bytes = self._bytes
+        return h
+
     @staticmethod
     def _reduce_values(values):
         # Headers can be folded
@@ -100,18 +132,28 @@ class Headers(multidict.MultiDict):
         return key.lower()
 
     def __bytes__(self):
-        if self.fields:
-            return b"\r\n".join(b": ".join(field) for field in self.fields) + b"\r\n"
-        else:
-            return b""
+        if self._bytes is None:
+            if self.fields:
+                self._bytes = b"\r\n".join(b": ".join(field) for field in self.fields) + b"\r\n"
+            else:
+                self._bytes = b""
+        return self._bytes
 
     def __delitem__(self, key):
         key = _always_bytes(key)
         super().__delitem__(key)
 
+    def __contains__(self, key):
+        return _always_bytes(key).lower() in self._get_index()
+
+    def __len__(self):
+        return len(self._get_index())
+
     def __iter__(self):
-        for x in super().__iter__():
-            yield _native(x)
+        # The index preserves the order of first occurrence.
+        fields = self.fields
+        for positions in list(self._get_index().values()):
+            yield _native(fields[positions[0]][0])
 
     def get_all(self, name):
         """
@@ -119,10 +161,10 @@ class Headers(multidict.MultiDict):
         This is useful for Set-Cookie headers, which do not support folding.
         See also: https://tools.ietf.org/html/rfc7230#section-3.2.2
         """
-        name = _always_bytes(name)
+        positions = self._get_index().get(_always_bytes(name).lower(), ())
+        fields = self.fields
         return [
-            _native(x) for x in
-            super().get_all(name)
+            _native(fields[i][1]) for i in positions
         ]
 
     def set_all(self, name, values):
@@ -132,7 +174,28 @@ class Headers(multidict.MultiDict):
         """
         name = _always_bytes(name)
         values = [_always_bytes(x) for x in values]
-        return super().set_all(name, values)
+        index = self._get_index()
+        key = name.lower()
+        positions = index.get(key, [])
+        fields = list(self.fields)
+        for i, value in zip(positions, values):
+            fields[i] = (fields[i][0], value)
+        if len(positions) == len(values):
+            # Same positions, the index stays valid.
+            self._fields = tuple(fields)
+            self._bytes = None
+        elif not positions:
+            # Only appended fields, extend the index.
+            fields.extend((name, value) for value in values)
+            self._fields = tuple(fields)
+            self._bytes = None
+            index[key] = list(range(len(fields) - len(values), len(fields)))
+        else:
+            for i in positions[len(values):]:
+                fields[i] = None
+            fields = [field for field in fields if field is not None]
+            fields.extend((name, value) for value in values[len(positions):])
+            self.fields = tuple(fields)
 
     def insert(self, index, key, value):
         key = _always_bytes(key)
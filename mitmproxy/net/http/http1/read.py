@@ -9,6 +9,9 @@ from mitmproxy.net.http import request
 from mitmproxy.net.http import response
 from mitmproxy.net.http import url
 
+# Message heads that fit into this many bytes are read with a single peek.
+HEAD_PEEK_SIZE = 1024 * 32
+
 
 def get_header_tokens(headers, key):
     """
@@ -49,8 +52,13 @@ def read_request_head(rfile):
     if hasattr(rfile, "reset_timestamps"):
         rfile.reset_timestamps()
 
-    host, port, method, scheme, authority, path, http_version = _read_request_line(rfile)
-    headers = _read_headers(rfile)
+    lines = _read_head(rfile)
+    if lines is None:
+        host, port, method, scheme, authority, path, http_version = _read_request_line(rfile)
+        headers = _read_headers(rfile)
+    else:
+        host, port, method, scheme, authority, path, http_version = _parse_request_line(lines[0].strip())
+        headers = _parse_headers(lines[1:], b"\r\n")
 
     if hasattr(rfile, "first_byte_timestamp"):
         # more accurate timestamp_start
@@ -89,8 +97,13 @@ def read_response_head(rfile):
     if hasattr(rfile, "reset_timestamps"):
         rfile.reset_timestamps()
 
-    http_version, status_code, message = _read_response_line(rfile)
-    headers = _read_headers(rfile)
+    lines = _read_head(rfile)
+    if lines is None:
+        http_version, status_code, message = _read_response_line(rfile)
+        headers = _read_headers(rfile)
+    else:
+        http_version, status_code, message = _parse_response_line(lines[0].strip())
+        headers = _parse_headers(lines[1:], b"\r\n")
 
     if hasattr(rfile, "first_byte_timestamp"):
         # more accurate timestamp_start
@@ -227,6 +240,48 @@ def expected_http_body_size(
     return -1
 
 
+def _read_head(rfile):
+    """
+        Read a complete message head (first line + headers) with a single
+        peek and a single read, and split it into lines.
+
+        This only succeeds if the whole head is already available and is
+        terminated by CRLF only. Otherwise nothing is consumed and None is
+        returned, so that the caller can fall back to reading line by line,
+        which also produces the usual errors for disconnects and bad input.
+
+        Returns:
+            A list of lines without line terminators, or None.
+
+        Raises:
+            exceptions.TcpTimeout
+    """
+    try:
+        data = rfile.peek(HEAD_PEEK_SIZE)
+    except exceptions.TcpTimeout:
+        raise
+    except (AttributeError, NotImplementedError, exceptions.TcpException, exceptions.TlsException):
+        return None
+    start = 0
+    # Possible leftover from previous message
+    if data.startswith(b"\r\n"):
+        start = 2
+    elif data.startswith(b"\n"):
+        start = 1
+    if data.startswith(b"\r\n", start) or data.startswith(b"\n", start):
+        return None
+    end = data.find(b"\r\n\r\n", start)
+    if end < 0:
+        return None
+    head = data[start:end]
+    lines = head.split(b"\r\n")
+    if head.count(b"\n") != len(lines) - 1:
+        # bare LF line endings, which are split differently
+        return None
+    rfile.read(end + 4)
+    return lines
+
+
 def _get_first_line(rfile):
     try:
         line = rfile.readline()
@@ -246,7 +301,10 @@ def _read_request_line(rfile):
     except exceptions.HttpReadDisconnect:
         # We want to provide a better error message.
         raise exceptions.HttpReadDisconnect("Client disconnected")
+    return _parse_request_line(line)
 
+
+def _parse_request_line(line):
     try:
         method, target, http_version = line.split()
 
@@ -282,7 +340,10 @@ def _read_response_line(rfile):
     except exceptions.HttpReadDisconnect:
         # We want to provide a better error message.
         raise exceptions.HttpReadDisconnect("Server disconnected")
+    return _parse_response_line(line)
+
 
+def _parse_response_line(line):
     try:
         parts = line.split(None, 2)
         if len(parts) == 2:  # handle missing message gracefully
@@ -314,12 +375,33 @@ def _read_headers(rfile):
         Raises:
             exceptions.HttpSyntaxException
     """
-    ret = []
+    lines = []
     while True:
         line = rfile.readline()
         if not line or line == b"\r\n" or line == b"\n":
             # we do have coverage of this, but coverage.py does not detect it.
             break  # pragma: no cover
+        lines.append(line)
+    return _parse_headers(lines)
+
+
+def _parse_headers(lines, eol=b""):
+    """
+        Parse header lines.
+
+        Args:
+            lines: The header lines, without the terminating blank line
+            eol: The line terminator that was stripped from the lines, if any.
+                Only used to keep error messages identical.
+
+        Returns:
+            A headers object
+
+        Raises:
+            exceptions.HttpSyntaxException
+    """
+    ret = []
+    for line in lines:
         if line[0] in b" \t":
             if not ret:
                 raise exceptions.HttpSyntaxException("Invalid headers")
@@ -334,7 +416,7 @@ def _read_headers(rfile):
                 ret.append((name, value))
             except ValueError:
                 raise exceptions.HttpSyntaxException(
-                    "Invalid header line: %s" % repr(line)
+                    "Invalid header line: %s" % repr(line + eol)
                 )
     return headers.Headers(ret)
 
@@ -44,6 +44,17 @@ class MessageData(serializable.Serializable):
             state["trailers"] = Headers.from_state(state["trailers"])
         return cls(**state)
 
+    def copy(self):
+        # All fields apart from the headers are immutable, so they are
+        # shared instead of going through get_state() and validating them
+        # again.
+        data = object.__new__(type(self))
+        data.__dict__.update(vars(self))
+        data.headers = self.headers.copy()
+        if self.trailers is not None:
+            data.trailers = self.trailers.copy()
+        return data
+
 
 class Message(serializable.Serializable):
     @classmethod
@@ -56,6 +67,15 @@ class Message(serializable.Serializable):
     def set_state(self, state):
         self.data.set_state(state)
 
+    def copy(self):
+        """
+        Copy the message. The copy shares the (immutable) content with this
+        message, but has its own headers.
+        """
+        m = object.__new__(type(self))
+        m.data = self.data.copy()
+        return m
+
     data: MessageData
     stream: Union[Callable, bool] = False
 
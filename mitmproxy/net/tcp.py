@@ -190,6 +190,7 @@ class Reader(_FileLike):
             Up to the next N bytes if peeking is successful.
 
         Raises:
+            exceptions.TcpTimeout if the socket timed out
             exceptions.TcpException if there was an error with the socket
             TlsException if there was an error with pyOpenSSL.
             NotImplementedError if the underlying file object is not a [pyOpenSSL] socket
@@ -197,6 +198,8 @@ class Reader(_FileLike):
         if isinstance(self.o, socket_fileobject):
             try:
                 return self.o._sock.recv(length, socket.MSG_PEEK)
+            except socket.timeout:
+                raise exceptions.TcpTimeout()
             except OSError as e:
                 raise exceptions.TcpException(repr(e))
         elif isinstance(self.o, SSL.Connection):
@@ -123,6 +123,13 @@ class Options(optmanager.OptManager):
             "Enable/disable WebSocket support. "
             "WebSocket support is enabled by default.",
         )
+        self.add_option(
+            "websocket_message_limit", int, 0,
+            "Keep at most this many messages of a WebSocket flow in memory. "
+            "Older messages are dropped once the websocket_message event has been handled, "
+            "so addons that need the whole conversation must persist it there. "
+            "0 means no limit.",
+        )
         self.add_option(
             "rawtcp", bool, False,
             "Enable/disable experimental raw TCP support. TCP connections starting with non-ascii "
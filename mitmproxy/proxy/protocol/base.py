@@ -97,6 +97,7 @@ class ServerConnectionMixin:
         super().__init__()
 
         self.server_conn = self.__make_server_conn(server_address)
+        self.offline = False
 
         self.__check_self_connect()
 
@@ -142,6 +143,17 @@ class ServerConnectionMixin:
         self.server_conn.address = address
         self.__check_self_connect()
 
+    def set_offline(self, offline: bool) -> None:
+        """
+        Serve this client connection without ever connecting to the server,
+        e.g. because an addon answers all requests locally. While offline,
+        :py:meth:`connect` fails and TLS with the client is established
+        with a certificate derived from SNI alone.
+        """
+        if offline and self.server_conn.connected():
+            self.disconnect()
+        self.offline = offline
+
     def disconnect(self):
         """
         Deletes (and closes) an existing server connection.
@@ -165,6 +177,10 @@ class ServerConnectionMixin:
         """
         if not self.server_conn.address:
             raise exceptions.ProtocolException("Cannot connect to server, no server address given.")
+        if self.offline:
+            raise exceptions.ProtocolException(
+                "Cannot connect to {}, upstream connections are disabled.".format(repr(self.server_conn.address))
+            )
         try:
             self.server_conn.connect()
             self.log("serverconnect", "debug", [repr(self.server_conn.address)])
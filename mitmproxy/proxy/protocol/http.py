@@ -1,3 +1,4 @@
+import itertools
 import textwrap
 
 import h2.exceptions
@@ -58,6 +59,9 @@ class _HttpTransmissionLayer(base.Layer):
     def send_response_body(self, response, chunks):
         raise NotImplementedError()
 
+    def send_response_file(self, response, body: http.AddonBody):
+        self.send_response_body(response, body.chunks())
+
     def send_response_trailers(self, response, chunks):
         raise NotImplementedError()
 
@@ -209,6 +213,9 @@ class HttpLayer(base.Layer):
 
         try:
             self.set_server((f.request.host, f.request.port))
+            # An http_connect hook may declare that it answers every request
+            # on this connection, so we never need to talk to the server.
+            self.set_offline(bool(f.metadata.get("offline")))
 
             if f.response:
                 resp = f.response
@@ -253,6 +260,7 @@ class HttpLayer(base.Layer):
         return False
 
     def _process_flow(self, f):
+        request_body = response_body = None
         try:
             try:
                 request: http.HTTPRequest = self.read_request_headers(f)
@@ -295,8 +303,14 @@ class HttpLayer(base.Layer):
                 self.send_response(http.make_expect_continue_response())
                 request.headers.pop("expect")
 
-            if f.request.stream:
+            if isinstance(f.request.stream, http.StreamAbove):
+                request_body = self.read_body_above(
+                    f.request, self.read_request_body(request), f.request.stream.limit)
+            elif f.request.stream:
                 f.request.data.content = None
+                # The body is framed by the headers as they were received,
+                # addons may change them before it is transferred.
+                request_body = self.read_request_body(request)
             else:
                 f.request.data.content = b"".join(self.read_request_body(request))
 
@@ -356,6 +370,13 @@ class HttpLayer(base.Layer):
                 # allow inline scripts to manipulate the client handshake
                 self.channel.ask("websocket_handshake", f)
 
+            if not f.response and self.offline:
+                f.response = http.make_error_response(
+                    502,
+                    "Upstream connections are disabled for this connection and "
+                    "no addon answered the request."
+                )
+
             if not f.response:
                 self.establish_server_connection(
                     f.request.host,
@@ -367,7 +388,9 @@ class HttpLayer(base.Layer):
                     self.send_request_headers(f.request)
 
                     if f.request.stream:
-                        chunks = self.read_request_body(f.request)
+                        chunks = request_body
+                        if chunks is None:
+                            chunks = self.read_request_body(f.request)
                         if callable(f.request.stream):
                             chunks = f.request.stream(chunks)
                         self.send_request_body(f.request, chunks)
@@ -418,8 +441,13 @@ class HttpLayer(base.Layer):
                 # an inline script to set f.stream = True
                 self.channel.ask("responseheaders", f)
 
-                if f.response.stream:
+                if isinstance(f.response.stream, http.StreamAbove):
+                    response_body = self.read_body_above(
+                        f.response, self.read_response_body(f.request, f.response), f.response.stream.limit)
+                elif f.response.stream:
                     f.response.data.content = None
+                    # See request_body above.
+                    response_body = self.read_response_body(f.request, f.response)
                 else:
                     f.response.data.content = b"".join(
                         self.read_response_body(f.request, f.response)
@@ -448,13 +476,19 @@ class HttpLayer(base.Layer):
                 # streaming:
                 # First send the headers and then transfer the response incrementally
                 self.send_response_headers(f.response)
-                chunks = self.read_response_body(
-                    f.request,
-                    f.response
-                )
-                if callable(f.response.stream):
-                    chunks = f.response.stream(chunks)
-                self.send_response_body(f.response, chunks)
+                if isinstance(f.response.stream, http.AddonBody):
+                    # body served by an addon, nothing to read upstream
+                    self.send_response_file(f.response, f.response.stream)
+                else:
+                    if response_body is None:
+                        response_body = self.read_response_body(
+                            f.request,
+                            f.response
+                        )
+                    chunks = response_body
+                    if callable(f.response.stream):
+                        chunks = f.response.stream(chunks)
+                    self.send_response_body(f.response, chunks)
                 f.response.timestamp_end = time.time()
 
             if self.check_close_connection(f):
@@ -505,6 +539,28 @@ class HttpLayer(base.Layer):
         except (exceptions.NetlibException, h2.exceptions.H2Error, exceptions.Http2ProtocolException):
             self.log(f"Failed to send error response to client: {message}", "debug")
 
+    def read_body_above(self, message, chunks, limit):
+        """
+            Read the body of a message whose stream is a StreamAbove. Returns
+            None if the body was read completely, and the chunks that are still
+            to be streamed otherwise.
+        """
+        buffered = []
+        size = 0
+        chunks = iter(chunks)
+        for chunk in chunks:
+            buffered.append(chunk)
+            size += len(chunk)
+            if size > limit:
+                self.log("Streaming {} larger than {} bytes".format(
+                    "request" if isinstance(message, http.HTTPRequest) else "response", limit), "info")
+                message.data.content = None
+                message.stream = True
+                return itertools.chain(buffered, chunks)
+        message.data.content = b"".join(buffered)
+        message.stream = False
+        return None
+
     def change_upstream_proxy_server(self, address):
         # Make set_upstream_proxy_server always available,
         # even if there's no UpstreamConnectLayer
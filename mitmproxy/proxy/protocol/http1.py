@@ -1,3 +1,7 @@
+import socket
+
+from mitmproxy import exceptions
+from mitmproxy import http
 from mitmproxy.net.http import http1
 from mitmproxy.proxy.protocol import http as httpbase
 from mitmproxy.utils import human
@@ -72,6 +76,22 @@ class Http1Layer(httpbase._HttpTransmissionLayer):
             self.client_conn.wfile.write(chunk)
             self.client_conn.wfile.flush()
 
+    def send_response_file(self, response, body):
+        conn = self.client_conn.connection
+        if (
+            not isinstance(body, http.FileBody)
+            or not isinstance(conn, socket.socket)  # TLS, the kernel can't encrypt for us
+            or self.client_conn.wfile.is_logging()
+            or "content-length" not in response.headers
+        ):
+            return super().send_response_file(response, body)
+        self.client_conn.wfile.flush()
+        try:
+            with open(body.path, "rb") as f:
+                conn.sendfile(f, body.offset, body.length)
+        except OSError as e:
+            raise exceptions.TcpDisconnect(str(e))
+
     def send_response_trailers(self, response):
         # HTTP/1.1 response trailer headers are sent in the body
         pass
@@ -1,6 +1,7 @@
 import threading
 import time
 import functools
+import traceback
 import types
 from typing import Dict, Callable, Any, List, Optional  # noqa
 
@@ -27,6 +28,8 @@ class SafeH2Connection(connection.H2Connection):
         super().__init__(*args, **kwargs)
         self.conn = conn
         self.lock = threading.RLock()
+        # notified by the connection loop whenever the peer opens up its flow control window
+        self.window_updated = threading.Condition(self.lock)
 
     def safe_acknowledge_received_data(self, acknowledged_size: int, stream_id: int):
         if acknowledged_size == 0:
@@ -60,23 +63,19 @@ class SafeH2Connection(connection.H2Connection):
         for chunk in chunks:
             position = 0
             while position < len(chunk):
-                self.lock.acquire()
-                raise_zombie(self.lock.release)
-                max_outbound_frame_size = self.max_outbound_frame_size
-                frame_chunk = chunk[position:position +
-                                    max_outbound_frame_size]
-                if self.local_flow_control_window(stream_id) < len(frame_chunk):  # pragma: no cover
-                    self.lock.release()
-                    time.sleep(0.1)
-                    continue
-                self.send_data(stream_id, frame_chunk)
-                try:
+                with self.lock:
+                    raise_zombie()
+                    window = self.local_flow_control_window(stream_id)
+                    if window <= 0:  # pragma: no cover
+                        self.window_updated.wait(0.1)
+                        continue
+                    # Write as many frames as the window allows and flush them at once.
+                    end = position + min(window, len(chunk) - position)
+                    while position < end:
+                        frame_end = min(position + self.max_outbound_frame_size, end)
+                        self.send_data(stream_id, chunk[position:frame_end])
+                        position = frame_end
                     self.conn.send(self.data_to_send())
-                except Exception as e:  # pragma: no cover
-                    raise e
-                finally:
-                    self.lock.release()
-                position += max_outbound_frame_size
         if end_stream:
             with self.lock:
                 raise_zombie()
@@ -118,7 +117,18 @@ class Http2Layer(base.Layer):
         self.connections[self.client_conn] = SafeH2Connection(
             self.client_conn, config=config)
 
+        # Streams are plain state objects driven by the connection loop. The HTTP
+        # exchange of a stream blocks on addon hooks, so it still needs a thread of
+        # its own while it runs, but threads are reused across streams. There can't
+        # be more active streams than we allow concurrently from the client, plus
+        # the streams the server may push.
+        max_streams = self.connections[self.client_conn].local_settings.max_concurrent_streams
+        self.stream_executor = basethread.WorkerPool(2 * max_streams, "Http2SingleStreamLayer")
+
     def _initiate_server_conn(self):
+        if self.offline:
+            # all streams are answered locally, there is no server connection
+            return
         if self.server_conn.connected():
             config = h2.config.H2Configuration(
                 client_side=True,
@@ -178,6 +188,8 @@ class Http2Layer(base.Layer):
             return self._handle_priority_updated(eid, event)
         elif isinstance(event, events.TrailersReceived):
             return self._handle_trailers(eid, event, is_server, other_conn)
+        elif isinstance(event, events.WindowUpdated):
+            return self._handle_window_updated(source_conn)
 
         # fail-safe for unhandled events
         return True
@@ -219,8 +231,9 @@ class Http2Layer(base.Layer):
             self.streams[eid].data_queue.put(event.data)
             self.streams[eid].queued_data_length += len(event.data)
 
-        # always acknowledge receved data with a WINDOW_UPDATE frame
-        self.connections[source_conn].safe_acknowledge_received_data(
+        # Always acknowledge received data. The connection loop holds the lock and
+        # flushes once per read, so WINDOW_UPDATE frames are coalesced by h2.
+        self.connections[source_conn].acknowledge_received_data(
             event.flow_controlled_length,
             event.stream_id
         )
@@ -249,10 +262,18 @@ class Http2Layer(base.Layer):
         self.streams[eid].trailers = trailers
         return True
 
+    def _handle_window_updated(self, source_conn):
+        self.connections[source_conn].window_updated.notify_all()
+        return True
+
     def _handle_remote_settings_changed(self, event, other_conn):
         new_settings = {key: cs.new_value for (
             key, cs) in event.changed_settings.items()}
-        self.connections[other_conn].safe_update_settings(new_settings)
+        if other_conn in self.connections:
+            self.connections[other_conn].safe_update_settings(new_settings)
+        # SETTINGS_INITIAL_WINDOW_SIZE may have enlarged our send windows towards the peer
+        source_conn = self.client_conn if other_conn == self.server_conn else self.server_conn
+        self.connections[source_conn].window_updated.notify_all()
         return True
 
     def _handle_connection_terminated(self, event, is_server):
@@ -315,6 +336,10 @@ class Http2Layer(base.Layer):
             # HeadersFrame + Priority information as RequestReceived
             return True
 
+        if self.server_conn not in self.connections:
+            # offline, nobody to forward the priority to
+            return True
+
         with self.connections[self.server_conn].lock:
             mapped_stream_id = event.stream_id
             if mapped_stream_id in self.streams and self.streams[mapped_stream_id].server_stream_id:
@@ -395,8 +420,6 @@ class Http2Layer(base.Layer):
 
                         incoming_events = self.connections[source_conn].receive_data(
                             consumed_bytes)
-                        source_conn.send(
-                            self.connections[source_conn].data_to_send())
 
                         for event in incoming_events:
                             if not self._handle_event(event, source_conn, other_conn, is_server):
@@ -404,10 +427,16 @@ class Http2Layer(base.Layer):
                                 self._kill_all_streams()
                                 return
 
+                        # one write for protocol replies and window updates of this frame
+                        source_conn.send(
+                            self.connections[source_conn].data_to_send())
+
                     self._cleanup_streams()
         except Exception as e:  # pragma: no cover
             self.log(repr(e), "info")
             self._kill_all_streams()
+        finally:
+            self.stream_executor.shutdown()
 
 
 def detect_zombie_stream(func):  # pragma: no cover
@@ -421,7 +450,7 @@ def detect_zombie_stream(func):  # pragma: no cover
     return wrapper
 
 
-class Http2SingleStreamLayer(httpbase._HttpTransmissionLayer, basethread.BaseThread):
+class Http2SingleStreamLayer(httpbase._HttpTransmissionLayer):
 
     class Message:
         def __init__(self, headers=None):
@@ -440,9 +469,8 @@ class Http2SingleStreamLayer(httpbase._HttpTransmissionLayer, basethread.BaseThr
             self.stream_ended = threading.Event()
 
     def __init__(self, ctx, h2_connection, stream_id: int, request_headers: mitmproxy.net.http.Headers) -> None:
-        super().__init__(
-            ctx, name=f"Http2SingleStreamLayer-{stream_id}"
-        )
+        super().__init__(ctx)
+        self.name = f"Http2SingleStreamLayer-{stream_id}"
         self.h2_connection = h2_connection
         self.zombie: Optional[float] = None
         self.client_stream_id: int = stream_id
@@ -751,7 +779,24 @@ class Http2SingleStreamLayer(httpbase._HttpTransmissionLayer, basethread.BaseThr
             )
 
     def __call__(self):  # pragma: no cover
-        raise OSError('Http2SingleStreamLayer must be run as thread')
+        raise OSError('Http2SingleStreamLayer must be started with start()')
+
+    def start(self):
+        """
+            Schedule the HTTP exchange of this stream on the connection's stream executor.
+        """
+        self.stream_executor.submit(self.run).add_done_callback(self._stream_done)
+
+    def _stream_done(self, future):
+        e = future.exception()
+        if e is not None:  # pragma: no cover
+            self.log(
+                "Http2SingleStreamLayer-{} failed: {}".format(
+                    self.client_stream_id,
+                    "".join(traceback.format_exception(type(e), e, e.__traceback__))
+                ),
+                "error"
+            )
 
     def run(self):
         layer = httpbase.HttpLayer(self, self.mode)
@@ -258,8 +258,10 @@ class TlsLayer(base.Layer):
         #  2.4 The client wants to negotiate an alternative protocol in its handshake, we need to find out
         #      what is supported by the server
         #  2.5 The client did not sent a SNI value, we don't know the certificate subject.
+        #  2.6 No server connection is wanted at all if the connection is served offline.
         client_tls_requires_server_connection = (
             self._server_tls and
+            not self.offline and
             self.config.options.upstream_cert and
             (
                 self.config.options.add_upstream_certs_to_client_chain or
@@ -343,7 +345,10 @@ class TlsLayer(base.Layer):
         # This gets triggered if we haven't established an upstream connection yet.
         default_alpn = b'http/1.1'
 
-        if self.alpn_for_client_connection in options:
+        if self.offline and self.config.options.http2 and b'h2' in options:
+            # There is no server to ask, we speak h2 with the client ourselves.
+            choice = b'h2'
+        elif self.alpn_for_client_connection in options:
             choice = bytes(self.alpn_for_client_connection)
         elif default_alpn in options:
             choice = bytes(default_alpn)
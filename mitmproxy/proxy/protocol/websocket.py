@@ -1,4 +1,5 @@
 import queue
+import socket
 from OpenSSL import SSL
 
 import wsproto
@@ -36,7 +37,12 @@ class WebSocketLayer(base.Layer):
         This layer is transparent to any negotiated subprotocols.
         Only raw frames are forwarded to the other endpoint.
 
-        WebSocket messages are stored in a WebSocketFlow.
+        WebSocket messages are stored in a WebSocketFlow. With the websocket_message_limit
+        option, only the most recent messages are kept in memory.
+
+        If the handshake was answered by an addon (e.g. from a mock) there is no server
+        connection. Client messages are then only recorded, and server messages are
+        whatever the addon injects with WebSocketFlow.inject_message.
     """
 
     def __init__(self, ctx, handshake_flow):
@@ -111,6 +117,7 @@ class WebSocketLayer(base.Layer):
             length = len(websocket_message.content)
             self.flow.messages.append(websocket_message)
             self.channel.ask("websocket_message", self.flow)
+            self._trim_messages()
 
             if not self.flow.stream and not websocket_message.killed:
                 def get_chunk(payload):
@@ -129,20 +136,29 @@ class WebSocketLayer(base.Layer):
                             yield (payload[i:i + chunk_size], True if i + chunk_size >= len(payload) else False)
 
                 for chunk, final in get_chunk(websocket_message.content):
-                    data = self.connections[other_conn].send(Message(data=chunk, message_finished=final))
-                    other_conn.send(data)
+                    self._send(other_conn, Message(data=chunk, message_finished=final))
 
         if self.flow.stream:
-            data = self.connections[other_conn].send(Message(data=event.data, message_finished=event.message_finished))
-            other_conn.send(data)
+            self._send(other_conn, Message(data=event.data, message_finished=event.message_finished))
         return True
 
+    def _trim_messages(self):
+        limit = self.config.options.websocket_message_limit
+        excess = len(self.flow.messages) - limit
+        if limit and excess > 0:
+            del self.flow.messages[:excess]
+            self.flow.messages_dropped += excess
+
+    def _send(self, endpoint, event):
+        data = self.connections[endpoint].send(event)
+        # keep the state machine of a mocked server in sync, but there is nobody to send to
+        if endpoint.connected():
+            endpoint.send(data)
+
     def _handle_ping(self, event, source_conn, other_conn, is_server):
         # Use event.response to create the approprate Pong response
-        data = self.connections[other_conn].send(Ping())
-        other_conn.send(data)
-        data = self.connections[source_conn].send(event.response())
-        source_conn.send(data)
+        self._send(other_conn, Ping())
+        self._send(source_conn, event.response())
         self.log(
             "Ping Received from {}".format("server" if is_server else "client"),
             "info",
@@ -163,10 +179,8 @@ class WebSocketLayer(base.Layer):
         self.flow.close_code = event.code
         self.flow.close_reason = event.reason
 
-        data = self.connections[other_conn].send(CloseConnection(code=event.code, reason=event.reason))
-        other_conn.send(data)
-        data = self.connections[source_conn].send(event.response())
-        source_conn.send(data)
+        self._send(other_conn, CloseConnection(code=event.code, reason=event.reason))
+        self._send(source_conn, event.response())
 
         return False
 
@@ -174,8 +188,7 @@ class WebSocketLayer(base.Layer):
         while True:
             try:
                 payload = message_queue.get_nowait()
-                data = self.connections[endpoint].send(Message(data=payload, message_finished=True))
-                endpoint.send(data)
+                self._send(endpoint, Message(data=payload, message_finished=True))
             except queue.Empty:
                 break
 
@@ -185,7 +198,10 @@ class WebSocketLayer(base.Layer):
         self.handshake_flow.metadata['websocket_flow'] = self.flow.id
         self.channel.ask("websocket_start", self.flow)
 
-        conns = [c.connection for c in self.connections.keys()]
+        conns = [c.connection for c in self.connections.keys() if c.connected()]
+        wakeup, inject_wakeup = socket.socketpair()
+        inject_wakeup.setblocking(False)
+        self.flow._inject_wakeup = inject_wakeup
         close_received = False
 
         try:
@@ -193,8 +209,12 @@ class WebSocketLayer(base.Layer):
                 self._inject_messages(self.client_conn, self.flow._inject_messages_client)
                 self._inject_messages(self.server_conn, self.flow._inject_messages_server)
 
-                r = tcp.ssl_read_select(conns, 0.1)
+                r = tcp.ssl_read_select(conns + [wakeup], 0.1)
                 for conn in r:
+                    if conn is wakeup:
+                        # injected messages are sent at the top of the loop
+                        wakeup.recv(4096)
+                        continue
                     source_conn = self.client_conn if conn == self.client_conn.connection else self.server_conn
                     other_conn = self.server_conn if conn == self.client_conn.connection else self.client_conn
                     is_server = (source_conn == self.server_conn)
@@ -224,5 +244,9 @@ class WebSocketLayer(base.Layer):
             self.flow.error = flow.Error("WebSocket connection closed unexpectedly by {}: {}".format(s, repr(e)))
             self.channel.tell("websocket_error", self.flow)
         finally:
+            # Unpublish the wakeup before closing it, senders that still hold it get an OSError.
+            self.flow._inject_wakeup = None
+            inject_wakeup.close()
+            wakeup.close()
             self.flow.ended = True
             self.channel.tell("websocket_end", self.flow)
@@ -122,10 +122,13 @@ class RootContext:
         """
         Send a log message to the master.
         """
+        if not self.channel.master.log.wants(level):
+            return
         full_msg = [
             "{}:{}: {}".format(self.client_conn.address[0], self.client_conn.address[1], msg)
         ]
         for i in subs:
             full_msg.append("  -> " + i)
         full_msg = "\n".join(full_msg)
-        self.channel.tell("log", log.LogEntry(full_msg, level))
+        if not self.channel.should_exit.is_set():
+            self.channel.master.log.add(log.LogEntry(full_msg, level))
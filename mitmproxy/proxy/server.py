@@ -159,6 +159,9 @@ class ConnectionHandler:
         self.client_conn.finish()
 
     def log(self, msg, level):
+        if not self.channel.master.log.wants(level):
+            return
         msg = "{}: {}".format(human.format_address(
             self.client_conn.address), msg)
-        self.channel.tell("log", log.LogEntry(msg, level))
+        if not self.channel.should_exit.is_set():
+            self.channel.master.log.add(log.LogEntry(msg, level))
@@ -74,6 +74,18 @@ def common_options(parser, opts):
     # Client replay
     group = parser.add_argument_group("Client Replay")
     opts.make_parser(group, "client_replay", metavar="PATH", short="C")
+    opts.make_parser(group, "client_replay_concurrency", metavar="N")
+    opts.make_parser(group, "client_replay_timing")
+    opts.make_parser(group, "client_replay_rps", metavar="RPS")
+
+    # Load test
+    group = parser.add_argument_group("Load Test")
+    opts.make_parser(group, "load_test", metavar="PATH")
+    opts.make_parser(group, "load_test_rps", metavar="RPS")
+    opts.make_parser(group, "load_test_ramp", metavar="SECONDS")
+    opts.make_parser(group, "load_test_duration", metavar="SECONDS")
+    opts.make_parser(group, "load_test_concurrency", metavar="N")
+    opts.make_parser(group, "load_test_report", metavar="PATH")
 
     # Server replay
     group = parser.add_argument_group("Server Replay")
@@ -81,6 +93,8 @@ def common_options(parser, opts):
     opts.make_parser(group, "server_replay_kill_extra")
     opts.make_parser(group, "server_replay_nopop")
     opts.make_parser(group, "server_replay_refresh")
+    opts.make_parser(group, "server_replay_lazy")
+    opts.make_parser(group, "server_replay_cache", metavar="SIZE")
 
     # Map Remote
     group = parser.add_argument_group("Map Remote")
@@ -93,11 +107,16 @@ def common_options(parser, opts):
     # Modify Body
     group = parser.add_argument_group("Modify Body")
     opts.make_parser(group, "modify_body", metavar="PATTERN", short="B")
+    opts.make_parser(group, "modify_body_max_match", metavar="SIZE")
 
     # Modify headers
     group = parser.add_argument_group("Modify Headers")
     opts.make_parser(group, "modify_headers", metavar="PATTERN", short="P")
 
+    # Streaming
+    group = parser.add_argument_group("Streaming")
+    opts.make_parser(group, "stream_rules", metavar="PATTERN")
+
 
 def mitmproxy(opts):
     parser = argparse.ArgumentParser(usage="%(prog)s [options]")
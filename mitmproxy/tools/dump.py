@@ -5,6 +5,8 @@ from mitmproxy.addons import dumper, termlog, termstatus, keepserving, readfile
 
 
 class ErrorCheck:
+    log_verbosity = "error"
+
     def __init__(self):
         self.has_errored = False
 
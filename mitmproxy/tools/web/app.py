@@ -27,8 +27,18 @@ from mitmproxy import log
 from mitmproxy import optmanager
 from mitmproxy import version
 from mitmproxy import ctx
+from mitmproxy.addons import streambodies
 from .replay import proxy_req
 from softmock.database import database
+from softmock import variants
+from softmock import blobs
+from softmock import frames
+from softmock import contents
+from softmock import profiles
+
+# 超过这个大小的tee副本不放进flow的json，内容由FlowContent分段返回
+SPILL_INLINE_LIMIT = 8 * 1024 * 1024
+SPILL_CHUNK_SIZE = 1024 * 1024
 
 
 def flow_to_json(flow: mitmproxy.flow.Flow) -> dict:
@@ -92,21 +102,30 @@ def flow_to_json(flow: mitmproxy.flow.Flow) -> dict:
                 "pretty_host": flow.request.pretty_host,
             }
         if flow.response:
-            if flow.response.raw_content:
-                content_length = len(flow.response.raw_content)
+            response = flow.response
+            if response.raw_content is None:
+                # tee模式下超过内存上限的内容，从落盘的完整副本读取，录制时内容是完整的
+                # 每次序列化都会读取，太大的副本不读，由FlowContent按需返回
+                spilled = streambodies.read_spill(flow, SPILL_INLINE_LIMIT)
+                if spilled is not None:
+                    response = response.copy()
+                    response.raw_content = spilled
+            if response.raw_content:
+                content_length = len(response.raw_content)
                 content_hash = hashlib.sha256(
-                    flow.response.raw_content).hexdigest()
+                    response.raw_content).hexdigest()
                 # 获取html
                 try:
-                    codeType = detect(flow.response.content)['encoding']
-                    html = flow.response.content.decode(codeType)
+                    codeType = detect(response.content)['encoding']
+                    html = response.content.decode(codeType)
                 except:
                     '''
                     很可能是二进制文件
                     '''
-                    html = base64.b64encode(flow.response.content).decode()
+                    html = base64.b64encode(response.content).decode()
             else:
-                content_length = None
+                # 没有读取的tee副本，大小记录在metadata里
+                content_length = flow.metadata.get("stream_tee", {}).get("size", None)
                 content_hash = None
                 html = None
 
@@ -300,9 +319,9 @@ class WebSocketEventBroadcaster(tornado.websocket.WebSocketHandler):
             已经存在记录，则不需要返回新的id，直接把旧的id返回去
             """
 
-            sql = f"select `detail` from Mock1 where url='{url}'"
-            js = [i for i in cursor.execute(sql)][0][0]
-            result = json.loads(parse.unquote(js))
+            sql = f"select `detail`, digest from Mock1 where url='{url}'"
+            js, old_digest = [i for i in cursor.execute(sql)][0]
+            result = contents.unpack(cursor, js)
             kwargs['data']['id'] = result['data']['id']
             kwargs['cmd'] = 'update'
             if not is_update_response:
@@ -313,22 +332,37 @@ class WebSocketEventBroadcaster(tornado.websocket.WebSocketHandler):
                     kwargs['data']['request']['aliasName'] = result['data']['request']['aliasName']
             else:
                 kwargs['data']['request'] = result['data']['request']
-            message = parse.quote(json.dumps(kwargs, ensure_ascii=False))
-            sql = f"update Mock1 set `detail`=? where url=?"
-            cursor.execute(sql, (message, url))
+            # 响应内容相同的mock共用一份
+            detail, digest = contents.pack(cursor, kwargs)
+            sql = f"update Mock1 set `detail`=?, digest=? where url=?"
+            cursor.execute(sql, (detail, digest, url))
         else:  # 新增记录
-            message = parse.quote(json.dumps(kwargs, ensure_ascii=False))
-            sql = f"insert into Mock1 (`id`, `detail`, `url`, `status`) values (?, ?, ?, ?)"
+            old_digest = None
+            detail, digest = contents.pack(cursor, kwargs)
+            sql = f"insert into Mock1 (`id`, `detail`, `url`, `status`, digest) values (?, ?, ?, ?, ?)"
             cursor.execute(
-                sql, (msg_id, message, url, '1'))
+                sql, (msg_id, detail, url, '1', digest))
+        # 响应内容变化时重新生成压缩版本，没变化时沿用已有的
+        refresh = is_update_response and digest is not None and digest != old_digest
+        if refresh:
+            # 旧的压缩版本先删掉，新的生成之前命中时返回未压缩的内容
+            variants.delete(cursor, url)
+        elif is_update_response and digest is None:
+            # 小的内容没有digest，压缩的开销也小，直接生成
+            variants.save(cursor, url, kwargs)
 
         db.commit()
         cursor.close()
         db.close()
+        if refresh:
+            # 压缩很耗CPU，放到线程池中，不阻塞事件循环
+            asyncio.get_event_loop().run_in_executor(
+                None, variants.refresh, database, url, kwargs, digest)
 
+        message = json.dumps(kwargs, ensure_ascii=False)
         for conn in cls.connections:
             try:
-                conn.write_message(parse.unquote(message))
+                conn.write_message(message)
             except Exception:  # pragma: no cover
                 # logging.error("Error sending message", exc_info=True)
                 pass
@@ -343,9 +377,9 @@ class Flows(RequestHandler):
         # 获取历史记录
         db = sqlite3.connect(database)
         cursor = db.cursor()
-        sql = f"select * from Mock1 where url like '%{ctx.options.host}%'"
-        result = [{**json.loads(parse.unquote(i[1]))['data'], "status": parse.unquote(i[3])}
-                  for i in cursor.execute(sql)]
+        sql = f"select id, `detail`, url, status, profile from Mock1 where url like '%{ctx.options.host}%'"
+        result = [{**contents.unpack(cursor, i[1])['data'], "status": parse.unquote(i[3]), "profile": i[4]}
+                  for i in cursor.execute(sql).fetchall()]
         self.write(result)
         cursor.close()
         db.close()
@@ -384,8 +418,18 @@ class SOFTMOCK_ClearAll(RequestHandler):
         cursor = db.cursor()
         sql = f"delete from Mock1 where url like '%{ctx.options.host}%'"
 
+        cursor.execute(sql)
+        sql = f"delete from MockBody where url like '%{ctx.options.host}%'"
+        cursor.execute(sql)
+        sql = f"select digest from MockBlob where url like '%{ctx.options.host}%'"
+        removed = [i[0] for i in cursor.execute(sql)]
+        sql = f"delete from MockBlob where url like '%{ctx.options.host}%'"
+        cursor.execute(sql)
+        sql = f"delete from MockFrame where url like '%{ctx.options.host}%'"
         cursor.execute(sql)
         db.commit()
+        # 记录删除后文件也要删除，其他mock还在用的文件保留
+        blobs.remove_unused(db, removed)
         cursor.close()
         db.close()
         self.write('0')
@@ -429,6 +473,8 @@ class DeleteFlow(RequestHandler):
         cursor = db.cursor()
         sql = f"delete from Mock1 where `url`='{url}'"
         cursor.execute(sql)
+        variants.delete(cursor, url)
+        frames.delete(cursor, url)
         db.commit()
         cursor.close()
         db.close()
@@ -444,8 +490,10 @@ class CreateFlow(RequestHandler):
         detail = self.request.body.decode()
         db = sqlite3.connect(database)
         cursor = db.cursor()
-        sql = f"insert into Mock1 (`detail`, `status`, `url`) values (?, ?, ?)"
-        cursor.execute(sql, (parse.quote(detail), '1', url))
+        packed, digest = contents.pack(cursor, detail)
+        sql = f"insert into Mock1 (`detail`, `status`, `url`, digest) values (?, ?, ?, ?)"
+        cursor.execute(sql, (packed, '1', url, digest))
+        variants.save(cursor, url, detail)
         db.commit()
         cursor.close()
         db.close()
@@ -464,14 +512,36 @@ class UpdateFlow(RequestHandler):
         db = sqlite3.connect(database)
         cursor = db.cursor()
         print('更新：'+url)
-        sql = f"update Mock1 set `detail`='{parse.quote(detail)}', `status`='{status}' where `url`=?"
-        cursor.execute(sql, (url, ))
+        packed, digest = contents.pack(cursor, detail)
+        sql = f"update Mock1 set `detail`=?, digest=?, `status`='{status}' where `url`=?"
+        cursor.execute(sql, (packed, digest, url))
+        variants.save(cursor, url, detail)
         db.commit()
         cursor.close()
         db.close()
         self.write('0')
 
 
+class UpdateProfile(RequestHandler):
+    def post(self):
+        '''
+        更新返回时的延迟、带宽和错误率，内容为空时清除
+        '''
+        url = base64.b64decode(self.get_argument('url').encode()).decode()
+        profile = self.request.body.decode()
+        db = sqlite3.connect(database)
+        cursor = db.cursor()
+        try:
+            profiles.save(cursor, url, profile)
+            db.commit()
+        except profiles.ProfileError as e:
+            raise APIError(400, str(e))
+        finally:
+            cursor.close()
+            db.close()
+        self.write('0')
+
+
 class UpdateStatus():
     def post(self):
         '''
@@ -582,11 +652,13 @@ class ReplayMe(RequestHandler):
         cursor = db.cursor()
         sql = f"select `detail` from Mock1 where url='{url}'"
         js = [i for i in cursor.execute(sql)][0][0]
-        result = json.loads(parse.unquote(js))
+        result = contents.unpack(cursor, js)
         # result['data']['response'] = None
         update_result = proxy_req(result)
-        sql2 = f"update Mock1 set `detail`='{parse.quote(json.dumps(update_result))}' where url='{url}'"
-        cursor.execute(sql2)
+        packed, digest = contents.pack(cursor, update_result)
+        sql2 = f"update Mock1 set `detail`=?, digest=? where url='{url}'"
+        cursor.execute(sql2, (packed, digest))
+        variants.save(cursor, url, update_result)
         db.commit()
         cursor.close()
         self.write('0')
@@ -599,10 +671,13 @@ class FlowContent(RequestHandler):
         message.content = self.filecontents
         self.view.update([self.flow])
 
-    def get(self, flow_id, message):
+    async def get(self, flow_id, message):
         message = getattr(self.flow, message)
 
-        if not message.raw_content:
+        spill = None
+        if message.raw_content is None and message is self.flow.response:
+            spill = streambodies.spill_path(self.flow)
+        if not message.raw_content and not spill:
             raise APIError(400, "No content.")
 
         content_encoding = message.headers.get("Content-Encoding", None)
@@ -625,6 +700,19 @@ class FlowContent(RequestHandler):
         self.set_header("Content-Type", "application/text")
         self.set_header("X-Content-Type-Options", "nosniff")
         self.set_header("X-Frame-Options", "DENY")
+        if spill:
+            # The full copy of a teed body may be large, send it in chunks.
+            try:
+                with open(spill, "rb") as f:
+                    while True:
+                        chunk = f.read(SPILL_CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        self.write(chunk)
+                        await self.flush()
+            except OSError as e:
+                raise APIError(500, str(e))
+            return
         self.write(message.raw_content)
 
 
@@ -750,6 +838,7 @@ class Application(tornado.web.Application):
                 (r"/clear_all", SOFTMOCK_ClearAll),
                 (r"/replay", ReplayMe),
                 (r"/update_status", UpdateStatus),
+                (r"/update_profile", UpdateProfile),
                 (r"/flows/(?P<flow_id>[0-9a-f\-]+)", FlowHandler),
                 (r"/flows/(?P<flow_id>[0-9a-f\-]+)/resume", ResumeFlow),
                 (r"/flows/(?P<flow_id>[0-9a-f\-]+)/kill", KillFlow),
@@ -0,0 +1,87 @@
+import typing
+
+
+class Histogram:
+    """
+    A histogram of non-negative integer values with bounded relative error,
+    in the style of HdrHistogram.
+
+    Values below 2 ** precision are counted exactly. Larger values fall into
+    buckets whose width is a fixed fraction of their magnitude, so the
+    recorded value is reported with a relative error of at most
+    2 ** -(precision - 1), regardless of its range. Recording is a dict
+    update, and histograms recorded in different threads can be merged.
+    """
+
+    def __init__(self, precision: int = 7) -> None:
+        self.precision = precision
+        self.counts: typing.Dict[int, int] = {}
+        self.count = 0
+        self.total = 0
+        self.min: typing.Optional[int] = None
+        self.max: typing.Optional[int] = None
+
+    def bucket(self, value: int) -> int:
+        shift = value.bit_length() - self.precision
+        if shift <= 0:
+            return value
+        return (shift << self.precision) + (value >> shift)
+
+    def highest_equivalent(self, bucket: int) -> int:
+        """
+        The largest value that falls into the given bucket.
+        """
+        shift = bucket >> self.precision
+        if shift == 0:
+            return bucket
+        sub = bucket & ((1 << self.precision) - 1)
+        return ((sub + 1) << shift) - 1
+
+    def record(self, value: int, n: int = 1) -> None:
+        value = max(int(value), 0)
+        b = self.bucket(value)
+        self.counts[b] = self.counts.get(b, 0) + n
+        self.count += n
+        self.total += value * n
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other: "Histogram") -> None:
+        if other.precision != self.precision:
+            raise ValueError("Cannot merge histograms of different precision.")
+        for b, n in other.counts.items():
+            self.counts[b] = self.counts.get(b, 0) + n
+        self.count += other.count
+        self.total += other.total
+        for v in (other.min, other.max):
+            if v is not None:
+                if self.min is None or v < self.min:
+                    self.min = v
+                if self.max is None or v > self.max:
+                    self.max = v
+
+    def percentile(self, p: float) -> int:
+        """
+        The value below which p percent of all recorded values fall.
+        """
+        if not self.count:
+            return 0
+        rank = max(1, -(-self.count * p // 100))
+        seen = 0
+        for b in sorted(self.counts):
+            seen += self.counts[b]
+            if seen >= rank:
+                return min(self.highest_equivalent(b), self.max)
+        return self.max  # pragma: no cover
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def buckets(self) -> typing.List[typing.Tuple[int, int]]:
+        """
+        (highest equivalent value, count) pairs in ascending order.
+        """
+        return [(self.highest_equivalent(b), self.counts[b]) for b in sorted(self.counts)]
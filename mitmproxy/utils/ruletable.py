@@ -0,0 +1,241 @@
+"""
+A table of rules in the "[/flow-filter]/subject/replacement" format that the
+map_local, map_remote, modify_body and modify_headers options share.
+
+Checking every rule for every flow gets expensive with hundreds of rules,
+so the table narrows the rules down by the request URL first:
+
+    - rules with URL regexes anchored to a literal host, such as
+      "^https?://example\\.com/", are indexed by that host,
+    - other URL regexes are only searched if the URL contains the longest
+      literal that every match of the regex contains, which is a lot cheaper
+      than running the regex.
+
+Rules whose flow filter requires a domain ("~d host" on its own or as part of
+"&") are narrowed down by the host as well. Which of them pass only depends on
+the host of the request, so that is decided once per host.
+
+Flow filters are only evaluated for the rules left over.
+"""
+import re
+import typing
+
+try:
+    from re import _constants as sre_constants
+    from re import _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_constants  # type: ignore
+    import sre_parse  # type: ignore
+
+from mitmproxy import flowfilter
+from mitmproxy import http
+
+T = typing.TypeVar("T")
+
+# A URL regex that can only match URLs with one host:
+# an anchored scheme, "://", a literal host and the end of the host.
+_ANCHORED_HOST = re.compile(
+    r"(?:\(\?[aiLmsux]+\))?"
+    r"\^(?:[A-Za-z]+\??|\((?:\?:)?[A-Za-z]+\??(?:\|[A-Za-z]+\??)*\))"
+    r":\\?/\\?/"
+    r"((?:[A-Za-z0-9-]|\\\.)+)"
+    r"(?:\\?/|:|\\\?|\$)"
+)
+
+
+def _url_host(url: str) -> str:
+    rest = url.partition("://")[2]
+    for i, c in enumerate(rest):
+        if c in "/:?#":
+            return rest[:i]
+    return rest
+
+
+def anchored_host(regex: typing.Pattern[str]) -> typing.Optional[str]:
+    """
+        The host that all URLs matched by the regex have, if it is a literal.
+        Case-insensitive regexes return the host in lowercase.
+    """
+    if regex.flags & (re.VERBOSE | re.MULTILINE):
+        return None
+    m = _ANCHORED_HOST.match(regex.pattern)
+    # An alternative further on may match other hosts.
+    if not m or "|" in regex.pattern[m.end():]:
+        return None
+    host = m.group(1).replace("\\.", ".")
+    if regex.flags & re.IGNORECASE:
+        host = host.lower()
+    return host
+
+
+def _required_domains(matches) -> typing.List[flowfilter.FDomain]:
+    if isinstance(matches, flowfilter.FDomain):
+        return [matches]
+    if isinstance(matches, flowfilter.FAnd):
+        return [f for f in matches.lst if isinstance(f, flowfilter.FDomain)]
+    return []
+
+
+def required_literal(regex: typing.Pattern[str]) -> typing.Optional[str]:
+    """
+        The longest string that every match of the regex contains, if there
+        is one of at least three characters.
+    """
+    if regex.flags & re.IGNORECASE:
+        # Case folding does not map to str.lower() in all cases.
+        return None
+    best = run = ""
+    for op, arg in sre_parse.parse(regex.pattern, regex.flags):
+        if op is sre_constants.LITERAL:
+            run += chr(arg)
+            if len(run) > len(best):
+                best = run
+        else:
+            run = ""
+    return best if len(best) >= 3 else None
+
+
+class Rule(typing.Generic[T]):
+    """
+        A parsed option with its compiled URL regex and a hit counter.
+    """
+    __slots__ = ("index", "option", "spec", "url", "literal", "domains", "filtered", "hits")
+
+    def __init__(
+        self,
+        index: int,
+        option: str,
+        spec: T,
+        url: typing.Optional[typing.Pattern[str]] = None,
+    ) -> None:
+        self.index = index
+        self.option = option
+        self.spec = spec
+        self.url = url
+        self.literal = None if url is None else required_literal(url)
+        matches = getattr(spec, "matches", None)
+        self.domains = [d.re for d in _required_domains(matches)]
+        # The domains are checked by the table, so a filter that is just a
+        # domain does not need to be evaluated.
+        self.filtered = not isinstance(matches, flowfilter.FDomain)
+        self.hits = 0
+
+
+class RuleTable(typing.Generic[T]):
+    # Number of hosts the domain checks are kept for.
+    max_hosts = 1024
+
+    def __init__(
+        self,
+        entries: typing.Iterable[typing.Tuple[str, T, typing.Optional[typing.Pattern[str]]]] = (),
+    ) -> None:
+        """
+            Entries are (option, spec, URL regex) in the order the rules
+            apply. Rules without a URL regex apply to every URL.
+        """
+        self.rules: typing.List[Rule[T]] = [
+            Rule(i, option, spec, url) for i, (option, spec, url) in enumerate(entries)
+        ]
+        self.always: typing.List[Rule[T]] = []
+        self.hosts: typing.Dict[str, typing.List[Rule[T]]] = {}
+        self.hosts_nocase: typing.Dict[str, typing.List[Rule[T]]] = {}
+        self.searched: typing.List[Rule[T]] = []
+        for rule in self.rules:
+            if rule.url is None:
+                self.always.append(rule)
+                continue
+            host = anchored_host(rule.url)
+            if host is not None:
+                hosts = self.hosts_nocase if rule.url.flags & re.IGNORECASE else self.hosts
+                hosts.setdefault(host, []).append(rule)
+            else:
+                self.searched.append(rule)
+        self.has_domains = any(rule.domains for rule in self.rules)
+        # (host, pretty host) -> (rules that pass their domain checks, their indices)
+        self.by_host: typing.Dict[
+            typing.Tuple[str, str],
+            typing.Tuple[typing.List[Rule[T]], typing.Set[int]]
+        ] = {}
+
+    def __len__(self) -> int:
+        return len(self.rules)
+
+    def __bool__(self) -> bool:
+        return bool(self.rules)
+
+    def __iter__(self) -> typing.Iterator[Rule[T]]:
+        return iter(self.rules)
+
+    def candidates(self, url: str) -> typing.List[Rule[T]]:
+        """
+            The rules whose URL regex matches the URL, in order.
+        """
+        ret = list(self.always)
+        if self.hosts or self.hosts_nocase:
+            host = _url_host(url)
+            for rule in self.hosts.get(host, ()):
+                if rule.url.search(url):  # type: ignore
+                    ret.append(rule)
+            for rule in self.hosts_nocase.get(host.lower(), ()):
+                if rule.url.search(url):  # type: ignore
+                    ret.append(rule)
+        for rule in self.searched:
+            if (rule.literal is None or rule.literal in url) and rule.url.search(url):  # type: ignore
+                ret.append(rule)
+        if len(ret) > 1:
+            ret.sort(key=lambda rule: rule.index)
+        return ret
+
+    def _passing(self, request: http.HTTPRequest) -> typing.Tuple[typing.List[Rule[T]], typing.Set[int]]:
+        """
+            The rules that are not ruled out by their domains.
+        """
+        key = (request.host, request.pretty_host)
+        ret = self.by_host.get(key)
+        if ret is None:
+            if len(self.by_host) >= self.max_hosts:
+                self.by_host.clear()
+            rules = [
+                rule for rule in self.rules
+                if all(d.search(key[0]) or d.search(key[1]) for d in rule.domains)
+            ]
+            ret = self.by_host[key] = (rules, {rule.index for rule in rules})
+        return ret
+
+    def matching(
+        self,
+        flow,
+        url: typing.Optional[str] = None,
+        start: int = 0,
+    ) -> typing.Iterator[Rule[T]]:
+        """
+            Yields the rules from the start index on whose URL regex matches
+            the URL and whose flow filter matches the flow, in order, and
+            counts their hits. Without a URL, only flow filters are checked.
+
+            Flow filters are evaluated as the rules are consumed, so rules
+            behind the last one used are neither checked nor counted.
+        """
+        rules: typing.List[Rule[T]]
+        domains_checked = self.has_domains and isinstance(flow, http.HTTPFlow)
+        if domains_checked:
+            passing, indices = self._passing(flow.request)
+            if url is None:
+                rules = passing
+            else:
+                rules = [rule for rule in self.candidates(url) if rule.index in indices]
+        else:
+            rules = self.rules if url is None else self.candidates(url)
+        for rule in rules:
+            if rule.index < start:
+                continue
+            if (rule.filtered or not domains_checked) and not rule.spec.matches(flow):  # type: ignore
+                continue
+            rule.hits += 1
+            yield rule
+
+    def hit_counts(self) -> typing.List[str]:
+        """
+            One "hits<TAB>option" line per rule.
+        """
+        return [f"{rule.hits}\t{rule.option}" for rule in self.rules]
@@ -0,0 +1,131 @@
+"""
+A hashed timing wheel for holding large numbers of short timers on the event
+loop, such as delayed replies.
+
+Timers are put into one of a fixed number of slots by the tick they are due
+in. While timers are pending, a single loop callback per tick fires the due
+slot, so adding and cancelling a timer is O(1) no matter how many are
+pending, and the loop does not track a handle per timer. Timers due more than
+a full turn of the wheel ahead wait in their slot for the later turns.
+
+Timers fire at the end of the tick they are due in, i.e. up to one tick late,
+and never early.
+"""
+import asyncio
+import math
+import typing
+
+
+class Timer:
+    __slots__ = ("tick", "callback", "args", "cancelled")
+
+    def __init__(self, tick: int, callback: typing.Callable, args: tuple) -> None:
+        self.tick = tick
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+
+class TimerWheel:
+    def __init__(
+        self,
+        tick: float = 0.01,
+        slots: int = 1024,
+        loop: typing.Optional[asyncio.AbstractEventLoop] = None,
+    ) -> None:
+        self.tick = tick
+        self.slots: typing.List[typing.List[Timer]] = [[] for _ in range(slots)]
+        self.loop = loop
+        self.start: typing.Optional[float] = None
+        # The last tick that has been fired.
+        self.current = 0
+        self.pending = 0
+        self.handle: typing.Optional[asyncio.TimerHandle] = None
+
+    def __len__(self) -> int:
+        return self.pending
+
+    def _now(self) -> int:
+        return math.floor((self.loop.time() - self.start) / self.tick)
+
+    def call_later(self, delay: float, callback: typing.Callable, *args) -> Timer:
+        """
+            Call callback(*args) on the event loop after delay seconds.
+        """
+        if self.loop is None:
+            self.loop = asyncio.get_event_loop()
+        if self.start is None:
+            self.start = self.loop.time()
+        if self.handle is None:
+            # Nothing is pending, skip the ticks that passed while idle.
+            self.current = max(self.current, self._now())
+        # The timer can't be fired before the tick it is due in has passed.
+        tick = max(math.ceil((self.loop.time() - self.start + delay) / self.tick), self.current + 1)
+        timer = Timer(tick, callback, args)
+        self.slots[tick % len(self.slots)].append(timer)
+        self.pending += 1
+        if self.handle is None:
+            self._schedule()
+        return timer
+
+    def cancel(self, timer: Timer) -> None:
+        if not timer.cancelled:
+            timer.cancelled = True
+            self.pending -= 1
+
+    def _schedule(self) -> None:
+        self.handle = self.loop.call_at(self.start + (self.current + 1) * self.tick, self._advance)
+
+    def _advance(self) -> None:
+        # Catch up on the ticks missed while the loop was busy. The handle
+        # is kept until then, so that timers added by callbacks don't
+        # reschedule the wheel.
+        now = self._now()
+        while self.current < now and self.pending:
+            self.current += 1
+            self._fire(self.current)
+        self.handle = None
+        if self.pending:
+            self._schedule()
+
+    def _fire(self, tick: int) -> None:
+        slot = self.slots[tick % len(self.slots)]
+        if not slot:
+            return
+        due = []
+        later = []
+        for timer in slot:
+            if timer.cancelled:
+                continue
+            if timer.tick <= tick:
+                due.append(timer)
+            else:
+                later.append(timer)
+        slot[:] = later
+        for timer in due:
+            self._call(timer)
+
+    def _call(self, timer: Timer) -> None:
+        timer.cancelled = True
+        self.pending -= 1
+        try:
+            timer.callback(*timer.args)
+        except Exception as e:
+            # Like a failing loop callback, without holding up the other timers.
+            self.loop.call_exception_handler({
+                "message": "Exception in timer callback",
+                "exception": e,
+            })
+
+    def fire_all(self) -> None:
+        """
+            Fire all pending timers now, e.g. to release delayed replies on shutdown.
+        """
+        if self.handle:
+            self.handle.cancel()
+            self.handle = None
+        timers = sorted((t for slot in self.slots for t in slot if not t.cancelled), key=lambda t: t.tick)
+        for slot in self.slots:
+            slot.clear()
+        for timer in timers:
+            self._call(timer)
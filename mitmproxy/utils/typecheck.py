@@ -31,11 +31,16 @@ def check_option_type(name: str, value: typing.Any, typeinfo: Type) -> None:
     TypeError otherwise. This function supports only those types required for
     options.
     """
-    e = TypeError("Expected {} for {}, but got {}.".format(
-        typeinfo,
-        name,
-        type(value)
-    ))
+    if type(typeinfo) is type and isinstance(value, typeinfo):
+        # Plain classes are by far the most common case, e.g. for every field of every HTTP message.
+        return
+
+    def e():
+        return TypeError("Expected {} for {}, but got {}.".format(
+            typeinfo,
+            name,
+            type(value)
+        ))
 
     typename = str(typeinfo)
 
@@ -47,33 +52,33 @@ def check_option_type(name: str, value: typing.Any, typeinfo: Type) -> None:
                 pass
             else:
                 return
-        raise e
+        raise e()
     elif typename.startswith("typing.Tuple"):
         types = tuple_types(typeinfo)
         if not isinstance(value, (tuple, list)):
-            raise e
+            raise e()
         if len(types) != len(value):
-            raise e
+            raise e()
         for i, (x, T) in enumerate(zip(value, types)):
             check_option_type(f"{name}[{i}]", x, T)
         return
     elif typename.startswith("typing.Sequence"):
         T = sequence_type(typeinfo)
         if not isinstance(value, (tuple, list)):
-            raise e
+            raise e()
         for v in value:
             check_option_type(name, v, T)
     elif typename.startswith("typing.IO"):
         if hasattr(value, "read"):
             return
         else:
-            raise e
+            raise e()
     elif typename.startswith("typing.Any"):
         return
     elif not isinstance(value, typeinfo):
         if typeinfo is float and isinstance(value, int):
             return
-        raise e
+        raise e()
 
 
 def typespec_to_str(typespec: typing.Any) -> str:
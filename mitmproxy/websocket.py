@@ -1,5 +1,6 @@
 import time
 import queue
+import socket
 import warnings
 from typing import List, Optional, Union
 
@@ -72,7 +73,9 @@ class WebSocketFlow(flow.Flow):
         super().__init__("websocket", client_conn, server_conn, live)
 
         self.messages: List[WebSocketMessage] = []
-        """A list containing all WebSocketMessage's."""
+        """A list containing all WebSocketMessage's (or the most recent ones, see messages_dropped)."""
+        self.messages_dropped = 0
+        """Number of messages dropped from the front of messages because of websocket_message_limit."""
         self.close_sender = 'client'
         """'client' if the client initiated connection closing."""
         self.close_code = CloseReason.NORMAL_CLOSURE
@@ -88,8 +91,10 @@ class WebSocketFlow(flow.Flow):
         self.ended = False
         """True when the WebSocket connection has been closed."""
 
-        self._inject_messages_client = queue.Queue(maxsize=1)
-        self._inject_messages_server = queue.Queue(maxsize=1)
+        self._inject_messages_client: queue.Queue = queue.Queue()
+        self._inject_messages_server: queue.Queue = queue.Queue()
+        # set by the live WebSocketLayer, wakes it up when a message is injected
+        self._inject_wakeup: Optional[socket.socket] = None
 
         if handshake_flow:
             self.client_key = websocket.get_client_key(handshake_flow.request.headers)
@@ -169,3 +174,10 @@ class WebSocketFlow(flow.Flow):
             self._inject_messages_server.put(payload)
         else:
             raise ValueError('Invalid endpoint')
+        # The layer clears the wakeup from its own thread when it ends.
+        w = self._inject_wakeup
+        if w is not None:
+            try:
+                w.send(b"\x00")
+            except OSError:  # pragma: no cover
+                pass  # the layer is gone or the wakeup is already pending.
@@ -0,0 +1,190 @@
+import os
+import time
+import hashlib
+import mitmproxy
+from mitmproxy.http import FileBody
+from softmock.database import blobs
+
+# 超过这个大小的响应内容存成文件，命中时从磁盘流式返回
+MIN_SIZE = 256 * 1024
+# gc不会删除这段时间（秒）内写入的文件，它们的记录可能还没有提交
+GRACE = 3600
+
+CREATE_TABLE = "create table if not exists MockBlob (url TEXT primary key, digest TEXT, size INTEGER)"
+
+
+def blob_path(digest, root=blobs):
+    '''
+    按内容的sha256存放，相同的内容只保存一份
+    '''
+    return os.path.join(root, digest[:2], digest)
+
+
+def write(body, root=blobs):
+    digest = hashlib.sha256(body).hexdigest()
+    path = blob_path(digest, root)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 先写临时文件再改名，避免返回写了一半的文件
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(body)
+        os.replace(tmp, path)
+    return digest
+
+
+def save(cursor, url, body):
+    '''
+    body为返回给客户端的原始内容，太小的内容不需要单独存放
+    '''
+    if len(body) < MIN_SIZE:
+        delete(cursor, url)
+        return
+    digest = write(body)
+    cursor.execute(
+        "insert or replace into MockBlob (url, digest, size) values (?, ?, ?)",
+        (url, digest, len(body)))
+
+
+def delete(cursor, url):
+    cursor.execute("delete from MockBlob where url=?", (url, ))
+
+
+def load(cursor, url):
+    '''
+    返回 (path, digest, size)，没有对应的文件时返回None
+    '''
+    row = cursor.execute(
+        "select digest, size from MockBlob where url=?", (url, )).fetchone()
+    if not row:
+        return None
+    path = blob_path(row[0])
+    if not os.path.exists(path):
+        return None
+    return path, row[0], row[1]
+
+
+def gc(db, root=blobs, grace=GRACE):
+    '''
+    删除已经没有对应mock的记录和文件，返回删除的文件数
+    gc在后台线程执行，和录制同时进行：正在写入的临时文件和刚写好、记录还没有提交的文件不能删除
+    '''
+    db.execute(
+        "delete from MockBlob where url not in (select url from Mock1)")
+    db.commit()
+    used = {i[0] for i in db.execute("select distinct digest from MockBlob")}
+    removed = 0
+    if not os.path.isdir(root):
+        return removed
+    before = time.time() - grace
+    for prefix in os.listdir(root):
+        folder = os.path.join(root, prefix)
+        if not os.path.isdir(folder):
+            continue
+        for name in os.listdir(folder):
+            if name in used or name.endswith('.tmp'):
+                continue
+            path = os.path.join(folder, name)
+            try:
+                if os.path.getmtime(path) > before:
+                    continue
+                os.remove(path)
+            except OSError:
+                # 已经被其他进程删除
+                continue
+            removed += 1
+    return removed
+
+
+def remove_unused(db, digests, root=blobs):
+    '''
+    删除mock之后调用，digests为删除的记录引用的文件，已经没有记录引用的文件直接删除
+    '''
+    used = set()
+    for digest in set(digests):
+        if db.execute("select 1 from MockBlob where digest=? limit 1", (digest, )).fetchone():
+            used.add(digest)
+    removed = 0
+    for digest in set(digests) - used:
+        try:
+            os.remove(blob_path(digest, root))
+        except OSError:
+            continue
+        removed += 1
+    return removed
+
+
+def etag_matches(if_none_match, etag):
+    for tag in if_none_match.split(','):
+        tag = tag.strip()
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        if tag == '*' or tag == etag:
+            return True
+    return False
+
+
+def parse_range(value, size):
+    '''
+    只支持单个区间，返回 (start, end)，end包含在内
+    区间无法满足时返回False，不支持或无效的格式返回None，按完整内容返回
+    '''
+    unit, _, spec = value.partition('=')
+    if unit.strip().lower() != 'bytes' or ',' in spec:
+        return None
+    start, _, end = spec.strip().partition('-')
+    try:
+        if not start:
+            # bytes=-500 表示最后500字节
+            length = int(end)
+            if length <= 0:
+                return False
+            return max(size - length, 0), size - 1
+        start = int(start)
+        end = int(end) if end else None
+    except ValueError:
+        return None
+    # end在start前面是无效的格式，要忽略Range而不是返回416
+    if end is not None and end < start:
+        return None
+    if start >= size:
+        return False
+    if end is None:
+        end = size - 1
+    return start, min(end, size - 1)
+
+
+def response(request, status_code, headers, blob):
+    '''
+    生成从文件返回内容的响应，支持If-None-Match和Range
+    录制的状态码不是200时（比如本身就是206），原样返回整个文件
+    '''
+    path, digest, size = blob
+    headers = {k: v for k, v in headers.items() if k.lower()
+               not in ('etag', 'accept-ranges', 'content-range')}
+    offset, length = 0, size
+    if status_code == 200:
+        etag = f'"{digest[:32]}"'
+        headers['ETag'] = etag
+        headers['Accept-Ranges'] = 'bytes'
+        if etag_matches(request.headers.get('if-none-match', ''), etag):
+            resp = mitmproxy.http.HTTPResponse.make(304, b'', headers)
+            resp.headers.pop('content-length', None)
+            return resp
+        value = request.headers.get('range', '')
+        if_range = request.headers.get('if-range', None)
+        if value and (if_range is None or if_range == etag):
+            rng = parse_range(value, size)
+            if rng is False:
+                headers['Content-Range'] = f'bytes */{size}'
+                return mitmproxy.http.HTTPResponse.make(416, b'', headers)
+            if rng:
+                status_code = 206
+                offset, length = rng[0], rng[1] - rng[0] + 1
+                headers['Content-Range'] = f'bytes {rng[0]}-{rng[1]}/{size}'
+    resp = mitmproxy.http.HTTPResponse.make(status_code, b'', headers)
+    resp.headers['content-length'] = str(length)
+    # 内容不放在内存里，由代理直接从文件发送
+    resp.data.content = None
+    resp.stream = FileBody(path, offset, length)
+    return resp
@@ -0,0 +1,270 @@
+import hashlib
+import itertools
+import sqlite3
+import struct
+import msgpack
+import zstandard as zstd
+from softmock.database import database
+from softmock import retention
+from softmock import blobs
+from softmock import frames
+from softmock import contents
+
+# mock的导入导出，用于在机器之间迁移mock数据
+#
+# 文件格式：MAGIC之后是一个zstd压缩流，流里是连续的记录，每条记录为
+# 1字节类型 + 4字节长度（大端）+ 内容
+#     BODY: 32字节sha256 + 内容，同样的内容只写一次
+#     MOCK: msgpack编码的 [id, url, status, detail, blob, variants, frames, content, profile]
+#         blob: 大的响应内容的sha256，没有为None
+#         variants: [[encoding, sha256]]，预先压缩好的响应内容
+#         frames: [[seq, from_client, after, delay, content]]，WebSocket消息
+#         content: detail引用的响应内容（见contents.py）的sha256，没有为None
+#         profile: 返回时的延迟、带宽和错误率（见profiles.py），没有为None
+#     旧的文件没有content和profile
+# MOCK引用的内容都在它之前写入，导入时可以边读边写
+MAGIC = b'SOFTMOCK-BUNDLE\x00\x01'
+BODY = 1
+MOCK = 2
+HEADER = struct.Struct('>BI')
+# 压缩级别，3比默认的级别快，压缩率差不多
+LEVEL = 3
+# 导入时每次写入的mock条数
+BATCH = 1000
+
+
+class BundleError(Exception):
+    pass
+
+
+class Writer:
+    def __init__(self, f, level=LEVEL):
+        f.write(MAGIC)
+        # 多线程压缩，导出的速度基本取决于磁盘
+        self.stream = zstd.ZstdCompressor(level=level, threads=-1).stream_writer(f, closefd=False)
+        self.digests = set()
+
+    def record(self, kind, payload):
+        self.stream.write(HEADER.pack(kind, len(payload)))
+        self.stream.write(payload)
+
+    def body(self, content, digest=None):
+        '''
+        返回内容的sha256，已经写过的内容不再写入
+        '''
+        if digest is None:
+            digest = hashlib.sha256(content).digest()
+        if digest not in self.digests:
+            self.digests.add(digest)
+            self.record(BODY, digest + content)
+        return digest
+
+    def mock(self, values):
+        self.record(MOCK, msgpack.packb(values, use_bin_type=True))
+
+    def close(self):
+        self.stream.close()
+
+
+def read_exact(stream, size):
+    '''
+    stream_reader每次可能只返回一部分，读到文件结尾时返回的内容比size少
+    '''
+    chunks = []
+    while size:
+        chunk = stream.read(size)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def read_records(f):
+    '''
+    依次返回 (类型, 内容)
+    '''
+    if f.read(len(MAGIC)) != MAGIC:
+        raise BundleError('不是softmock导出的文件')
+    stream = zstd.ZstdDecompressor().stream_reader(f, closefd=False)
+    try:
+        while True:
+            header = read_exact(stream, HEADER.size)
+            if not header:
+                return
+            if len(header) < HEADER.size:
+                raise BundleError('文件不完整')
+            kind, length = HEADER.unpack(header)
+            payload = read_exact(stream, length)
+            if len(payload) < length:
+                raise BundleError('文件不完整')
+            yield kind, payload
+    except zstd.ZstdError as e:
+        raise BundleError(f'文件已损坏：{e}')
+
+
+def create_tables(db):
+    '''
+    新机器上还没有数据库时，导入前先建表
+    '''
+    db.execute("pragma auto_vacuum=INCREMENTAL")
+    db.execute(
+        "create table if not exists Mock1 (id varchar(100) primary key, detail TEXT, url TEXT, status Text)")
+    retention.ensure_schema(db)
+
+
+class Grouped:
+    '''
+    按url排好序的查询结果，按url分组取出，和同样按url排序的mock一起遍历
+    '''
+
+    def __init__(self, cursor):
+        self.groups = itertools.groupby(cursor, key=lambda row: row[0])
+        self.url, self.rows = None, []
+        self.done = False
+
+    def get(self, url):
+        while not self.done and (self.url is None or self.url < url):
+            group = next(self.groups, None)
+            if group is None:
+                self.done = True
+                self.url, self.rows = None, []
+            else:
+                self.url, self.rows = group[0], [row[1:] for row in group[1]]
+        return self.rows if self.url == url else []
+
+
+def export(path, host=None, db_path=database, blob_root=blobs.blobs):
+    '''
+    导出host下的mock（host为空时导出全部），返回 (mock条数, 内容条数)
+    '''
+    db = sqlite3.connect(db_path)
+    try:
+        create_tables(db)
+        where, params = "", ()
+        if host:
+            where, params = " where url like ?", (f'%{host}%', )
+        # 每条mock分别查询太慢，几张表都按url排序后一起遍历
+        mocks = db.execute(
+            f"select id, url, status, detail, digest, profile from Mock1{where} order by url, rowid", params)
+        blob_rows = Grouped(db.execute(
+            f"select url, digest from MockBlob{where} order by url", params))
+        variant_rows = Grouped(db.execute(
+            f"select url, encoding, body from MockBody{where} order by url", params))
+        frame_rows = Grouped(db.execute(
+            f"select url, seq, from_client, after, delay, content from MockFrame{where} order by url, seq", params))
+        count = 0
+        with open(path, 'wb') as f:
+            writer = Writer(f)
+            for id, url, status, detail, digest, profile in mocks:
+                content = contents.load(db, digest) if digest else None
+                content_digest = None
+                if content is not None:
+                    content_digest = writer.body(content.encode('utf-8', 'surrogatepass'), bytes.fromhex(digest))
+                blob = None
+                for blob_digest, in blob_rows.get(url):
+                    try:
+                        with open(blobs.blob_path(blob_digest, blob_root), 'rb') as b:
+                            blob_content = b.read()
+                    except OSError:
+                        # 文件已经被删除，导入后按原始内容返回
+                        continue
+                    blob = writer.body(blob_content, bytes.fromhex(blob_digest))
+                variants = [[enc, writer.body(body)] for enc, body in variant_rows.get(url)]
+                lst = [list(i) for i in frame_rows.get(url)]
+                writer.mock([id, url, status, detail, blob, variants, lst, content_digest, profile])
+                count += 1
+            writer.close()
+        return count, len(writer.digests)
+    finally:
+        db.close()
+
+
+def import_(path, db_path=database, blob_root=blobs.blobs):
+    '''
+    导入mock，url已经存在的mock会被替换，整个文件在一个事务里导入
+    返回导入的mock条数
+    '''
+    db = sqlite3.connect(db_path)
+    try:
+        create_tables(db)
+        cursor = db.cursor()
+        # 内容只在导入期间需要，先放在临时表里，由后面的mock引用
+        cursor.execute(
+            "create temp table BundleBody (digest BLOB primary key, body BLOB)")
+        count = 0
+        loaded = set()
+        # url -> mock，同一个url只保留最后一条
+        batch = {}
+        with open(path, 'rb') as f:
+            for kind, payload in read_records(f):
+                if kind == BODY:
+                    digest, content = payload[:32], payload[32:]
+                    if hashlib.sha256(content).digest() != digest:
+                        raise BundleError('内容校验失败')
+                    cursor.execute(
+                        "insert or ignore into BundleBody (digest, body) values (?, ?)", (digest, content))
+                    loaded.add(digest)
+                elif kind == MOCK:
+                    try:
+                        mock = msgpack.unpackb(payload, raw=False)
+                        mock.extend([None] * (9 - len(mock)))
+                        batch[mock[1]] = mock
+                    except (ValueError, IndexError, TypeError, msgpack.UnpackException):
+                        raise BundleError('文件已损坏')
+                    if mock[7] is not None and mock[7] not in loaded:
+                        raise BundleError('文件已损坏，缺少引用的内容')
+                    count += 1
+                    if len(batch) >= BATCH:
+                        save(cursor, list(batch.values()), blob_root)
+                        batch = {}
+        save(cursor, list(batch.values()), blob_root)
+        cursor.execute("drop table BundleBody")
+        db.commit()
+        return count
+    except BaseException:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def save(cursor, mocks, blob_root=blobs.blobs):
+    '''
+    按url替换已有的mock，id相同的mock也会被替换
+    mocks: [[id, url, status, detail, blob, variants, frames, content, profile]]，url不能重复
+    '''
+    urls = [(mock[1], ) for mock in mocks]
+    cursor.executemany("delete from Mock1 where url=?", urls)
+    # insert or replace删除的行不会触发触发器，内容的引用计数会不对，先按id删除
+    cursor.executemany("delete from Mock1 where id=?", [(mock[0], ) for mock in mocks])
+    cursor.executemany("delete from MockBody where url=?", urls)
+    cursor.executemany("delete from MockBlob where url=?", urls)
+    cursor.executemany("delete from MockFrame where url=?", urls)
+    params = [(content.hex(), content) for *_, content, _ in mocks if content is not None]
+    cursor.executemany(
+        "insert or ignore into MockContent (digest, refs, content) select ?, 0, cast(body as TEXT) from BundleBody where digest=?", params)
+    cursor.executemany(
+        "insert or replace into Mock1 (`id`, `detail`, `url`, `status`, digest, profile) values (?, ?, ?, ?, ?, ?)",
+        [(id, detail, url, status, content.hex() if content is not None else None, profile)
+         for id, url, status, detail, *_, content, profile in mocks])
+    for id, url, status, detail, blob, variants, lst, _, _ in mocks:
+        if blob is None:
+            continue
+        row = cursor.execute(
+            "select body from BundleBody where digest=?", (blob, )).fetchone()
+        if row is None:
+            raise BundleError('文件已损坏，缺少引用的内容')
+        digest = blobs.write(row[0], blob_root)
+        cursor.execute(
+            "insert or replace into MockBlob (url, digest, size) values (?, ?, ?)",
+            (url, digest, len(row[0])))
+    # 内容直接从临时表复制，不用经过python
+    params = [(url, enc, digest) for _, url, _, _, _, variants, *_ in mocks for enc, digest in variants]
+    cursor.executemany(
+        "insert into MockBody (url, encoding, body) select ?, ?, body from BundleBody where digest=?", params)
+    if cursor.rowcount != len(params):
+        raise BundleError('文件已损坏，缺少引用的内容')
+    cursor.executemany(
+        "insert into MockFrame (url, seq, from_client, after, delay, content) values (?, ?, ?, ?, ?, ?)",
+        [(url, *i) for _, url, _, _, _, _, lst, *_ in mocks for i in lst])
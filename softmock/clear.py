@@ -1,5 +1,9 @@
 import sqlite3
 from softmock.database import database
+from softmock import retention
+from softmock import variants
+from softmock import blobs
+from softmock import frames
 
 
 def clear():
@@ -8,8 +12,17 @@ def clear():
     sql = "delete from Mock1"
 
     cursor.execute(sql)
+    cursor.execute(variants.CREATE_TABLE)
+    cursor.execute("delete from MockBody")
+    cursor.execute(blobs.CREATE_TABLE)
+    cursor.execute(frames.CREATE_TABLE)
+    cursor.execute("delete from MockFrame")
     db.commit()
     cursor.close()
+    # 全部清理，不用保留刚写入的文件
+    blobs.gc(db, grace=0)
+    # 回收删除数据后的空闲页
+    retention.incremental_vacuum(db)
     db.close()
 
     print('清理完成')
@@ -0,0 +1,127 @@
+import codecs
+import hashlib
+import json
+from urllib import parse
+
+# 录制时同样的静态资源、同样的json会反复出现，每条mock的detail里都有一份完整的内容
+# 响应内容按sha256存放在MockContent里，相同的内容只保存一份
+# detail中response['html']为None，response['html_digest']为内容的sha256，Mock1.digest同样
+# refs为引用内容的mock条数，由触发器维护，没有引用的内容直接删除
+
+# 太小的内容单独存放没有意义
+MIN_SIZE = 1024
+
+CREATE_TABLE = "create table if not exists MockContent (digest TEXT primary key, refs INTEGER default 0, content TEXT)"
+
+TRIGGERS = [
+    """create trigger if not exists Mock1_content_inserted after insert on Mock1 when new.digest is not null
+    begin
+        update MockContent set refs=refs+1 where digest=new.digest;
+    end""",
+    """create trigger if not exists Mock1_content_deleted after delete on Mock1 when old.digest is not null
+    begin
+        update MockContent set refs=refs-1 where digest=old.digest;
+        delete from MockContent where digest=old.digest and refs<=0;
+    end""",
+    """create trigger if not exists Mock1_content_updated after update of digest on Mock1
+    when old.digest is not new.digest
+    begin
+        update MockContent set refs=refs+1 where digest=new.digest;
+        update MockContent set refs=refs-1 where digest=old.digest;
+        delete from MockContent where digest=old.digest and refs<=0;
+    end""",
+]
+
+
+def ensure_schema(cursor):
+    '''
+    给旧的数据库补上digest字段，已有的mock在这时把内容移到MockContent
+    '''
+    cursor.execute(CREATE_TABLE)
+    columns = [i[1] for i in cursor.execute("pragma table_info(Mock1)")]
+    if 'digest' in columns:
+        for sql in TRIGGERS:
+            cursor.execute(sql)
+        return
+    cursor.execute("alter table Mock1 add column digest TEXT")
+    for sql in TRIGGERS:
+        cursor.execute(sql)
+    rows = [i for i in cursor.execute("select rowid, `detail`, `updated` from Mock1")]
+    for rowid, detail, updated in rows:
+        try:
+            packed, digest = pack(cursor, json.loads(unquote(detail)))
+        except Exception:
+            continue
+        if digest:
+            cursor.execute(
+                "update Mock1 set `detail`=?, digest=? where rowid=?", (packed, digest, rowid))
+            # 只改了内容的存放位置，不算更新，恢复触发器改掉的updated
+            cursor.execute(
+                "update Mock1 set `updated`=? where rowid=?", (updated, rowid))
+
+
+def unquote(detail):
+    '''
+    parse.unquote逐个字符处理，内容大时很慢
+    detail由parse.quote生成，只有ascii字符，把%XX换成\\xXX后由escape_decode一次解码
+    '''
+    try:
+        raw = detail.encode('ascii')
+        if b'\\' not in raw:
+            return codecs.escape_decode(raw.replace(b'%', b'\\x'))[0].decode('utf-8', 'replace')
+    except (UnicodeEncodeError, ValueError):
+        # 不完整的%XX按parse.unquote的方式原样保留
+        pass
+    return parse.unquote(detail)
+
+
+def digest_of(html):
+    return hashlib.sha256(html.encode('utf-8', 'surrogatepass')).hexdigest()
+
+
+def pack(cursor, detail):
+    '''
+    返回 (写入Mock1.detail的内容, 内容的digest)，太小的内容返回的digest为None
+    detail可以是dict或者json字符串，传入的detail不会被修改
+    写入Mock1时digest要一起写入，MockContent的引用计数才正确
+    '''
+    if isinstance(detail, str):
+        detail = json.loads(detail)
+    response = (detail.get('data', None) or {}).get('response', None)
+    html = response.get('html', None) if isinstance(response, dict) else None
+    if not isinstance(html, str) or len(html) < MIN_SIZE:
+        return parse.quote(json.dumps(detail, ensure_ascii=False)), None
+    digest = digest_of(html)
+    # 已经有同样的内容时不用再写一次
+    cursor.execute(
+        "insert or ignore into MockContent (digest, refs, content) values (?, 0, ?)", (digest, html))
+    packed = {**detail, 'data': {
+        **detail['data'], 'response': {**response, 'html': None, 'html_digest': digest}}}
+    return parse.quote(json.dumps(packed, ensure_ascii=False)), digest
+
+
+def resolve(cursor, response):
+    '''
+    把引用的内容放回response['html']，找不到内容时为None
+    '''
+    if not isinstance(response, dict):
+        return response
+    digest = response.pop('html_digest', None)
+    if digest:
+        response['html'] = load(cursor, digest)
+    return response
+
+
+def unpack(cursor, detail):
+    '''
+    读取Mock1.detail，返回带完整内容的dict
+    '''
+    result = json.loads(unquote(detail))
+    resolve(cursor, (result.get('data', None) or {}).get('response', None))
+    return result
+
+
+def load(cursor, digest):
+    row = cursor.execute(
+        "select content from MockContent where digest=?", (digest, )).fetchone()
+    return row[0] if row else None
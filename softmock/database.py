@@ -2,3 +2,7 @@ import os
 
 current_path = os.path.abspath(os.path.dirname(__file__))
 database = os.path.join(current_path, "soft_mock.db")
+# 大的响应内容存放的目录
+blobs = os.path.join(current_path, "blobs")
+# 流式返回时落盘的完整副本，用于录制，退出时删除
+streams = os.path.join(current_path, "streams")
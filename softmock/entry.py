@@ -1,9 +1,15 @@
+import sqlite3
 import click
 
 
 from softmock import index
 from softmock.utils.version import version as VERSION
-from softmock import clear
+from softmock.clear import clear
+from softmock import retention
+from softmock import loadtest
+from softmock import bundle
+from softmock import profiles
+from softmock.database import database
 
 
 def version(ctx, param, value):
@@ -19,15 +25,90 @@ def clear_all(ctx, param, value):
         ctx.exit()
 
 
+def compact(max_age, max_rows_per_host):
+    result = retention.compact(
+        max_age=max_age, max_rows_per_host=max_rows_per_host)
+    click.secho(f'已清理{result["deleted"]}条数据')
+    click.secho(f'已删除{result["removed_blobs"]}个不再使用的文件')
+    click.secho(f'文件大小：{result["file_size"]} 字节，空闲页：{result["free_pages"]}')
+    for host, count in sorted(result['rows_per_host'].items()):
+        click.secho(f'{host}：{count}条')
+
+
+def export(path, host):
+    try:
+        count, bodies = bundle.export(path, host)
+    except OSError as e:
+        click.secho(f'导出失败：{e}', fg='red')
+        return
+    click.secho(f'已导出{count}条mock，{bodies}份内容到{path}')
+
+
+def import_(path):
+    try:
+        count = bundle.import_(path)
+    except (bundle.BundleError, OSError) as e:
+        click.secho(f'导入失败：{e}', fg='red')
+        return
+    click.secho(f'已导入{count}条mock')
+
+
+def set_profile(text, host):
+    db = sqlite3.connect(database)
+    try:
+        # 还没有录制过时数据库是空的
+        bundle.create_tables(db)
+        count = profiles.save_host(db.cursor(), host, text)
+        db.commit()
+    except profiles.ProfileError as e:
+        click.secho(f'配置有误：{e}', fg='red')
+        return
+    finally:
+        db.close()
+    click.secho(f'已修改{count}条mock的配置' if text else f'已清除{count}条mock的配置')
+
+
 @click.command()
 @click.option('--version', '-v', is_flag=True, is_eager=True, expose_value=False, help='查看softmock版本信息', callback=version)
-@click.option('--host', '-h', prompt='请输入要监听的host', help='监听的host')
+@click.option('--host', '-h', help='监听的host')
 @click.option('--clear-all', help='清理所有数据', is_flag=True, is_eager=True, expose_value=False, callback=clear_all)
-def main(host):
+@click.option('--compact', 'do_compact', help='按保留策略清理数据并压缩数据库', is_flag=True)
+@click.option('--max-age', type=int, default=0, help='配合--compact，数据保留的天数')
+@click.option('--max-rows-per-host', type=int, default=0, help='配合--compact，每个host最多保留的条数')
+@click.option('--offline', is_flag=True, help='有mock数据的host完全离线返回，不连接真实服务器')
+@click.option('--load-test', 'do_load_test', is_flag=True, help='用host下启用的mock对应的请求压测真实服务器')
+@click.option('--rps', type=int, default=0, help='配合--load-test，每秒请求数，0为不限速')
+@click.option('--ramp', type=int, default=0, help='配合--load-test，每秒请求数从0线性增加到--rps的秒数')
+@click.option('--duration', type=int, default=0, help='配合--load-test，压测的秒数，0为每个请求发送一次')
+@click.option('--concurrency', type=int, default=1, help='配合--load-test，并发的连接数')
+@click.option('--report', help='配合--load-test，压测结果保存为json的文件路径')
+@click.option('--export', 'export_path', help='把mock导出到文件，指定--host时只导出这个host的mock')
+@click.option('--import', 'import_path', help='从--export导出的文件导入mock，url相同的mock会被替换')
+@click.option('--profile', help='给host下所有的mock设置返回时的延迟、带宽和错误率，为json，空字符串为清除，'
+              '例如 \'{"latency": [100, 500], "bandwidth": "64k", "error_rate": 0.01}\'')
+def main(host, do_compact, max_age, max_rows_per_host, offline,
+         do_load_test, rps, ramp, duration, concurrency, report, export_path, import_path, profile):
     """
     录制接口，并mock数据！
     """
-    index.launch(host)
+    if do_compact:
+        compact(max_age, max_rows_per_host)
+        return
+    if export_path:
+        export(export_path, host)
+        return
+    if import_path:
+        import_(import_path)
+        return
+    if not host:
+        host = click.prompt('请输入要监听的host')
+    if profile is not None:
+        set_profile(profile, host)
+        return
+    if do_load_test:
+        loadtest.launch(host, rps, ramp, duration, concurrency, report)
+        return
+    index.launch(host, offline)
 
 
 main()
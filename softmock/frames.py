@@ -0,0 +1,30 @@
+CREATE_TABLE = "create table if not exists MockFrame (url TEXT, seq INTEGER, from_client INTEGER, after INTEGER, delay REAL, content BLOB, primary key (url, seq))"
+
+
+def delete(cursor, url):
+    cursor.execute("delete from MockFrame where url=?", (url, ))
+
+
+def append_many(cursor, url, rows):
+    '''
+    rows: [(seq, from_client, after, delay, content)]
+    after: 这条消息之前客户端已经发送的消息条数，回放时要等客户端发送了同样多的消息
+    delay: 和上一条消息（不管哪一端发送的）间隔的秒数
+    content: 文本消息为str，二进制消息为bytes，sqlite会保留类型
+    '''
+    cursor.executemany(
+        "insert or replace into MockFrame (url, seq, from_client, after, delay, content) values (?, ?, ?, ?, ?, ?)",
+        [(url, seq, int(from_client), after, delay, content) for seq, from_client, after, delay, content in rows])
+
+
+def exists(cursor, url):
+    return cursor.execute(
+        "select 1 from MockFrame where url=? limit 1", (url, )).fetchone() is not None
+
+
+def load(cursor, url):
+    '''
+    按录制顺序返回 [(from_client, after, delay, content)]
+    '''
+    return cursor.execute(
+        "select from_client, after, delay, content from MockFrame where url=? order by seq", (url, )).fetchall()
@@ -2,7 +2,8 @@ from .utils.version import version
 from .mock.mock import Mock
 
 
-def launch(host):
+def launch(host, offline=False):
     mock = Mock()
     mock.set('--host', host)
+    mock.set('--offline', offline)
     mock.start()
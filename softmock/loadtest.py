@@ -0,0 +1,79 @@
+import json
+import os
+import sqlite3
+import tempfile
+from urllib import parse
+import click
+from mitmproxy import connections
+from mitmproxy import http
+from mitmproxy import io
+from mitmproxy.net.http.url import hostport
+from softmock.database import database
+
+
+def make_flow(request):
+    '''
+    用mock里保存的请求生成flow，请求内容是解码后的文本
+    '''
+    url = f"{request['scheme']}://{request['host']}:{request['port']}{request['path']}"
+    headers = [(k.encode('utf-8', 'surrogateescape'), v.encode('utf-8', 'surrogateescape'))
+               for k, v in request.get('headers', None) or []]
+    req = http.HTTPRequest.make(
+        request['method'], url, request.get('raw_content', None) or '', headers)
+    # HTTP/2录制的请求没有host头
+    if 'host' not in req.headers:
+        req.headers.insert(0, 'host', hostport(req.scheme, req.host, req.port))
+    flow = http.HTTPFlow(
+        connections.ClientConnection.make_dummy(('', 0)),
+        connections.ServerConnection.make_dummy((req.host, req.port))
+    )
+    flow.request = req
+    return flow
+
+
+def flows(cursor, host):
+    '''
+    host下所有启用的mock对应的请求
+    '''
+    ret = []
+    for detail, in cursor.execute(
+            "select `detail` from Mock1 where status='1' and url like ?", (f'%{host}%', )):
+        try:
+            request = json.loads(parse.unquote(detail))['data']['request']
+            ret.append(make_flow(request))
+        except (ValueError, KeyError, TypeError):
+            continue
+    return ret
+
+
+def launch(host, rps, ramp, duration, concurrency, report):
+    '''
+    用录制的请求压测真实服务器，请求直接发给服务器，不经过mock
+    '''
+    from mitmproxy.tools.main import run as mitmproxy_run
+    from mitmproxy.tools import dump, cmdline
+    db = sqlite3.connect(database)
+    try:
+        lst = flows(db, host)
+    finally:
+        db.close()
+    if not lst:
+        click.secho(f'{host}没有可以压测的mock数据', fg='red')
+        return
+    # 通过流文件交给load_test选项，和压测mitmproxy保存的流走同一条路
+    fd, path = tempfile.mkstemp(prefix='softmock-loadtest-', suffix='.mitm')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            writer = io.FlowWriter(f)
+            for flow in lst:
+                writer.add(flow)
+        args = ['--no-server', '--load-test', path,
+                '--load-test-rps', str(rps),
+                '--load-test-ramp', str(ramp),
+                '--load-test-duration', str(duration),
+                '--load-test-concurrency', str(concurrency)]
+        if report:
+            args += ['--load-test-report', report]
+        mitmproxy_run(dump.DumpMaster, cmdline.mitmdump, args)
+    finally:
+        os.remove(path)
@@ -4,20 +4,25 @@ import os
 import subprocess
 from mitmproxy.tools.main import run as mitmproxy_run
 from mitmproxy.tools import web, cmdline
-from softmock.database import database
+from softmock.database import database, streams
+from softmock import retention
+from softmock import variants
 import sqlite3
 import click
 
 # 导入addons
-from .addons import Host
+from .addons import Host, Retention, WebSocketMock
 
 
 class Proxy:
-    def __init__(self, host):
+    def __init__(self, host, offline=False):
         self.host = host
+        self.offline = offline
         self.conn = sqlite3.connect(database)
         self.network_list = ['Wi-Fi', 'Ethernet']
         cursor = self.conn.cursor()
+        # 新建的数据库开启增量回收，删除数据后文件可以变小
+        cursor.execute("pragma auto_vacuum=INCREMENTAL")
         try:
             sql = "create table Mock1 (id varchar(100) primary key, detail TEXT, url TEXT, status Text)"
             cursor.execute(sql)
@@ -25,6 +30,8 @@ class Proxy:
             cursor.execute(sql)
         except:
             pass
+        cursor.execute(variants.CREATE_TABLE)
+        retention.ensure_schema(self.conn)
 
     def set_browser_proxy(self):
 
@@ -105,11 +112,23 @@ class Proxy:
 
     def server_start(self):
         sys.argv = sys.argv[0:1]
-        addons = [Host(self.host, self.conn)]  # 添加插件
+        addons = [Host(self.host, self.conn), Retention(), WebSocketMock()]  # 添加插件
         # 设置浏览器代理
         self.set_browser_proxy()
+        # WebSocket消息已经写入数据库，内存里只保留最近的消息
+        args = ['--host', self.host, '--set', 'websocket_message_limit=1000']
+        # 页面不显示事件日志，不需要保存debug日志
+        args += ['--set', 'eventstore_verbosity=info']
+        # 视频和二进制下载边返回边落盘一份，录制时从落盘的副本读取；json要完整录制，不流式
+        os.makedirs(streams, exist_ok=True)
+        args += ['--stream-rules', ':~ts json:buffer',
+                 '--stream-rules', ':~ts video/:tee',
+                 '--stream-rules', ':~ts application/octet-stream:tee',
+                 '--set', f'stream_tee_spill={streams}']
+        if self.offline:
+            args += ['--set', 'mock_offline=true']
         mitmproxy_run(web.master.WebMaster, cmdline.mitmweb,
-                      ['--host', self.host], extend_addons=addons)
+                      args, extend_addons=addons)
         # 关闭浏览器代理
         self.browser_proxy_off()
         click.secho(f'softmock已安全关闭', fg='green')
@@ -1 +1,3 @@
 from .host import Host
+from .retention import Retention
+from .websocket import WebSocketMock
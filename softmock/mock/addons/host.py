@@ -1,11 +1,16 @@
 import sqlite3
 import json
-import base64
 from mitmproxy import ctx
+from mitmproxy import log
 import mitmproxy
-from urllib import parse
 from functools import wraps
 from softmock.database import database
+from softmock import variants
+from softmock import blobs
+from softmock import contents
+from softmock import profiles
+from mitmproxy.utils.timerwheel import TimerWheel
+from mitmproxy.net import websocket
 
 null = None
 false = False
@@ -15,6 +20,9 @@ undefined = None
 class Host:
     def __init__(self, host, conn) -> None:
         self.host = host
+        self.sampler = log.Sampler(100)
+        # 按配置延迟返回的请求，到时间后由时间轮继续
+        self.wheel = TimerWheel()
 
     def exclude_host(fn):
         """
@@ -26,12 +34,45 @@ class Host:
 
         return wrapper
 
-    # @exclude_host
-    # def http_connect(self, flow: mitmproxy.http.HTTPFlow):
-    #     '''
-    #     在应用层，dns查询之前
-    #     '''
-    #     print(flow.server_conn.__dict__)
+    def load(self, loader):
+        loader.add_option(
+            "mock_offline", bool, False,
+            "有mock数据的host不再连接真实服务器，没有mock的请求直接返回404"
+        )
+        loader.add_option(
+            "mock_log_sample", int, 100,
+            "命中mock时输出debug日志，每个url第一次和之后每N次输出一条，0为不输出"
+        )
+        loader.add_option(
+            "mock_profiles", bool, True,
+            "按mock配置的延迟、带宽和错误率返回，关闭后命中时直接返回"
+        )
+
+    def configure(self, updated):
+        if "mock_log_sample" in updated:
+            self.sampler = log.Sampler(ctx.options.mock_log_sample)
+
+    def has_mocks(self, host):
+        '''
+        host下是否有启用的mock
+        '''
+        db = sqlite3.connect(database)
+        try:
+            row = db.execute(
+                "select 1 from Mock1 where status='1' and (url like ? or url like ?) limit 1",
+                (f'http://{host}/%', f'https://{host}/%')).fetchone()
+        finally:
+            db.close()
+        return row is not None
+
+    @exclude_host
+    def http_connect(self, flow: mitmproxy.http.HTTPFlow):
+        '''
+        在应用层，dns查询之前
+        离线模式下整个连接都由mock返回，不用连接服务器，证书直接按SNI生成
+        '''
+        if ctx.options.mock_offline and self.has_mocks(flow.request.host):
+            flow.metadata['offline'] = True
 
     @exclude_host
     def request(self, flow: mitmproxy.http.HTTPFlow):
@@ -39,41 +80,80 @@ class Host:
         网络层
         dns查询之后
         '''
+        # WebSocket握手由WebSocketMock处理
+        if websocket.check_handshake(flow.request.headers):
+            return None
         url = flow.request.scheme + '://' + \
             flow.request.host + \
             flow.request.path.split('?')[0] + ' ' + flow.request.method
         db = sqlite3.connect(database)
         cursor = db.cursor()
-        sql = f"select * from Mock1 where url='{url}' and status='1'"
-        print(f'拦截{url}到本地')
-        result = cursor.execute(sql)
-        js = [i for i in cursor.execute(sql)]
+        sql = f"select `detail`, profile from Mock1 where url=? and status='1'"
+        js = [i for i in cursor.execute(sql, (url, ))]
         if len(js) > 0:
-            result = json.loads(parse.unquote(js[0][1]))
+            # 每个请求都输出日志在压力大时很慢，只抽样输出
+            if ctx.log.wants('debug') and self.sampler(url):
+                ctx.log.debug('拦截%s到本地', url)
+            result = json.loads(contents.unquote(js[0][0]))
             # flow.response = result['data']['response']
             response = result['data'].get('response', None)
             if not response:
                 return None
-            headers = {}
-            try:
-                for header in response['headers']:
-                    headers[header[0]] = header[1]
-            except:
-                pass
-            content_type = headers.get(
-                'content-type', None) or headers.get('Content-Type', None)
-            html = response['html']
-            if 'image' in content_type or 'video' in content_type:
-                html = base64.b64decode(html.encode())
+            headers = variants.response_headers(response)
+            blob = blobs.load(cursor, url)
+            # 请求部分内容时只能从文件返回，压缩后的内容不支持Range
+            if blob and 'range' in flow.request.headers:
+                enc, body = None, None
+            else:
+                enc, body = variants.load(
+                    cursor, url, flow.request.headers.get('accept-encoding', ''))
+            if enc:
+                flow.response = mitmproxy.http.HTTPResponse.make(
+                    response['status_code'] or 200,
+                    b'',
+                    headers
+                )
+                flow.response.raw_content = body
+                flow.response.headers['content-encoding'] = enc
+                flow.response.headers['content-length'] = str(len(body))
+            elif blob:
+                # 大的内容从文件流式返回，不用每次解码到内存
+                flow.response = blobs.response(
+                    flow.request, response['status_code'] or 200, headers, blob)
+            else:
+                # 只有没有压缩版本时才需要原始内容
+                contents.resolve(cursor, response)
+                flow.response = mitmproxy.http.HTTPResponse.make(
+                    response['status_code'] or 200,  # (optional) status code
+                    variants.response_content(response, headers),  # (optional) content
+                    headers  # (optional) headers
+                )
+            flow.response.headers['vary'] = 'Accept-Encoding'
+            if js[0][1] and ctx.options.mock_profiles:
+                self.apply_profile(flow, url, js[0][1])
+        elif ctx.options.mock_offline and self.has_mocks(flow.request.host):
             flow.response = mitmproxy.http.HTTPResponse.make(
-                response['status_code'] or 200,  # (optional) status code
-                html,  # (optional) content
-                headers  # (optional) headers
+                404,
+                f'softmock: {url} 没有mock数据',
+                {'Content-Type': 'text/plain; charset=utf-8'}
             )
 
         cursor.close()
         db.close()
 
+    def apply_profile(self, flow, url, text):
+        try:
+            profile = profiles.parse(text)
+        except profiles.ProfileError as e:
+            ctx.log.warn(f'{url}的配置有误，直接返回：{e}')
+            return
+        if profile:
+            profiles.apply(flow, profile, self.wheel)
+
+    def done(self):
+        # 退出时还在延迟的请求直接返回
+        self.wheel.fire_all()
+
     def sentry():
         pass
 
@@ -0,0 +1,53 @@
+import asyncio
+import functools
+from mitmproxy import ctx
+from softmock import retention
+from softmock.database import database
+
+
+class Retention:
+    '''
+    后台定时按保留策略清理数据库，并回收空闲页
+    '''
+
+    def __init__(self) -> None:
+        self.started = False
+
+    def load(self, loader):
+        loader.add_option(
+            "mock_max_age", int, 0,
+            "mock数据保留的天数，0为不限制"
+        )
+        loader.add_option(
+            "mock_max_rows_per_host", int, 0,
+            "每个host最多保留的mock条数，0为不限制"
+        )
+        loader.add_option(
+            "mock_retention_interval", int, 600,
+            "清理数据库的间隔秒数，0为不清理"
+        )
+        loader.add_option(
+            "mock_vacuum_pages", int, 256,
+            "每次清理最多回收的空闲页数，0为全部回收"
+        )
+
+    def running(self):
+        if not self.started and ctx.options.mock_retention_interval:
+            self.started = True
+            asyncio.get_event_loop().create_task(self._run())
+
+    async def _run(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            await asyncio.sleep(ctx.options.mock_retention_interval)
+            # sqlite的操作放在线程池中，避免阻塞事件循环
+            result = await loop.run_in_executor(None, functools.partial(
+                retention.compact,
+                database,
+                max_age=ctx.options.mock_max_age,
+                max_rows_per_host=ctx.options.mock_max_rows_per_host,
+                full=False,
+                pages=ctx.options.mock_vacuum_pages,
+            ))
+            if result['deleted']:
+                ctx.log.info(f"清理了{result['deleted']}条过期的mock数据")
@@ -0,0 +1,177 @@
+import asyncio
+import sqlite3
+import time
+import mitmproxy
+from mitmproxy import ctx
+from mitmproxy.net import websocket
+from softmock.database import database
+from softmock import frames
+
+
+def handshake_url(request):
+    return request.scheme + '://' + request.host + \
+        request.path.split('?')[0] + ' ' + request.method
+
+
+class Recording:
+    def __init__(self, url, start) -> None:
+        self.url = url
+        self.db = sqlite3.connect(database)
+        self.seq = 0
+        # 已经录制的客户端消息条数
+        self.clients = 0
+        self.last = start
+        # 还没有写入数据库的消息，攒够一批或者隔一段时间写入一次
+        self.pending = []
+        self.flushed = start
+
+    def flush(self):
+        '''
+        每批消息在一个很短的事务里写入，事务不会跨过网络读写，不会一直占着数据库的写锁
+        数据库被其他连接锁住时保留这批消息，下次再写
+        '''
+        if not self.pending:
+            return
+        try:
+            frames.append_many(self.db, self.url, self.pending)
+            self.db.commit()
+        except sqlite3.OperationalError as e:
+            self.db.rollback()
+            ctx.log.warn(f'WebSocket消息写入失败，稍后重试：{e}')
+            return
+        self.pending = []
+        self.flushed = time.time()
+
+
+class Replay:
+    def __init__(self, url, rows) -> None:
+        self.url = url
+        self.rows = rows
+        # 回放时客户端已经发送的消息条数
+        self.clients = 0
+        self.received = asyncio.Event()
+        self.task = None
+
+
+class WebSocketMock:
+    '''
+    录制WebSocket的消息，有录制数据并且mock启用时，按握手的url回放服务端的消息
+    消息在websocket_message时就写入数据库，配合websocket_message_limit，长连接占用的内存不会一直增长
+    '''
+    # 每录制这么多条消息，或者距离上次写入超过这么多秒，写入一次
+    COMMIT_EVERY = 100
+    COMMIT_INTERVAL = 1.0
+
+    def __init__(self) -> None:
+        self.recordings = {}
+        self.replays = {}
+
+    def load(self, loader):
+        loader.add_option(
+            "mock_ws_max_frames", int, 10000,
+            "每个WebSocket连接最多录制的消息条数，0为不限制"
+        )
+        loader.add_option(
+            "mock_ws_replay", str, "timing",
+            "WebSocket回放方式，timing按录制时的间隔发送，fast尽快发送",
+            choices=["timing", "fast"]
+        )
+
+    def request(self, flow: mitmproxy.http.HTTPFlow):
+        '''
+        有录制的消息时，握手直接由本地返回，不连接服务器
+        '''
+        if flow.response or ctx.options.host not in flow.request.host:
+            return
+        if not websocket.check_handshake(flow.request.headers):
+            return
+        url = handshake_url(flow.request)
+        db = sqlite3.connect(database)
+        try:
+            enabled = db.execute(
+                "select 1 from Mock1 where url=? and status='1'", (url, )).fetchone()
+            if not enabled or not frames.exists(db, url):
+                return
+        finally:
+            db.close()
+        protocol = websocket.get_protocol(flow.request.headers)
+        if protocol:
+            # 客户端支持多个子协议时选第一个
+            protocol = protocol.split(',')[0].strip()
+        flow.response = mitmproxy.http.HTTPResponse.make(
+            101,
+            b'',
+            websocket.server_handshake_headers(
+                websocket.get_client_key(flow.request.headers), protocol)
+        )
+        flow.response.headers.pop('content-length', None)
+        flow.metadata['softmock_websocket'] = url
+
+    def websocket_start(self, flow):
+        handshake = flow.handshake_flow
+        url = handshake.metadata.get('softmock_websocket', None)
+        if url:
+            db = sqlite3.connect(database)
+            try:
+                rows = frames.load(db, url)
+            finally:
+                db.close()
+            replay = Replay(url, rows)
+            replay.task = asyncio.ensure_future(self.replay(flow, replay))
+            self.replays[flow.id] = replay
+            return
+        if ctx.options.host not in handshake.request.host:
+            return
+        url = handshake_url(handshake.request)
+        # 同一个url同时只录制一个连接
+        if any(i.url == url for i in self.recordings.values()):
+            return
+        recording = Recording(url, time.time())
+        # 新的录制替换旧的，马上提交，不能在录制期间一直占着写锁
+        frames.delete(recording.db, url)
+        recording.db.commit()
+        self.recordings[flow.id] = recording
+
+    def websocket_message(self, flow):
+        message = flow.messages[-1]
+        replay = self.replays.get(flow.id, None)
+        if replay and message.from_client:
+            replay.clients += 1
+            replay.received.set()
+        recording = self.recordings.get(flow.id, None)
+        if not recording:
+            return
+        if ctx.options.mock_ws_max_frames and recording.seq >= ctx.options.mock_ws_max_frames:
+            return
+        recording.pending.append((
+            recording.seq, message.from_client, recording.clients,
+            message.timestamp - recording.last, message.content))
+        recording.seq += 1
+        recording.last = message.timestamp
+        if message.from_client:
+            recording.clients += 1
+        if len(recording.pending) >= self.COMMIT_EVERY or time.time() - recording.flushed >= self.COMMIT_INTERVAL:
+            recording.flush()
+
+    def websocket_end(self, flow):
+        recording = self.recordings.pop(flow.id, None)
+        if recording:
+            recording.flush()
+            recording.db.close()
+        replay = self.replays.pop(flow.id, None)
+        if replay and replay.task:
+            replay.task.cancel()
+
+    async def replay(self, flow, replay):
+        for from_client, after, delay, content in replay.rows:
+            if from_client:
+                continue
+            # 录制时这条消息是在客户端发了after条消息之后才收到的
+            while replay.clients < after:
+                replay.received.clear()
+                await replay.received.wait()
+            if ctx.options.mock_ws_replay == 'timing' and delay > 0:
+                await asyncio.sleep(delay)
+            if flow.ended:
+                return
+            flow.inject_message(flow.client_conn, content)
@@ -11,7 +11,8 @@ class Mock:
 
     def start(self):
         if '--host' in self.params:
-            self.proxy = Proxy(self.params['--host'])
+            self.proxy = Proxy(self.params['--host'],
+                               self.params.get('--offline', False))
             self.proxy.run()
             return
         click.secho('exec error 缺少参数--host', fg='red', )
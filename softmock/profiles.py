@@ -0,0 +1,184 @@
+import functools
+import json
+import random
+import mitmproxy
+from mitmproxy import controller
+from mitmproxy.utils import human
+from mitmproxy.http import FileBody, ThrottledBody
+
+# 每条mock可以配置返回时的网络状况，用于模拟真实的服务器，保存在Mock1.profile中，为json
+#     latency: 延迟的毫秒数
+#         200                            固定延迟
+#         [100, 500]                     均匀分布
+#         {"mean": 200, "stddev": 50}    正态分布
+#         {"median": 200, "sigma": 1}    对数正态分布，少数请求很慢，和真实的服务器接近
+#     bandwidth: 每秒返回的字节数，支持k/m后缀
+#     error_rate: 返回错误的比例，0到1
+#     error: 返回的错误，状态码或者"reset"（直接断开连接），默认503
+# 延迟期间请求不占用事件循环，由时间轮统一计时，到时间后再返回
+
+
+class ProfileError(ValueError):
+    pass
+
+
+@functools.lru_cache(maxsize=1024)
+def parse(text):
+    '''
+    解析并检查Mock1.profile，返回dict，没有配置时返回None
+    同样的配置只解析一次
+    '''
+    if not text:
+        return None
+    try:
+        profile = json.loads(text)
+    except ValueError as e:
+        raise ProfileError(f'配置不是json：{e}')
+    if not profile:
+        return None
+    if not isinstance(profile, dict):
+        raise ProfileError('配置必须是json对象')
+    unknown = set(profile) - {'latency', 'bandwidth', 'error_rate', 'error'}
+    if unknown:
+        raise ProfileError(f'不支持的配置：{", ".join(sorted(unknown))}')
+    latency = profile.get('latency', None)
+    if latency is not None:
+        # 检查分布的参数，顺便确认能取到值
+        try:
+            if sample(latency) < 0:
+                raise ProfileError('延迟不能是负数')
+        except (TypeError, ValueError, KeyError, IndexError):
+            raise ProfileError(f'不支持的延迟：{latency}')
+    if 'bandwidth' in profile:
+        try:
+            profile['bandwidth'] = human.parse_size(str(profile['bandwidth']))
+        except ValueError:
+            raise ProfileError(f'不支持的带宽：{profile["bandwidth"]}')
+        if profile['bandwidth'] <= 0:
+            raise ProfileError('带宽必须大于0')
+    error_rate = profile.get('error_rate', 0)
+    if not isinstance(error_rate, (int, float)) or not 0 <= error_rate <= 1:
+        raise ProfileError('error_rate必须在0到1之间')
+    error = profile.setdefault('error', 503)
+    if error != 'reset' and not (isinstance(error, int) and 100 <= error <= 599):
+        raise ProfileError(f'不支持的错误：{error}')
+    return profile
+
+
+def dumps(profile):
+    '''
+    检查后返回写入数据库的内容，profile可以是dict或者json字符串，空的配置返回None
+    '''
+    if isinstance(profile, dict):
+        profile = json.dumps(profile)
+    if not profile or parse(profile) is None:
+        return None
+    return profile
+
+
+def sample(latency):
+    '''
+    按配置取一次延迟的毫秒数，结果不会小于0
+    '''
+    if isinstance(latency, (int, float)):
+        return latency
+    if isinstance(latency, list):
+        low, high = latency
+        if not 0 <= low <= high:
+            raise ValueError(latency)
+        return random.uniform(low, high)
+    if 'mean' in latency:
+        return max(0.0, random.gauss(latency['mean'], latency.get('stddev', 0)))
+    if 'median' in latency:
+        if latency['median'] <= 0:
+            raise ValueError(latency)
+        return random.lognormvariate(0, latency.get('sigma', 1)) * latency['median']
+    raise KeyError(latency)
+
+
+def load(cursor, url):
+    row = cursor.execute(
+        "select profile from Mock1 where url=?", (url, )).fetchone()
+    return row[0] if row else None
+
+
+def save(cursor, url, profile):
+    cursor.execute(
+        "update Mock1 set profile=? where url=?", (dumps(profile), url))
+
+
+def save_host(cursor, host, profile):
+    '''
+    给host下所有的mock设置同样的配置，返回修改的条数
+    '''
+    cursor.execute(
+        "update Mock1 set profile=? where url like ?", (dumps(profile), f'%{host}%'))
+    return cursor.rowcount
+
+
+def ensure_schema(cursor):
+    columns = [i[1] for i in cursor.execute("pragma table_info(Mock1)")]
+    if 'profile' not in columns:
+        cursor.execute("alter table Mock1 add column profile TEXT")
+
+
+def release(flow):
+    '''
+    延迟结束，让连接继续返回响应
+    '''
+    if flow.reply.state != 'taken':
+        # 已经被关闭了
+        return
+    if not flow.reply.has_message:
+        flow.reply.ack()
+    flow.reply.commit()
+
+
+def reset(flow):
+    if flow.killable:
+        flow.kill()
+    else:
+        release(flow)
+
+
+def apply(flow, profile, wheel):
+    '''
+    按配置修改mock的响应，需要延迟时暂停返回，由时间轮到时间后继续
+    '''
+    if profile.get('error_rate', 0) and random.random() < profile['error_rate']:
+        if profile['error'] == 'reset':
+            done = reset
+        else:
+            done = release
+            flow.response = mitmproxy.http.HTTPResponse.make(
+                profile['error'],
+                f'softmock: 模拟的错误 {profile["error"]}',
+                {'Content-Type': 'text/plain; charset=utf-8'}
+            )
+    else:
+        done = release
+        if profile.get('bandwidth', None):
+            throttle(flow.response, profile['bandwidth'])
+    delay = sample(profile['latency']) / 1000 if profile.get('latency', None) is not None else 0
+    # 被其他插件拦截的请求和回放的请求不延迟
+    if delay > 0 and flow.reply.state == 'start' and not isinstance(flow.reply, controller.DummyReply):
+        flow.reply.take()
+        wheel.call_later(delay, done, flow)
+    elif done is reset:
+        reset(flow)
+
+
+def throttle(response, rate):
+    '''
+    按带宽限速返回内容
+    '''
+    if isinstance(response.stream, FileBody):
+        source = response.stream
+    elif response.raw_content:
+        source = response.raw_content
+        response.headers['content-length'] = str(len(source))
+        # 内容由连接分段发送
+        response.data.content = None
+    else:
+        return
+    response.stream = ThrottledBody(source, rate)
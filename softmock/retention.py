@@ -0,0 +1,159 @@
+import os
+import json
+import sqlite3
+import time
+from collections import defaultdict
+from urllib import parse
+from softmock.database import database
+from softmock import variants
+from softmock import blobs
+from softmock import frames
+from softmock import contents
+from softmock import profiles
+
+DAY = 24 * 60 * 60
+
+# 记录每条数据最后一次写入的时间，用于按时间清理
+TRIGGERS = [
+    """create trigger if not exists Mock1_inserted after insert on Mock1
+    begin
+        update Mock1 set `updated`=cast(strftime('%s', 'now') as real) where rowid=new.rowid;
+    end""",
+    """create trigger if not exists Mock1_updated after update of `detail`, `status` on Mock1
+    begin
+        update Mock1 set `updated`=cast(strftime('%s', 'now') as real) where rowid=new.rowid;
+    end""",
+]
+
+
+def ensure_schema(db):
+    '''
+    给旧的数据库补上updated字段和触发器
+    '''
+    cursor = db.cursor()
+    cursor.execute(variants.CREATE_TABLE)
+    cursor.execute(blobs.CREATE_TABLE)
+    cursor.execute(frames.CREATE_TABLE)
+    columns = [i[1] for i in cursor.execute("pragma table_info(Mock1)")]
+    if 'updated' not in columns:
+        cursor.execute("alter table Mock1 add column `updated` REAL")
+    for sql in TRIGGERS:
+        cursor.execute(sql)
+    # 按url替换mock时不用扫描全表
+    cursor.execute("create index if not exists Mock1_url on Mock1(url)")
+    # 没有记录时间的数据，取录制时的时间，取不到就从现在开始算
+    rows = [i for i in cursor.execute(
+        "select rowid, `detail` from Mock1 where `updated` is null")]
+    now = time.time()
+    for rowid, detail in rows:
+        try:
+            updated = json.loads(contents.unquote(detail))[
+                'data']['request']['timestamp_start'] or now
+        except Exception:
+            updated = now
+        cursor.execute(
+            "update Mock1 set `updated`=? where rowid=?", (updated, rowid))
+    contents.ensure_schema(cursor)
+    profiles.ensure_schema(cursor)
+    db.commit()
+    cursor.close()
+
+
+def enable_incremental_vacuum(db):
+    '''
+    auto_vacuum 只能在建表之前或者VACUUM时修改，已有的数据库需要整理一次
+    '''
+    mode = db.execute("pragma auto_vacuum").fetchone()[0]
+    if mode != 2:
+        db.execute("pragma auto_vacuum=INCREMENTAL")
+        db.execute("vacuum")
+
+
+def url_host(url):
+    '''
+    url的格式为 "scheme://host/path METHOD"
+    '''
+    return parse.urlsplit(url.split(' ')[0]).hostname or ''
+
+
+def prune(db, max_age=None, max_rows_per_host=None):
+    '''
+    按保留策略删除数据，返回删除的条数
+    max_age: 保留的天数
+    max_rows_per_host: 每个host最多保留的条数
+    '''
+    cursor = db.cursor()
+    deleted = 0
+    if max_age:
+        cursor.execute("delete from Mock1 where `updated` < ?",
+                       (time.time() - max_age * DAY, ))
+        deleted += cursor.rowcount
+    if max_rows_per_host:
+        by_host = defaultdict(list)
+        # 按最后写入时间倒序，排在前面的保留
+        for rowid, url in cursor.execute(
+                "select rowid, url from Mock1 order by `updated` desc, rowid desc").fetchall():
+            by_host[url_host(url or '')].append(rowid)
+        stale = set()
+        for rowids in by_host.values():
+            stale.update(rowids[max_rows_per_host:])
+        cursor.executemany("delete from Mock1 where rowid=?",
+                           [(i, ) for i in stale])
+        deleted += len(stale)
+    if deleted:
+        # 删除已经没有对应mock的压缩版本
+        cursor.execute(
+            "delete from MockBody where url not in (select url from Mock1)")
+        cursor.execute(
+            "delete from MockFrame where url not in (select url from Mock1)")
+    # 写入后没有被mock引用的内容
+    cursor.execute("delete from MockContent where refs<=0")
+    db.commit()
+    cursor.close()
+    return deleted
+
+
+def stats(db, path=database):
+    '''
+    数据库文件大小、空闲页以及每个host的数据条数
+    '''
+    page_size = db.execute("pragma page_size").fetchone()[0]
+    rows_per_host = defaultdict(int)
+    for url, in db.execute("select url from Mock1"):
+        rows_per_host[url_host(url or '')] += 1
+    return {
+        'file_size': os.path.getsize(path),
+        'page_size': page_size,
+        'page_count': db.execute("pragma page_count").fetchone()[0],
+        'free_pages': db.execute("pragma freelist_count").fetchone()[0],
+        'rows_per_host': dict(rows_per_host),
+    }
+
+
+def incremental_vacuum(db, pages=None):
+    '''
+    回收空闲页，pages为空时回收全部
+    '''
+    # execute每次只会回收一页，executescript才会执行完整个pragma
+    db.executescript(f"pragma incremental_vacuum({int(pages or 0)});")
+
+
+def compact(path=database, max_age=None, max_rows_per_host=None, full=True, pages=None):
+    '''
+    清理过期数据并回收空闲页，返回清理后的统计信息
+    full为False时不会做耗时的整库VACUUM，适合在后台定时执行
+    '''
+    db = sqlite3.connect(path)
+    try:
+        ensure_schema(db)
+        if full:
+            enable_incremental_vacuum(db)
+        deleted = prune(db, max_age, max_rows_per_host)
+        incremental_vacuum(db, pages)
+        result = stats(db, path)
+        result['deleted'] = deleted
+        # 清理已经没有mock引用的文件
+        result['removed_blobs'] = blobs.gc(db)
+        return result
+    finally:
+        db.close()
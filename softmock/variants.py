@@ -0,0 +1,172 @@
+import base64
+import json
+import sqlite3
+import brotli
+from mitmproxy import http
+from mitmproxy.net.http import encoding
+from softmock import blobs
+
+# 服务端的压缩格式偏好，客户端权重相同时靠前的优先
+ENCODINGS = ('br', 'zstd', 'gzip')
+# 录制时压缩，质量5比默认的11快约100倍，结果大两到三成
+BROTLI_QUALITY = 5
+
+
+def encode_brotli(body):
+    return brotli.compress(body, quality=BROTLI_QUALITY)
+
+
+ENCODERS = {
+    'br': encode_brotli,
+    'zstd': encoding.encode_zstd,
+    'gzip': encoding.encode_gzip,
+}
+# 太小的内容压缩没有意义
+MIN_SIZE = 1024
+
+CREATE_TABLE = "create table if not exists MockBody (url TEXT, encoding TEXT, body BLOB, primary key (url, encoding))"
+
+
+def response_headers(response):
+    '''
+    录制时的压缩方式和长度与返回的内容无关，返回时按协商结果重新设置
+    '''
+    headers = {}
+    try:
+        for header in response['headers']:
+            if header[0].lower() not in ('content-encoding', 'content-length'):
+                headers[header[0]] = header[1]
+    except:
+        pass
+    return headers
+
+
+def is_binary(headers):
+    content_type = headers.get(
+        'content-type', None) or headers.get('Content-Type', None) or ''
+    return 'image' in content_type or 'video' in content_type
+
+
+def response_content(response, headers):
+    '''
+    mock中保存的是解码后的内容，图片和视频是base64
+    '''
+    html = response['html'] or ''
+    if is_binary(headers):
+        return base64.b64decode(html.encode())
+    return html
+
+
+def encode(detail):
+    '''
+    生成返回给客户端的原始内容和各个压缩版本，只用到CPU，可以放到线程池中
+    返回 (body, [(encoding, 压缩后的内容)])，不是有效的响应时body为None
+    '''
+    try:
+        if isinstance(detail, str):
+            detail = json.loads(detail)
+        response = detail['data'].get('response', None)
+        if not response:
+            return None, []
+        headers = response_headers(response)
+        # 按content-type中的字符集转换成bytes，和命中时直接返回的内容一致
+        body = http.HTTPResponse.make(
+            200, response_content(response, headers), headers).raw_content
+    except Exception:
+        return None, []
+    # 图片和视频本身已经压缩过了，太小的内容压缩没有意义
+    if is_binary(headers) or len(body) < MIN_SIZE:
+        return body, []
+    return body, [(enc, ENCODERS[enc](body)) for enc in ENCODINGS]
+
+
+def store(cursor, url, body, encoded):
+    delete(cursor, url)
+    if body is None:
+        return
+    blobs.save(cursor, url, body)
+    cursor.executemany(
+        "insert into MockBody (url, encoding, body) values (?, ?, ?)",
+        [(url, enc, data) for enc, data in encoded]
+    )
+
+
+def save(cursor, url, detail):
+    '''
+    保存mock时把响应内容压缩好，命中时直接返回，大的内容另外存成文件
+    detail可以是dict或者json字符串
+    '''
+    body, encoded = encode(detail)
+    store(cursor, url, body, encoded)
+
+
+def refresh(database, url, detail, digest):
+    '''
+    在线程池中重新生成url的压缩版本，digest是生成时Mock1中响应内容的摘要
+    生成期间响应又变了就放弃，由之后的那次生成
+    '''
+    body, encoded = encode(detail)
+    db = sqlite3.connect(database)
+    try:
+        # 先拿到写锁再检查，检查之后响应不会再被修改
+        db.execute("begin immediate")
+        row = db.execute(
+            "select digest from Mock1 where url=?", (url, )).fetchone()
+        if row and row[0] == digest:
+            store(db.cursor(), url, body, encoded)
+        db.commit()
+    finally:
+        db.close()
+
+
+def delete(cursor, url):
+    cursor.execute("delete from MockBody where url=?", (url, ))
+    blobs.delete(cursor, url)
+
+
+def negotiate(accept_encoding, available):
+    '''
+    根据Accept-Encoding选择压缩格式，没有合适的返回None，即不压缩
+    '''
+    if not accept_encoding or not available:
+        return None
+    weights = {}
+    for item in accept_encoding.split(','):
+        name, _, params = item.strip().partition(';')
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        weights[name.strip().lower()] = q
+    default = weights.get('*', 0.0)
+    best = None
+    best_q = weights.get('identity', max(default, 0.001))
+    for enc in ENCODINGS:
+        if enc not in available:
+            continue
+        q = weights.get(enc, default)
+        if q > 0 and q > best_q:
+            best, best_q = enc, q
+    return best
+
+
+def load(cursor, url, accept_encoding):
+    '''
+    返回协商后的 (encoding, body)，没有可用的压缩版本时返回 (None, None)
+    '''
+    # 先只查有哪些压缩版本，协商后再读取选中的一个
+    available = {
+        i[0] for i in cursor.execute(
+            "select encoding from MockBody where url=?", (url, ))
+    }
+    enc = negotiate(accept_encoding, available)
+    if enc is None:
+        return None, None
+    row = cursor.execute(
+        "select body from MockBody where url=? and encoding=?", (url, enc)).fetchone()
+    if row is None:
+        return None, None
+    return enc, row[0]